@@ -6,7 +6,8 @@ from flask_wtf import FlaskForm
 from wtforms.fields import SelectField
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from flask import render_template, request, redirect, url_for
-from src.create_db import Predictions, BikeManager
+from src.create_db import Predictions, Stations, BikeManager
+from src.forecast_serving import ForecastCache
 
 # Set up randomly generated number for WTF forms syntax
 randomly_generated_number = os.urandom(32)
@@ -25,6 +26,13 @@ logger.debug('Web app log')
 # Initialize the database session
 bike_manager = BikeManager(app)
 
+# In 'lazy' mode, forecasts are computed from the stations' forecast states when
+# first requested instead of being read from the predictions table
+forecast_cache = None
+if app.config["PREDICTIONS_MODE"] == 'lazy':
+    forecast_cache = ForecastCache(app.config["FORECAST_STATE_PATH"],
+                                   maxsize=app.config["FORECAST_CACHE_SIZE"])
+
 
 # Create forms for webpage
 
@@ -45,16 +53,26 @@ def selection():
     """
     try:
         form = Form(meta={'crsf': False})
-        form.stations.choices = [i[0] for i in bike_manager.session.query(Predictions.name).distinct()]
-        form.dates.choices = [i[0] for i in bike_manager.session.query(Predictions.date).distinct().filter(
-            Predictions.date > '2021-06-06')]
-        form.hours.choices = [i[0] for i in bike_manager.session.query(Predictions.hour).distinct()]
+        if forecast_cache is not None:
+            form.stations.choices = [i[0] for i in bike_manager.session.query(Stations.name).filter(
+                Stations.station_id.in_(forecast_cache.station_ids))]
+            form.dates.choices = [date for date in forecast_cache.dates() if date > '2021-06-06']
+            form.hours.choices = list(range(24))
+        else:
+            form.stations.choices = [i[0] for i in bike_manager.session.query(Predictions.name).distinct()]
+            form.dates.choices = [i[0] for i in bike_manager.session.query(Predictions.date).distinct().filter(
+                Predictions.date > '2021-06-06')]
+            form.hours.choices = [i[0] for i in bike_manager.session.query(Predictions.hour).distinct()]
         logger.debug("Selection page accessed")
 
         if request.method == 'POST':
             station = form.data['stations']
             date = form.data['dates']
             hour = form.data['hours']
+            if forecast_cache is not None:
+                station_id = bike_manager.session.query(Stations.station_id).filter_by(name=station).first()[0]
+                results = forecast_cache.predict(station_id, date, hour)
+                return render_template('response.html', station=station, date=date, hour=hour, results=results)
             results = [i[0] for i in bike_manager.session.query(Predictions.pred_num_bikes).filter_by(name=station,
                                                                                                       date=date,
                                                                                                       hour=hour
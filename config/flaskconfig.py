@@ -8,6 +8,12 @@ HOST = "0.0.0.0"
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 100
 
+# 'table' reads predictions from the database; 'lazy' computes them on demand
+# from the forecast states written by the model run
+PREDICTIONS_MODE = os.environ.get('PREDICTIONS_MODE', 'table')
+FORECAST_STATE_PATH = os.environ.get('FORECAST_STATE_PATH', 'data/forecast_states.json')
+FORECAST_CACHE_SIZE = int(os.environ.get('FORECAST_CACHE_SIZE', 256))
+
 # Connection string
 DB_HOST = os.environ.get('MYSQL_HOST')
 DB_PORT = os.environ.get('MYSQL_PORT')
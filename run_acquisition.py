@@ -25,10 +25,15 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Acquire stations and trips data from the web')
     parser.add_argument('--config', '-c', default=config_obj,
                         help='path to yaml file with configurations')
-    parser.add_argument("--threads", default=config_obj['download_trips_data']['threads'],
-                        help="s3 bucket name")
-    parser.add_argument("--sleep_time", default=config_obj['download_trips_data']['sleep_time'],
-                        help="s3 bucket name")
+    parser.add_argument("--threads", type=int,
+                        default=config_obj['download_trips_data']['threads'],
+                        help="number of threads for downloading trips data")
+    parser.add_argument("--workers", type=int,
+                        default=config_obj['download_trips_data']['workers'],
+                        help="number of processes for aggregating trips data")
+    parser.add_argument("--retries", type=int,
+                        default=config_obj['download_trips_data']['retries'],
+                        help="number of download attempts per trips data file")
     parser.add_argument("--s3_bucket", default=connection_config.S3_BUCKET,
                         help="s3 bucket name")
     parser.add_argument("--engine_string", default=connection_config.SQLALCHEMY_DATABASE_URI,
@@ -20,7 +20,8 @@ def acquire_data(arguments):
             s3_bucket (str): S3 bucket name passed in as a string
             engine_string (str): SQLAlchemy engine string
             threads (int): Number of threads for multithreaded download of trips data
-            sleep_time (int): Number of seconds to sleep while multithread download occurs
+            workers (int): Number of processes for aggregating trips data
+            retries (int): Number of attempts per file for the trips data download
 
     Returns: None--all data sets saved to paths specified in arguments and config object
 
@@ -43,14 +44,17 @@ def acquire_data(arguments):
     download_trips_data(month_start=config['download_trips_data']['month_start'],
                         month_end=config['download_trips_data']['month_end'],
                         zip_data_path=config['download_trips_data']['zip_data_path'],
-                        csv_data_path=config['download_trips_data']['csv_data_path'],
                         url_stem=config['download_trips_data']['url_stem'],
                         suffix_1=config['download_trips_data']['suffix_1'],
                         suffix_2=config['download_trips_data']['suffix_2'],
-                        label_chunk=config['download_trips_data']['label_chunk'],
                         threads=arguments.threads,
-                        sleep_time=arguments.sleep_time,
+                        workers=arguments.workers,
+                        chunksize=config['download_trips_data']['chunksize'],
+                        retries=arguments.retries,
+                        backoff=config['download_trips_data']['backoff'],
+                        timeout=config['download_trips_data']['timeout'],
                         output_path=config['download_trips_data']['output_path'],
+                        storage_format=config['storage_format'],
                         s3_bucket=arguments.s3_bucket,
                         s3_directory=config['download_trips_data']['s3_directory'])
     logger.info("Success! Downloaded trips data locally to '%s' and on s3 to '%s'",
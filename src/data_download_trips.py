@@ -1,25 +1,408 @@
 """ Downloads Citibikes trips data for the YYYYMM periods specified in config.py"""
 import os
-from time import sleep
+import re
+import time
+import json
+import hashlib
 import logging
-import glob
 import sys
 import zipfile
-import shutil
+import multiprocessing
 from pathlib import Path
-from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import requests
+import numpy as np
 import pandas as pd
 from src.helper_months import iter_months
 from src.helper_s3 import upload_to_s3
+from src.helper_io import table_path, write_table
 
 # Logging
 logger = logging.getLogger(__name__)
 
+# Size of each streamed block written to disk while downloading
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
 
-def download_trips_data(month_start, month_end, zip_data_path, csv_data_path,
-                        url_stem, suffix_1, suffix_2, label_chunk,
-                        threads, sleep_time, output_path, s3_bucket, s3_directory):
+# Explicit timestamp layouts found in trips files published until 201612
+LEGACY_TIME_FORMATS = ['%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M']
+
+# Positions of the digits in an ISO "YYYY-MM-DD HH" timestamp prefix
+ISO_DIGIT_POSITIONS = [0, 1, 2, 3, 5, 6, 8, 9, 11, 12]
+
+# Number of low bits of a station-hour key holding the hour bucket
+FLOW_KEY_BITS = 32
+
+# Name of the archive cache manifest kept alongside the raw .zip files
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def file_md5(f_path):
+    """
+    Computes the MD5 checksum of a local file without reading it into memory at once
+
+    Args:
+        f_path (str): path of the file to hash
+
+    Returns:
+        (str): hexadecimal MD5 digest of the file
+    """
+    digest = hashlib.md5()
+    with open(f_path, 'rb') as file_location:
+        for box in iter(lambda: file_location.read(DOWNLOAD_CHUNK_BYTES), b''):
+            digest.update(box)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_path):
+    """
+    Reads the manifest describing the .zip files held in the local archive cache
+
+    Args:
+        manifest_path (str): path of the manifest .json file
+
+    Returns:
+        manifest (dict): cache entries keyed by YYYYMM (empty if no cache exists yet)
+    """
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning("Archive cache manifest %s is unreadable; "
+                       "all months will be verified again.", manifest_path)
+        return {}
+
+
+def write_manifest(manifest, manifest_path):
+    """
+    Atomically writes the archive cache manifest so that an interrupted
+    run never leaves a half-written manifest behind
+
+    Args:
+        manifest (dict): cache entries keyed by YYYYMM
+        manifest_path (str): path of the manifest .json file
+
+    Returns: none (writes manifest to manifest_path)
+
+    """
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def fetch_trips_zip(f_path, url, retries, backoff, timeout, cached=None):
+    """
+    Brings a single trips .zip file in the local archive cache up to date,
+    retrying with exponential backoff until the file is complete and
+    readable as a zip archive.
+
+    The remote ETag (or, if the server sends none, its size) is compared
+    with the cache entry first, and the download is skipped if the cached
+    file is unchanged and still matches its recorded checksum. Interrupted
+    downloads are kept as `<f_path>.part` and resumed with an HTTP Range
+    request as long as the remote ETag has not changed in the meantime.
+
+    Args:
+        f_path (str): local path to which the .zip file is written
+        url (str): URL of the .zip file
+        retries (int): maximum number of download attempts
+        backoff (float): seconds to wait after the first failed attempt;
+            doubled after every subsequent failure
+        timeout (float): seconds to wait on the connection before giving up
+        cached (dict): manifest entry of a previous run for this file (optional)
+
+    Returns:
+        status (dict): download report with the keys 'path', 'url',
+            'status' ('ok', 'cached' or 'failed'), 'bytes' (transferred in
+            this run), 'seconds', 'attempts', and the cache fields 'etag',
+            'size', 'md5' and 'complete'
+    """
+    cached = cached or {}
+    part_path = f'{f_path}.part'
+    status = {'path': f_path, 'url': url, 'status': 'failed',
+              'bytes': 0, 'seconds': 0.0, 'attempts': 0,
+              'etag': cached.get('etag'), 'size': cached.get('size'),
+              'md5': cached.get('md5'), 'complete': False}
+    start = time.perf_counter()
+
+    # An unfinished download can only be resumed against the same remote object
+    resume_etag = cached.get('etag') if not cached.get('complete') else None
+
+    for attempt in range(1, retries + 1):
+        status['attempts'] = attempt
+        try:
+            head = requests.head(url, timeout=timeout, allow_redirects=True)
+            head.raise_for_status()
+            etag = head.headers.get('ETag')
+            size = head.headers.get('Content-Length')
+            size = int(size) if size is not None else None
+
+            # Skip files that are unchanged remotely and intact locally
+            if cached.get('complete') and os.path.exists(f_path) \
+                    and (etag or size) is not None \
+                    and (etag == cached.get('etag') if etag else size == cached.get('size')) \
+                    and os.path.getsize(f_path) == cached.get('size') \
+                    and file_md5(f_path) == cached.get('md5'):
+                status.update(status='cached', complete=True)
+                break
+
+            offset = 0
+            headers = {}
+            if etag and etag == resume_etag and os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+                headers = {'Range': f'bytes={offset}-', 'If-Range': etag}
+            status['etag'] = resume_etag = etag
+
+            with requests.get(url, headers=headers, stream=True,
+                              timeout=timeout) as response:
+                # A range starting at the end of the file is not satisfiable:
+                # the .part file is then either complete or unusable
+                if offset and response.status_code == 416:
+                    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                    if total != str(offset):
+                        os.remove(part_path)
+                        raise IOError(f'cannot resume from byte {offset} of {total or "?"}; '
+                                      'restarting the download')
+                else:
+                    response.raise_for_status()
+                    if response.status_code != 206:  # Range not honoured
+                        offset = 0
+                    with open(part_path, 'ab' if offset else 'wb') as file_location:
+                        for box in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                            file_location.write(box)
+                            status['bytes'] += len(box)
+
+            # A truncated body or an error page served with a 200 must not
+            # reach the processing step
+            received = os.path.getsize(part_path)
+            if size is not None and received != size:
+                raise IOError(f'received {received} of {size} bytes')
+            if not zipfile.is_zipfile(part_path):
+                os.remove(part_path)
+                raise IOError('downloaded file is not a valid .zip archive')
+
+            # Single-part S3 uploads use the MD5 of the object as their ETag
+            md5 = file_md5(part_path)
+            if etag and re.fullmatch(r'"?[0-9a-f]{32}"?', etag) and etag.strip('"') != md5:
+                os.remove(part_path)
+                raise IOError('checksum of downloaded file does not match its ETag')
+
+            os.replace(part_path, f_path)
+            status.update(status='ok', size=received, md5=md5, complete=True)
+            break
+        except (requests.exceptions.RequestException, IOError) as err_msg:
+            logger.warning("Attempt %s of %s to download %s failed: %s",
+                           attempt, retries, url, err_msg)
+            if attempt < retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+
+    status['seconds'] = time.perf_counter() - start
+    return status
+
+
+def log_download_summary(statuses):
+    """
+    Logs the size, duration and throughput of every downloaded file
+
+    Args:
+        statuses (list): download reports as returned by `fetch_trips_zip`
+
+    Returns: none (writes summary to the log)
+
+    """
+    total_bytes = 0
+    for status in sorted(statuses, key=lambda stat: stat['path']):
+        megabytes = status['bytes'] / 1024 ** 2
+        rate = megabytes / status['seconds'] if status['seconds'] > 0 else 0.0
+        total_bytes += status['bytes']
+        logger.info("%s: %s after %s attempt(s), %.1f MB in %.1f s (%.2f MB/s)",
+                    os.path.basename(status['path']), status['status'],
+                    status['attempts'], megabytes, status['seconds'], rate)
+    logger.info("Downloaded %.1f MB across %s file(s); %s file(s) "
+                "served from the archive cache.", total_bytes / 1024 ** 2,
+                len(statuses), sum(stat['status'] == 'cached' for stat in statuses))
+
+
+def parse_trip_hours(times, legacy=False):
+    """
+    Parses trip timestamps to the start of their hour.
+
+    Citi Bike files since 2017 use ISO timestamps ("2020-03-01 06:10:01.1230"),
+    whose date and hour are read straight from the digits of the fixed-width
+    string with vectorized NumPy arithmetic. Files up to 201612 additionally use the US layout
+    ("3/1/2016 06:10:01"), which is parsed with its explicit formats. Only
+    values matching none of these fall back to the generic parser.
+
+    Args:
+        times (pandas Series): timestamp strings from a trips file
+        legacy (bool): whether the file uses the layouts published until 201612
+
+    Returns:
+        hours (pandas Series): timestamps floored to the hour
+    """
+    # View the leading "YYYY-MM-DD HH" of every value as a row of bytes and
+    # their digits; non-digit characters wrap around to values above 9
+    raw = np.frombuffer(times.values.astype('S13').tobytes(), dtype=np.uint8).reshape(-1, 13)
+    digits = raw - np.uint8(ord('0'))
+    number = digits.astype(np.int32)
+    year = number[:, 0] * 1000 + number[:, 1] * 100 + number[:, 2] * 10 + number[:, 3]
+    month = number[:, 5] * 10 + number[:, 6]
+    day = number[:, 8] * 10 + number[:, 9]
+    hour = number[:, 11] * 10 + number[:, 12]
+    iso = ((digits[:, ISO_DIGIT_POSITIONS] <= 9).all(axis=1)
+           & (raw[:, 4] == ord('-')) & (raw[:, 7] == ord('-')) & (raw[:, 10] == ord(' '))
+           & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31) & (hour <= 23))
+
+    # Assemble the hour from its parts, leaving other layouts as NaT; days past
+    # the end of their month (e.g. 2019-02-29) go to the generic parser
+    month_start = (year - 1970).astype('M8[Y]').astype('M8[M]') + (month - 1)
+    stamps = month_start.astype('M8[D]')
+    iso &= day <= ((month_start + 1).astype('M8[D]') - stamps).astype(np.int64)
+    stamps = (stamps + (day - 1)).astype('M8[h]') + hour
+    hours = pd.Series(np.where(iso, stamps, np.datetime64('NaT')).astype('M8[ns]'),
+                      index=times.index)
+
+    if legacy:
+        for time_format in LEGACY_TIME_FORMATS:
+            rest = hours.isna() & times.notna()
+            if not rest.any():
+                break
+            hours[rest] = pd.to_datetime(times[rest], format=time_format,
+                                         errors='coerce').dt.floor('H')
+
+    rest = hours.isna() & times.notna()
+    if rest.any():
+        logger.debug("Falling back to generic timestamp parsing for %s rows.", rest.sum())
+        hours[rest] = pd.to_datetime(times[rest], infer_datetime_format=True).dt.floor('H')
+
+    return hours
+
+
+def count_flows(data_f, legacy=False):
+    """
+    Counts the inflows and outflows in a chunk of raw trips data in a single pass.
+
+    Every trip contributes an outflow at its start station and an inflow at
+    its end station. Each event is encoded as one integer key combining the
+    station id with its hour bucket (hours since the epoch), and both
+    directions are counted over the unique keys with `np.bincount`. Station
+    hours with flows in only one direction are kept.
+
+    Args:
+        data_f (pandas DataFrame): chunk of raw trips data
+        legacy (bool): whether the timestamps use the layouts published until 201612
+
+    Returns:
+        keys (numpy array): sorted unique station-hour keys, see `split_flow_keys`
+        inflows (numpy array): number of trips ending at each key
+        outflows (numpy array): number of trips starting at each key
+    """
+    stations = np.concatenate([data_f['start_station_id'].values,
+                               data_f['end_station_id'].values])
+    hours = np.concatenate([parse_trip_hours(data_f['start_time'], legacy).values,
+                            parse_trip_hours(data_f['stop_time'], legacy).values])
+    is_inflow = np.repeat([False, True], len(data_f))
+
+    # Trips without a station or timestamp cannot be attributed
+    known = ~(pd.isna(stations) | pd.isna(hours))
+    buckets = hours[known].astype('M8[h]').astype(np.int64)
+    events = (stations[known].astype(np.int64) << FLOW_KEY_BITS) | buckets
+    keys, position = np.unique(events, return_inverse=True)
+    inflows = np.bincount(position[is_inflow[known]], minlength=len(keys))
+    outflows = np.bincount(position, minlength=len(keys)) - inflows
+    return keys, inflows, outflows
+
+
+def split_flow_keys(keys, inflows, outflows):
+    """
+    Turns station-hour keys and their counts into a flows table
+
+    Args:
+        keys (numpy array): station-hour keys as returned by `count_flows`
+        inflows (numpy array): number of trips ending at each key
+        outflows (numpy array): number of trips starting at each key
+
+    Returns:
+        flows (pandas DataFrame): inflows and outflows by station, date and hour
+    """
+    date_hour = pd.Series((keys & (2 ** FLOW_KEY_BITS - 1)).astype('M8[h]'))
+    return pd.DataFrame({'station_id': keys >> FLOW_KEY_BITS,
+                         'date': date_hour.dt.date,
+                         'hour': date_hour.dt.hour,
+                         'inflows': inflows.astype(np.int64),
+                         'outflows': outflows.astype(np.int64)})
+
+
+def aggregate_trips_zip(zip_path, chunksize=None, legacy=False):
+    """
+    Aggregates one month of raw trips into hourly station in- and outflows.
+
+    When `chunksize` is given, the month is streamed from the .zip file in
+    chunks whose counts are added into a running total, so that memory use
+    is bounded by the number of station-hours rather than the number of trips.
+
+    Args:
+        zip_path (str): path of the monthly Citi Bike trips .zip file
+        chunksize (int): number of trips read per chunk (optional;
+            reads the whole month at once if not given)
+        legacy (bool): whether the file uses the timestamp layouts
+            published until 201612
+
+    Returns:
+        flows (pandas DataFrame): inflows and outflows by station, date and hour
+    """
+    # Read in CSV and rename columns for ease of use
+    zip_f = zipfile.ZipFile(zip_path)  # Obtain zipper object of zip folder
+    target = zip_f.namelist()[0]  # Extracts relevant .csv file from zip folder
+    reader = pd.read_csv(zip_f.open(target), usecols=[1, 2, 3, 7], chunksize=chunksize)
+    if chunksize is None:
+        reader = [reader]
+
+    keys = np.empty(0, dtype=np.int64)
+    inflows = np.empty(0, dtype=np.int64)
+    outflows = np.empty(0, dtype=np.int64)
+    for data_f in reader:
+        data_f.columns = ['start_time', 'stop_time', 'start_station_id', 'end_station_id']
+
+        # Add this chunk's inflows and outflows to the running totals
+        chunk_keys, chunk_in, chunk_out = count_flows(data_f, legacy)
+        keys, position = np.unique(np.concatenate([keys, chunk_keys]), return_inverse=True)
+        inflows = np.bincount(position, np.concatenate([inflows, chunk_in]), len(keys))
+        outflows = np.bincount(position, np.concatenate([outflows, chunk_out]), len(keys))
+
+    # Create total table
+    return split_flow_keys(keys, inflows, outflows)
+
+
+def start_process_pool(workers):
+    """
+    Starts a process pool whose workers are never forked while other threads run.
+
+    A worker forked from a process with running threads can inherit a lock
+    held by one of them (e.g. in logging or urllib3) and deadlock. Workers are
+    therefore spawned where the start method can be chosen (Python 3.7+);
+    Python 3.6 forks all of them on the first submission, which is made here.
+
+    Args:
+        workers (int): number of worker processes
+
+    Returns:
+        process_pool (concurrent.futures.ProcessPoolExecutor): started pool
+    """
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    process_pool = ProcessPoolExecutor(max_workers=workers)
+    process_pool.submit(int).result()
+    return process_pool
+
+
+def download_trips_data(month_start, month_end, zip_data_path,
+                        url_stem, suffix_1, suffix_2,
+                        threads, workers, chunksize, retries, backoff, timeout,
+                        output_path, storage_format, s3_bucket, s3_directory):
     """
     Takes the YYYYMM and downloads all relevant Citibike trips
     data for that period from https://s3.amazonaws.com/tripdata/
@@ -27,19 +410,25 @@ def download_trips_data(month_start, month_end, zip_data_path, csv_data_path,
     Args:
         month_start (str): the earliest YYYYMM from which to download the data
         month_end (str): the latest YYYYMM to which to download the data
-        zip_data_path (str): folder location in which to
-            keep/extract all intermediate .zip files
-        csv_data_path (str): folder location in which to
-            keep/extract all intermediate .csv files
+        zip_data_path (str): folder location of the archive cache in
+            which raw .zip files are kept between runs
         url_stem (str): URL stem for S3 bucket holding Citibikes raw data
         suffix_1 (str): URL suffix 1 for S3 bucket holding Citibikes raw data
         suffix_2 (str): URL suffix 2 for S3 bucket holding Citibikes raw data
-        label_chunk (str): file path chunk for labeling intermediate datasets
         threads (int): Number of download threads to use for downloading
-        sleep_time (int): Number of seconds to sleep
-            while threaded pool downloading occurs
+        workers (int): Number of processes used to aggregate the monthly
+            .zip files (1 aggregates each month in the main process)
+        chunksize (int): Number of trips read at a time while aggregating
+            a month (None reads each month at once)
+        retries (int): Maximum number of attempts per downloaded file
+        backoff (float): Number of seconds to wait before the first retry;
+            doubled after every further failed attempt
+        timeout (float): Number of seconds to wait on a stalled connection
         output_path (str): file location to which the
-            final output .csv will be written
+            final output will be written
+        storage_format (str): 'csv' or 'parquet'; format of the output file
+            (the extension of output_path is replaced accordingly, and
+            Parquet output holds one row group per month)
         s3_bucket (str): Name of S3 bucket to write data
         s3_directory (str): String of S3 directory in which to house data
 
@@ -47,44 +436,20 @@ def download_trips_data(month_start, month_end, zip_data_path, csv_data_path,
 
     """
 
-    # Specify local filepath and URL stems + suffix for downloading
-    zip_path = Path(zip_data_path)
-    if zip_path.exists() and zip_path.is_dir():
-        shutil.rmtree(zip_path)
-        logger.info("Creating temporary folder for raw .zip "
-                    "data for processing in %s.", zip_data_path)
-    os.mkdir(zip_data_path)
-
-    csv_path = Path(csv_data_path)
-    if csv_path.exists() and csv_path.is_dir():
-        shutil.rmtree(csv_path)
-        logger.info("Creating temporary folder for intermediate .csv "
-                    "data for processing in %s.", csv_data_path)
-    os.mkdir(csv_data_path)
+    # Specify local filepath and URL stems + suffix for downloading. Raw .zip
+    # files are kept between runs as an archive cache described by a manifest
+    os.makedirs(zip_data_path, exist_ok=True)
+    manifest_path = f'{zip_data_path}{MANIFEST_FILENAME}'
+    manifest = read_manifest(manifest_path)
+    logger.info("Using archive cache of raw .zip data in %s "
+                "(%s month(s) cached).", zip_data_path, len(manifest))
 
     # Initialize empty lists
     urls = []
-    pr_paths = []
+    months = {}
+    legacy = {}
     yrmo = []
 
-    # Function to download raw zip files and download them to local path
-    def url_response(url):
-        """
-        Takes the a url and downloads the file associated
-        with it using the `requests` module.
-
-        Args:
-            url (list/str): the URL from which to download data.
-
-        Returns: the file located at the above URL
-
-        """
-        f_path, url = url
-        request_obj = requests.get(url, stream=True)
-        with open(f_path, 'wb') as file_location:
-            for box in request_obj:
-                file_location.write(box)
-
     # Create list 'yrmo' with all desired dates in YYYYMM format
     for year_obj, mon_obj in iter_months(month_start, month_end):
         if mon_obj % 13 < 10:
@@ -93,105 +458,96 @@ def download_trips_data(month_start, month_end, zip_data_path, csv_data_path,
             yrmo.append(f'{year_obj}{mon_obj}')
 
     # Create path and URL lists for batch downloading and processing
+    output_path = table_path(output_path, storage_format)
     for date in yrmo:
         if date <= '201612':  # Filepath patterns change after 201612
-            urls.append([
-                # Path to which you want .zip from_s3
-                f'{zip_data_path}{date}{suffix_1}',
-                # URL path of associated file
-                f'{url_stem}{date}{suffix_1}'])
-            pr_paths.append([
-                # Path from which you want to load .zip file
-                f'{zip_data_path}{date}{suffix_1}',
-                # Path to which you want to save processed .csv file
-                f'{csv_data_path}{label_chunk}{date}.csv'])
+            suffix = suffix_1
         else:
-            urls.append([
-                # Path to which you want .zip from_s3
-                f'{zip_data_path}{date}{suffix_2}',
-                # URL path of associated file
-                f'{url_stem}{date}{suffix_2}'])
-            pr_paths.append([
-                # Path from which you want to load .zip file
-                f'{zip_data_path}{date}{suffix_2}',
-                # Path to which you want to save processed .csv file
-                f'{csv_data_path}{label_chunk}{date}.csv'])
-
-    # Download raw zip files in ThreadPool
-    try:
-        ThreadPool(threads).imap_unordered(url_response, urls)
-        logger.info("Downloading raw Citi Bike files from months "
-                    "%s to %s using %s threads to %s. "
-                    "Sleep time during multi-thread download: %s seconds.",
-                    month_start, month_end, threads,
-                    zip_data_path, sleep_time)
-        logger.warning("Warning: Due to bandwidth and connection "
-                       "unpredictability, threaded downloading with the "
-                       "specified thread count and sleep length may not "
-                       "be sufficient to download all files quickly "
-                       "enough. If the program fails, increase the number "
-                       "of threads and sleep time.")
-        sleep(sleep_time)  # Sleeping to give device sufficient time to download files.
-    except requests.exceptions.ConnectionError as err_msg:
-        logger.error(err_msg)
-        logger.error("Could not connect. Try checking your "
-                     "internet connection and trying again.")
-        sys.exit(1)
+            suffix = suffix_2
+        urls.append([
+            # Month used as the archive cache key
+            date,
+            # Path to which you want .zip from_s3
+            f'{zip_data_path}{date}{suffix}',
+            # URL path of associated file
+            f'{url_stem}{date}{suffix}'])
+        # Month whose flows are aggregated from the file
+        months[f'{zip_data_path}{date}{suffix}'] = date
+        # Timestamp layout used by the file
+        legacy[f'{zip_data_path}{date}{suffix}'] = date <= '201612'
+
+    # Download raw zip files in a thread pool, processing each month's
+    # .zip file as soon as its download has completed
+    logger.info("Downloading raw Citi Bike files from months "
+                "%s to %s using %s threads to %s.",
+                month_start, month_end, threads, zip_data_path)
+    statuses = []
+    aggregations = {}
+    monthly_flows = {}
+
+    # With more than one worker, months are aggregated in separate processes
+    # while the remaining downloads continue; the pool is started before them
+    if workers > 1:
+        logger.info("Aggregating downloaded months using %s worker processes.", workers)
+        process_pool = start_process_pool(workers)
+    else:
+        process_pool = None
 
-    # Open, process, aggregate, and save processed data.
-    logger.info(
-        "Attempting to process from_s3 .zip files into intermediate "
-        ".csv files and saving to %s.", csv_data_path)
+    # The worker processes are shut down even if a download or aggregation fails
     try:
-        for path in pr_paths:
-            # Read in CSV and rename columns for ease of use
-            zip_f = zipfile.ZipFile(path[0])  # Obtain zipper object of zip folder
-            target = zip_f.namelist()[0]  # Extracts relevant .csv file from zip folder
-            data_f = pd.read_csv(zip_f.open(target), usecols=[1, 2, 3, 7])
-            data_f.columns = ['start_time', 'stop_time', 'start_station_id', 'end_station_id']
-
-            # Create inflows table
-            infl = data_f[['end_station_id', 'stop_time']].copy()
-            infl.loc[:, 'stop_time'] = pd.to_datetime(infl['stop_time'],
-                                                      infer_datetime_format=True)
-            infl.loc[:, 'date'] = infl['stop_time'].dt.date
-            infl.loc[:, 'hour'] = infl['stop_time'].dt.hour
-            infl.loc[:, 'inflows'] = 1
-            infl.rename(columns={'end_station_id': 'station_id'}, inplace=True)
-            infl.drop('stop_time', axis='columns', inplace=True)
-            inflows = infl.groupby(['station_id', 'date', 'hour']).sum().reset_index()
-
-            # Create outflows table
-            outf = data_f[['start_station_id', 'start_time']].copy()
-            outf.loc[:, 'start_time'] = pd.to_datetime(outf['start_time'],
-                                                       infer_datetime_format=True)
-            outf.loc[:, 'date'] = outf['start_time'].dt.date
-            outf.loc[:, 'hour'] = outf['start_time'].dt.hour
-            outf.loc[:, 'outflows'] = 1
-            outf.rename(columns={'start_station_id': 'station_id'}, inplace=True)
-            outf.drop('start_time', axis='columns', inplace=True)
-            outflows = outf.groupby(['station_id', 'date', 'hour']).sum().reset_index()
-
-            # Create total table
-            flows = pd.merge(inflows, outflows, on=['station_id', 'date', 'hour'])
-
-            # Export to csv
-            flows.to_csv(path[1])
-
-    except ConnectionError as err:
-        logger.error(err)
-        logger.error("Multi-thread downloading did not complete as "
-                     "designed. Try specifying a higher '--thread' count "
-                     "and higher '--sleep_time' value and try again.")
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = {pool.submit(fetch_trips_zip, f_path, url, retries, backoff,
+                                   timeout, manifest.get(date)): date
+                       for date, f_path, url in urls}
+            for future in as_completed(futures):
+                status = future.result()
+                statuses.append(status)
+
+                # Record progress so that reruns skip or resume this month; a
+                # failed run keeps a complete entry, whose file is still intact
+                previous = manifest.get(futures[future]) or {}
+                if (status['etag'] is not None or status['complete']) and \
+                        not (status['status'] == 'failed' and previous.get('complete')):
+                    manifest[futures[future]] = {
+                        key: status[key] for key in ('url', 'etag', 'size', 'md5', 'complete')}
+                    write_manifest(manifest, manifest_path)
+
+                if status['status'] == 'failed':
+                    logger.error("Could not download %s after %s attempts.",
+                                 status['url'], status['attempts'])
+                    continue
+
+                # Open, process and aggregate data.
+                logger.info("Processing %s into hourly station flows.", status['path'])
+                if process_pool is None:
+                    monthly_flows[months[status['path']]] = aggregate_trips_zip(
+                        status['path'], chunksize, legacy[status['path']])
+                else:
+                    aggregations[process_pool.submit(aggregate_trips_zip, status['path'], chunksize,
+                                                     legacy[status['path']])] = status['path']
+
+        # Collect the months aggregated by the worker processes
+        if process_pool is not None:
+            for future in as_completed(aggregations):
+                monthly_flows[months[aggregations[future]]] = future.result()
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+
+    log_download_summary(statuses)
+    failed = [status['url'] for status in statuses if status['status'] == 'failed']
+    if failed:
+        logger.error("%s file(s) could not be downloaded: %s. Try checking "
+                     "your internet connection or increasing '--retries' "
+                     "and trying again.", len(failed), ', '.join(failed))
         sys.exit(1)
 
-    # Consolidate all intermediate .csv files into one output file
-    logger.info("Consolidating intermediate .csv files into trips .csv output.")
-    files = glob.glob(f'{csv_data_path}*.csv')
-    trips_df = pd.concat((pd.read_csv(f, usecols=[1, 2, 3, 4, 5]) for f in files))
+    # Consolidate the aggregated months, in calendar order, into one output file
+    logger.info("Consolidating %s month(s) of flows into trips output.", len(monthly_flows))
+    trips_dfs = [monthly_flows[date] for date in sorted(monthly_flows)]
 
     # Save file locally
-    trips_df.to_csv(output_path, index=False)
+    write_table(trips_dfs, output_path, storage_format)
     logger.info("Success! Wrote Citi Bikes trip output to %s.", output_path)
 
     # Add trips data to S3 bucket
@@ -199,12 +555,10 @@ def download_trips_data(month_start, month_end, zip_data_path, csv_data_path,
     logger.info("Success! Wrote Citi Bike stations data to '%s' S3 "
                 "bucket in '%s' folder.", s3_bucket, s3_directory)
 
-    # Remove raw and intermediate data (if output performed correctly)
+    # Verify output was written; the raw .zip files stay in the archive
+    # cache for the next run
     file = Path(output_path)
-    if file.exists():
-        shutil.rmtree(csv_data_path)
-        shutil.rmtree(zip_data_path)
-    else:
+    if not file.exists():
         logger.error("Download process to obtain output 'trips.csv'"
                      " file not completed successfully. "
                      "Please try again or consider re-specifying function options.")
@@ -1,4 +1,5 @@
 """Functions to process bike data and shape it for modeling"""
+import os
 import sys
 import logging
 import yaml
@@ -6,11 +7,119 @@ import pandas as pd
 import numpy as np
 from src.helper_db import add_to_database
 from src.helper_s3 import download_csv_s3, upload_to_s3
+from src.helper_io import table_path, write_table, append_table, read_table
+from src.stock_matrix import build_stock_matrix, extend_stock_matrix, save_stock_matrix, \
+    load_stock_matrix
+from src.stock_store import StockStore
 
 # Logging
 logger = logging.getLogger(__name__)
 
 
+def fill_within_groups(values, group_starts, group_ends):
+    """
+    Forward- then back-fills missing values within contiguous groups of rows
+    using index arithmetic instead of a per-group function call
+    Args:
+        values (numpy array): column values, ordered so that each group is contiguous
+        group_starts (numpy array): position of the first row of each row's group
+        group_ends (numpy array): position of the last row of each row's group
+    Returns:
+        (numpy array): values with gaps filled from the nearest row of the same group
+    """
+    missing = pd.isna(values)
+    if not missing.any():
+        return values
+
+    positions = np.arange(len(values))
+
+    # Forward fill: last non-missing position so far, if it lies within the group
+    previous = np.maximum.accumulate(np.where(missing, -1, positions))
+    source = np.where(previous >= group_starts, previous, -1)
+
+    # Back fill what is left: next non-missing position, if it lies within the group
+    following = np.minimum.accumulate(
+        np.where(missing, len(values), positions)[::-1])[::-1]
+    source = np.where((source < 0) & (following <= group_ends), following, source)
+
+    filled = values.copy() if values.dtype == object else values.astype(float)
+    filled[source >= 0] = values[source[source >= 0]]
+    filled[source < 0] = np.nan
+    return filled
+
+
+def day_keys(station_ids, dates):
+    """
+    Encodes (station, day) partitions as single integers
+    Args:
+        station_ids (array-like): station id of each row
+        dates (array-like): date or hourly timestamp of each row
+    Returns:
+        (numpy array): int64 key of each row's (station, day) partition
+    """
+    days = pd.to_datetime(dates).values.astype('M8[D]').astype(np.int64)
+    return (np.asarray(station_ids, dtype=np.int64) << 32) | (days & 0xFFFFFFFF)
+
+
+def select_new_days(trips_df, processed_df):
+    """
+    Keeps the trips of the (station, day) partitions from each station's last
+        processed day on; that day is processed again, since trips may have
+        arrived after it was processed. As the stock is reset to the rebalanced
+        level at each station's first hour of the day, those partitions can be
+        processed on their own
+    Args:
+        trips_df (pandas DataFrame): hourly trips data with station_id and date columns
+        processed_df (pandas DataFrame): previously processed bike stock data with
+            station_id and date (hourly timestamp) columns
+    Returns:
+        (pandas DataFrame): rows of trips_df not before the last day of their station
+            in processed_df, and all rows of stations not in processed_df
+    """
+    processed_days = pd.Series(pd.to_datetime(processed_df['date']).values.astype('M8[D]'))
+    last_days = processed_days.groupby(processed_df['station_id'].values).max()
+    trip_last_days = pd.Series(trips_df['station_id'].values).map(last_days).values
+    trip_days = pd.to_datetime(trips_df['date']).values.astype('M8[D]')
+    return trips_df.loc[~(trip_days < trip_last_days)]
+
+
+def replace_store_days(store, bike_df, replaced_keys):
+    """
+    Builds a stock store in which the bike stock of reprocessed (station, day)
+        partitions replaces their previous stock
+    Args:
+        store (StockStore): store of the previously processed bike stock
+        bike_df (pandas DataFrame): bike stock of the reprocessed partitions, with
+            station_id, date and stock columns
+        replaced_keys (numpy array): `day_keys` of the reprocessed partitions
+    Returns:
+        (StockStore): in-memory store of the updated bike stock
+    """
+    previous = store.to_frame()
+    kept = previous.loc[~np.isin(day_keys(previous['station_id'], previous['date']),
+                                 replaced_keys)]
+    return StockStore.from_frame(pd.concat([kept, bike_df[['station_id', 'date', 'stock']]],
+                                           ignore_index=True))
+
+
+def partition_delete_where(partitions):
+    """
+    Builds the condition deleting the rows of (station, day) partitions from the
+        bike_stock table with a single join against the partitions' keys
+    Args:
+        partitions (pandas DataFrame): station_id and day of each partition
+    Returns:
+        (tuple): WHERE condition and DataFrame of keys, as taken by `add_to_database`
+    """
+    days = partitions['day'].values.astype('M8[D]')
+    keys = pd.DataFrame({'station_id': partitions['station_id'].values.astype(np.int64),
+                         'day_start': days.astype('M8[ns]'),
+                         'day_end': (days + 1).astype('M8[ns]')})
+    return ('EXISTS (SELECT 1 FROM {keys} WHERE {keys}.station_id = {table}.station_id '
+            'AND {table}.date >= {keys}.day_start AND {table}.date < {keys}.day_end)',
+            keys)
+
+
 def process_bike_data(trips_df, stations_df, rebalancing_prop):
     """
     Filters raw data to columns of interest and joins trips and stations datasets
@@ -33,27 +142,35 @@ def process_bike_data(trips_df, stations_df, rebalancing_prop):
             sort_values(['station_id', 'date', 'hour']). \
             drop(['num_bikes_available', 'last_reported'], axis=1)
 
+        # Locate station blocks and (station, day) segments in the sorted rows
+        positions = np.arange(len(bikes))
+        station_ids = bikes['station_id'].values
+        day_codes = pd.factorize(bikes['date'])[0]
+        new_station = np.r_[True, np.diff(station_ids) != 0]
+        new_day = new_station | np.r_[True, np.diff(day_codes) != 0]
+        station_starts = np.maximum.accumulate(np.where(new_station, positions, 0))
+        station_ends = np.minimum.accumulate(
+            np.where(np.r_[new_station[1:], True], positions, len(bikes))[::-1])[::-1]
+        day_starts = np.maximum.accumulate(np.where(new_day, positions, 0))
+
         # Fill in station-level data and mathematical operations for all observations
-        bikes['name'] = bikes.groupby('station_id')['name'].\
-            transform(lambda x: x.ffill().bfill())
-        bikes['latitude'] = bikes.groupby('station_id')['latitude'].\
-            transform(lambda x: x.ffill().bfill())
-        bikes['longitude'] = bikes.groupby('station_id')['longitude'].\
-            transform(lambda x: x.ffill().bfill())
-        bikes['capacity'] = bikes.groupby('station_id')['capacity'].\
-            transform(lambda x: x.ffill().bfill())
+        for col in ['name', 'latitude', 'longitude', 'capacity']:
+            bikes[col] = fill_within_groups(bikes[col].values, station_starts, station_ends)
         bikes['net_flows'] = bikes['outflows'] - bikes['inflows']
 
-        # Calculate stock of bikes, using `rebalancing_prop`
-        bikes['stock'] = np.where(
-            bikes.groupby(['station_id', 'date'])['hour'].
-            transform('min') == bikes['hour'],
-            round(bikes.capacity * rebalancing_prop),
-            bikes.net_flows.shift()
-        )
+        # Calculate stock of bikes, using `rebalancing_prop`: each day starts from
+        # the rebalanced stock, followed by the previous hour's net flows
+        hours = bikes['hour'].values
+        stock = np.where(hours[day_starts] == hours,
+                         np.round(bikes['capacity'].values * rebalancing_prop),
+                         bikes['net_flows'].shift().values).astype(float)
 
-        # Create daily running stock
-        bikes['stock'] = bikes.groupby(['station_id', 'date'])['stock'].cumsum()
+        # Create daily running stock as a segmented cumulative sum over (station, day)
+        missing = np.isnan(stock)
+        running = np.cumsum(np.where(missing, 0, stock))
+        running -= (running - np.where(missing, 0, stock))[day_starts]
+        running[missing] = np.nan
+        bikes['stock'] = running
         bikes['date'] = pd.to_datetime(bikes.date)
         bikes['date'] += pd.to_timedelta(bikes.hour, unit='h')
 
@@ -96,11 +213,15 @@ def run_data_processing(arguments):
                      "filename/path.")
         sys.exit(1)
 
+    # Trips and bike_stock data are stored in the configured storage format
+    storage_format = config['storage_format']
+    output_file = table_path(config['process_bike_data']['output_file'], storage_format)
+
     # If --local flag activated, download from local
     if arguments.local_flag:
-        trips = pd.read_csv(config['fetch_local_data']['trips_data_path'])
-        logger.info('Successfully retrieved trips data from local at "%s"',
-                    config['fetch_local_data']['trips_data_path'])
+        trips_path = table_path(config['fetch_local_data']['trips_data_path'], storage_format)
+        trips = read_table(trips_path)
+        logger.info('Successfully retrieved trips data from local at "%s"', trips_path)
         stations = pd.read_csv(config['fetch_local_data']['stations_data_path'])
         logger.info('Successfully retrieved stations data from local at "%s"',
                     config['fetch_local_data']['stations_data_path'])
@@ -111,32 +232,90 @@ def run_data_processing(arguments):
         trips = download_csv_s3(s3_bucket_name=arguments.s3_bucket,
                                 bucket_dir_path=
                                 config['download_csv_s3']['trips_data']['bucket_dir_path'],
-                                input_filename=
-                                config['download_csv_s3']['trips_data']['input_filename'],
-                                output_filename=
-                                config['download_csv_s3']['trips_data']['output_filename'])
+                                input_filename=table_path(
+                                    config['download_csv_s3']['trips_data']['input_filename'],
+                                    storage_format),
+                                output_filename=table_path(
+                                    config['download_csv_s3']['trips_data']['output_filename'],
+                                    storage_format),
+                                skip_unchanged=config['s3_skip_unchanged'])
         stations = download_csv_s3(s3_bucket_name=arguments.s3_bucket,
                                    bucket_dir_path=
                                    config['download_csv_s3']['stations_data']['bucket_dir_path'],
                                    input_filename=
                                    config['download_csv_s3']['stations_data']['input_filename'],
                                    output_filename=
-                                   config['download_csv_s3']['stations_data']['output_filename'])
+                                   config['download_csv_s3']['stations_data']['output_filename'],
+                                   skip_unchanged=config['s3_skip_unchanged'])
+
+    # In incremental mode, only the (station, day) partitions from each station's
+    # last processed day on are processed, and they replace their previous rows in
+    # the local bike_stock data, matrix and store and in the database table
+    config_process = config['process_bike_data']
+    incremental = config_process.get('incremental') and os.path.exists(output_file)
+    if incremental:
+        processed = read_table(output_file, columns=['station_id', 'date'])
+        trips = select_new_days(trips, processed)
+        logger.info('Incremental run: %s hourly trip records in (station, day) '
+                    'partitions from the last day in "%s" on.', len(trips), output_file)
+        if trips.empty:
+            logger.info('No new days to process; bike_stock data is up to date.')
+            return
+        replaced = pd.DataFrame({'station_id': trips['station_id'].values,
+                                 'day': pd.to_datetime(trips['date']).values.astype('M8[D]')}). \
+            drop_duplicates()
+        replaced_keys = day_keys(replaced['station_id'], replaced['day'])
 
     # Begin processing bike data
     logger.info('Processing trips and stations data for modeling...')
-    bike_df = process_bike_data(trips, stations,
-                                config['process_bike_data']['rebalancing_proportion'])
+    bike_df = process_bike_data(trips, stations, config_process['rebalancing_proportion'])
 
     # Save bike_stock data locally
-    bike_df.to_csv(config['process_bike_data']['output_file'], index=False)
-    logger.info('Success! Added bike_stock data locally to:'
-                ' "%s"', config['process_bike_data']['output_file'])
+    if incremental:
+        append_table(bike_df, output_file, storage_format,
+                     replaced=np.isin(day_keys(processed['station_id'], processed['date']),
+                                      replaced_keys))
+        logger.info('Success! Replaced %s (station, day) partitions with %s rows of '
+                    'bike_stock data locally in: "%s"', len(replaced), len(bike_df),
+                    output_file)
+    else:
+        write_table(bike_df, output_file, storage_format)
+        logger.info('Success! Added bike_stock data locally to:'
+                    ' "%s"', output_file)
+
+    # Save compact station x hour matrix of the bike stock, if configured
+    matrix_path = config_process.get('matrix_path')
+    if matrix_path:
+        if incremental and os.path.exists(matrix_path):
+            matrix, matrix_stations, matrix_hours = load_stock_matrix(matrix_path,
+                                                                      mmap_mode=None)
+            matrix, matrix_stations, matrix_hours = extend_stock_matrix(
+                matrix, matrix_stations, matrix_hours, bike_df, replaced['station_id'].values,
+                replaced['day'].values.astype('M8[D]'))
+        else:
+            matrix, matrix_stations, matrix_hours = build_stock_matrix(
+                read_table(output_file) if incremental else bike_df)
+        save_stock_matrix(matrix, matrix_stations, matrix_hours, matrix_path)
+        logger.info('Success! Added %s x %s bike_stock matrix locally to: "%s"',
+                    matrix.shape[0], matrix.shape[1], matrix_path)
+
+    # Save memory-mappable per-station stock store for modeling, if configured
+    store_path = config_process.get('store_path')
+    if store_path:
+        if incremental and os.path.exists(store_path):
+            store = replace_store_days(StockStore.open(store_path, mmap_mode=None), bike_df,
+                                       replaced_keys)
+        else:
+            store = StockStore.from_frame(read_table(output_file) if incremental else bike_df)
+        store.save(store_path)
+        logger.info('Success! Added bike_stock store of %s stations locally to: "%s"',
+                    len(store), store_path)
 
     # Save bike_stock data to S3
-    upload_to_s3(file_local_path=config['process_bike_data']['output_file'],
+    upload_to_s3(file_local_path=output_file,
                  s3_bucket=arguments.s3_bucket,
-                 s3_directory=config['upload_to_s3']['s3_directory'])
+                 s3_directory=config['upload_to_s3']['s3_directory'],
+                 skip_unchanged=config['s3_skip_unchanged'])
     logger.info('Success! Added bike_stock data to the "%s" folder in the "%s" S3 bucket .',
                 config['upload_to_s3']['s3_directory'], arguments.s3_bucket)
 
@@ -144,7 +323,11 @@ def run_data_processing(arguments):
     try:
         logger.info('Attempting to add bike stock data to '
                     'database at %s...', arguments.engine_string)
-        add_to_database(bike_df, "bike_stock", 'replace', arguments.engine_string)
+        if incremental:
+            add_to_database(bike_df, "bike_stock", 'append', arguments.engine_string,
+                            delete_where=partition_delete_where(replaced))
+        else:
+            add_to_database(bike_df, "bike_stock", 'replace', arguments.engine_string)
         logger.info('Success! Added data to "bike_stock" '
                     'table at the following engine_string: %s',
                     arguments.engine_string)
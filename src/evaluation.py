@@ -0,0 +1,126 @@
+"""Multi-horizon backtest of the station models on rolling origins."""
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+# Logging
+logger = logging.getLogger(__name__)
+
+# Columns of the metrics table, one row per station and horizon
+METRICS_COLUMNS = ['station_id', 'horizon', 'folds', 'MAPE', 'sMAPE', 'MAE']
+
+
+def forecast_metrics(y_pred, y_true):
+    """
+    Computes forecast errors over the last axis, ignoring hours without data
+    Args:
+        y_pred (numpy array): forecasts, with the forecast hours on the last axis
+        y_true (numpy array): observed stock of the same shape, NaN where missing
+    Returns:
+        mape (numpy array): mean absolute percentage error over the hours whose
+            observed stock is not zero, rather than dividing by zero
+        smape (numpy array): symmetric MAPE, 200 |e| / (|y| + |y_hat|), counting
+            hours where both are zero as exact
+        mae (numpy array): mean absolute error
+    """
+    error = np.abs(y_pred - y_true)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        ape = np.where(y_true == 0, np.nan, error / np.abs(y_true) * 100)
+        scale = np.abs(y_true) + np.abs(y_pred)
+        sape = np.where(scale == 0, 0.0, 200 * error / scale)
+        return (np.nanmean(ape, axis=-1), np.nanmean(sape, axis=-1),
+                np.nanmean(error, axis=-1))
+
+
+def rolling_origins(n_hours, horizon, folds, fold_step, min_history=168):
+    """
+    Places the forecast origins of the backtest folds, the last fold ending at the
+        last hour of data
+    Args:
+        n_hours (int): number of hours of data
+        horizon (int): number of hours forecast from each origin
+        folds (int): number of origins
+        fold_step (int): hours between consecutive origins
+        min_history (int): fewest hours of data before an origin
+    Returns:
+        (numpy array): first forecast hour of each fold, oldest first
+    """
+    origins = n_hours - horizon - fold_step * np.arange(folds)[::-1]
+    return origins[origins >= min_history]
+
+
+def weekly_profile(rows, week_hours, values, n_stations):
+    """
+    Averages the stock of each station at each hour of the week
+    Args:
+        rows (numpy array): station (row) of each observation
+        week_hours (numpy array): hour of the week, 0 (Monday 00:00) to 167, of
+            each observation
+        values (numpy array): observed stock
+        n_stations (int): number of stations
+    Returns:
+        (numpy array): profile of shape (stations, 168); hours of the week
+            without data fall back to the station's overall average
+    """
+    cells = rows * 168 + week_hours
+    sums = np.bincount(cells, weights=values, minlength=n_stations * 168)
+    counts = np.bincount(cells, minlength=n_stations * 168)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        station_means = np.bincount(rows, weights=values, minlength=n_stations) \
+            / np.bincount(rows, minlength=n_stations)
+        means = (sums / counts).reshape(n_stations, 168)
+    return np.where(counts.reshape(n_stations, 168) > 0, means, station_means[:, None])
+
+
+def evaluate_forecasts(matrix, station_ids, hours, stations, forecaster, horizons, folds,
+                       fold_step):
+    """
+    Backtests station models on rolling origins and scores them against the stock
+        matrix at several horizons
+    Args:
+        matrix (numpy array): stock of shape (stations, hours), as built by
+            `build_stock_matrix`
+        station_ids (numpy array): station id of each matrix row
+        hours (pandas DatetimeIndex): hourly timestamps of the matrix columns
+        stations (list): ids of the stations backtested
+        forecaster (callable): called with a list of station ids, the datetime64
+            timestamps of the origins and a number of steps, returns the stations'
+            forecasts from each origin, of shape (stations, folds, steps), made
+            from the hours before that origin only
+        horizons (list): forecast horizons scored, in hours
+        folds (int): number of rolling origins
+        fold_step (int): hours between consecutive origins
+    Returns:
+        (pandas DataFrame): METRICS_COLUMNS of each station at each horizon, the
+            errors being averaged over the folds with data
+    """
+    steps = max(horizons)
+    origins = rolling_origins(len(hours), steps, folds, fold_step)
+    rows = {station: row for row, station in enumerate(np.asarray(station_ids).tolist())}
+    stations = [station for station in sorted(stations) if station in rows]
+    if not len(origins):
+        logger.warning('Not enough data for any backtest fold; no metrics computed.')
+        stations = []
+    if not stations:
+        return pd.DataFrame(columns=METRICS_COLUMNS)
+
+    y_pred = forecaster(stations, hours.values[origins], steps)
+    y_true = np.asarray(matrix[[rows[station] for station in stations]],
+                        dtype=np.float64)[:, origins[:, None] + np.arange(steps)]
+
+    tables = []
+    for horizon in horizons:
+        mape, smape, mae = forecast_metrics(y_pred[..., :horizon], y_true[..., :horizon])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            tables.append(pd.DataFrame({'station_id': stations,
+                                        'horizon': horizon,
+                                        'folds': (~np.isnan(mae)).sum(axis=1),
+                                        'MAPE': np.nanmean(mape, axis=1),
+                                        'sMAPE': np.nanmean(smape, axis=1),
+                                        'MAE': np.nanmean(mae, axis=1)},
+                                       columns=METRICS_COLUMNS))
+
+    return pd.concat(tables).sort_values(['station_id', 'horizon']).reset_index(drop=True)
@@ -0,0 +1,215 @@
+"""Compact per-station forecast states and an LRU cache of forecasts computed on demand."""
+import json
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+def arima_state(model_arima, y_var, model_params):
+    """
+    Extracts what is needed to forecast from a fitted ARIMA model: its parameters
+        and the last observations and residuals the forecast recursion starts from
+    Args:
+        model_arima (ARIMAResults): model fit on the station's stock
+        y_var (pandas Series): the station's hourly stock, in time order
+        model_params (dict): ARIMA model required fit parameters
+    Returns:
+        (dict): 'arma' forecast state of the station
+    """
+    p, d, q = model_params['p'], model_params['d'], model_params['q']
+    ar = np.asarray(model_arima.arparams) if p else np.zeros(0)
+    ma = np.asarray(model_arima.maparams) if q else np.zeros(0)
+    const = model_arima.params[0] if model_arima.k_trend else 0.0
+    endog = np.asarray(model_arima.model.endog, dtype=np.float64).ravel()
+    resid = np.asarray(model_arima.resid, dtype=np.float64)
+
+    # last value of the series and of each of its differences but the last one
+    levels = []
+    series = np.asarray(y_var, dtype=np.float64)
+    for _ in range(d):
+        levels.append(float(series[-1]))
+        series = np.diff(series)
+
+    return {'kind': 'arma',
+            'intercept': float(const * (1 - ar.sum())),
+            'ar': ar.tolist(),
+            'ma': ma.tolist(),
+            'history': endog[len(endog) - p:].tolist() if p else [],
+            'resid': resid[len(resid) - q:].tolist() if q else [],
+            'levels': levels}
+
+
+def ar1_state(intercept, phi, last):
+    """
+    Builds the forecast state of an AR(1) model with intercept
+    Args:
+        intercept (float): intercept c of y[t] = c + phi * y[t - 1]
+        phi (float): autoregressive coefficient
+        last (float): last observed stock
+    Returns:
+        (dict): 'arma' forecast state of the station
+    """
+    return {'kind': 'arma', 'intercept': float(intercept), 'ar': [float(phi)], 'ma': [],
+            'history': [float(last)], 'resid': [], 'levels': []}
+
+
+def profile_state(profile):
+    """
+    Builds the forecast state of an hour-of-week profile model
+    Args:
+        profile (numpy array): average stock at each of the 168 hours of the week,
+            starting on Monday 00:00
+    Returns:
+        (dict): 'hour_of_week' forecast state of the station
+    """
+    return {'kind': 'hour_of_week', 'profile': np.asarray(profile, dtype=np.float64).tolist()}
+
+
+def forecast_from_state(state, steps, forecast_start):
+    """
+    Forecasts a station's stock from its forecast state
+    Args:
+        state (dict): forecast state of the station
+        steps (int): number of hours to forecast
+        forecast_start (pandas Timestamp): hour of the first forecast
+    Returns:
+        (numpy array): forecast stock of the next steps hours
+    """
+    if state['kind'] == 'hour_of_week':
+        first = forecast_start.dayofweek * 24 + forecast_start.hour
+        return np.asarray(state['profile'])[(first + np.arange(steps)) % 168]
+
+    # ARMA recursion on the differenced series, with future shocks at zero
+    ar, ma = state['ar'], state['ma']
+    history, resid = list(state['history']), list(state['resid'])
+    forecasts = np.empty(steps)
+    for step in range(steps):
+        value = state['intercept'] + \
+            sum(ar[i] * history[-1 - i] for i in range(len(ar))) + \
+            sum(ma[j] * resid[-1 - j] for j in range(len(ma)))
+        forecasts[step] = value
+        history.append(value)
+        resid.append(0.0)
+
+    # undo the differencing
+    for level in reversed(state['levels']):
+        forecasts = level + np.cumsum(forecasts)
+    return forecasts
+
+
+def save_forecast_states(states, forecast_hours, state_path):
+    """
+    Writes the forecast states of all stations
+    Args:
+        states (dict): forecast state of each station id
+        forecast_hours (pandas DatetimeIndex): hours that can be forecast
+        state_path (str): path of the JSON file
+    Returns:
+        None -- writes the states to state_path
+    """
+    with open(state_path, 'w') as state_file:
+        json.dump({'forecast_start': str(forecast_hours[0]),
+                   'forecast_hours': len(forecast_hours),
+                   'stations': {str(station): states[station] for station in sorted(states)}},
+                  state_file)
+    logger.debug('Forecast states of %s stations written to %s', len(states), state_path)
+
+
+def load_forecast_states(state_path):
+    """
+    Loads the forecast states written by `save_forecast_states`
+    Args:
+        state_path (str): path of the JSON file
+    Returns:
+        forecast_start (pandas Timestamp): hour of the first forecast
+        forecast_hours (int): number of hours that can be forecast
+        states (dict): forecast state of each station id
+    """
+    with open(state_path, 'r') as state_file:
+        meta = json.load(state_file)
+    return (pd.Timestamp(meta['forecast_start']), meta['forecast_hours'],
+            {int(station): state for station, state in meta['stations'].items()})
+
+
+class ForecastCache:
+    """Serves station forecasts computed from their states when first requested.
+
+    Each station's forecast is computed up to the requested hour (at least
+    doubling the horizon already computed) and kept in a least recently used
+    cache of at most `maxsize` stations, shared safely by the app's threads.
+    """
+
+    def __init__(self, state_path, maxsize=256):
+        """
+        Args:
+            state_path (str): path of the JSON file written by `save_forecast_states`
+            maxsize (int): maximum number of stations whose forecasts are cached
+        """
+        self.forecast_start, self.forecast_hours, self.states = \
+            load_forecast_states(state_path)
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def station_ids(self):
+        """Ids of the stations that can be forecast."""
+        return sorted(self.states)
+
+    def dates(self):
+        """
+        Returns:
+            (list): 'YYYY-MM-DD' dates that can be forecast
+        """
+        hours = pd.date_range(self.forecast_start, periods=self.forecast_hours, freq='H')
+        return sorted(set(hours.strftime('%Y-%m-%d')))
+
+    def forecasts(self, station, steps):
+        """
+        Returns at least the first `steps` hourly forecasts of a station
+        Args:
+            station (int): station id
+            steps (int): number of hours needed
+        Returns:
+            (numpy array): forecast stock from the first forecast hour on
+        """
+        with self._lock:
+            cached = self._cache.get(station)
+        if cached is None or len(cached) < steps:
+            horizon = min(max(steps, 2 * len(cached) if cached is not None else steps),
+                          self.forecast_hours)
+            cached = forecast_from_state(self.states[station], horizon, self.forecast_start)
+
+        # the forecast is computed outside the lock; only the LRU bookkeeping
+        # is serialized
+        with self._lock:
+            current = self._cache.get(station)
+            if current is not None and len(current) > len(cached):
+                cached = current
+            self._cache[station] = cached
+            self._cache.move_to_end(station)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return cached
+
+    def predict(self, station, date, hour):
+        """
+        Forecasts the number of bikes at a station at one hour
+        Args:
+            station (int): station id
+            date (str): date, 'YYYY-MM-DD'
+            hour (int): hour of the day
+        Returns:
+            (int): forecast number of bikes, or None if the station or hour
+                cannot be forecast
+        """
+        step = int((pd.Timestamp(date) + pd.Timedelta(hours=int(hour)) -
+                    self.forecast_start) / pd.Timedelta(hours=1))
+        if station not in self.states or not 0 <= step < self.forecast_hours:
+            return None
+        return int(round(self.forecasts(station, step + 1)[step]))
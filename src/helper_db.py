@@ -1,7 +1,12 @@
 """Helper module to connect with databases."""
+import os
 import sys
+import time
+import tempfile
 import logging.config
 import logging
+import numpy as np
+import pandas as pd
 import sqlalchemy as sql
 from sqlalchemy import exc
 import src.config as config
@@ -9,6 +14,15 @@ import src.config as config
 # Logging
 logger = logging.getLogger(__name__)
 
+# Rows sent to the database per executemany call when bulk loading
+BULK_CHUNK_SIZE = 10000
+
+# SQLAlchemy types of object columns by the kind of values they hold, as
+# `pandas.DataFrame.to_sql` assigns them; other kinds are stored as TEXT
+OBJECT_COLUMN_TYPES = {'date': sql.Date, 'datetime': sql.DateTime, 'datetime64': sql.DateTime,
+                       'time': sql.Time, 'boolean': sql.Boolean, 'integer': sql.BigInteger,
+                       'floating': sql.Float, 'mixed-integer-float': sql.Float}
+
 
 def get_engine_string():
     """
@@ -41,17 +55,264 @@ def get_engine(engine_string=None):
             logger.debug("Local DB is being used")
 
         engine_string = get_engine_string()
-        engine = sql.create_engine(engine_string)
 
-    else:
-        engine = sql.create_engine(engine_string)
+    # MySQL clients must opt in to LOAD DATA LOCAL INFILE, used for bulk loads
+    connect_args = {'local_infile': True} if engine_string.startswith('mysql') else {}
+    engine = sql.create_engine(engine_string, connect_args=connect_args)
 
     return engine
 
 
-def add_to_database(dataframe, table_name, if_exists_condition, engine_string=None):
+def table_rows(dataframe):
+    """
+    Converts a DataFrame to rows of Python values that any DBAPI driver can bind
+    Args:
+        dataframe (pandas DataFrame): data to be inserted
+    Returns:
+        (list): one tuple per row, with None for missing values and timestamps
+            formatted as 'YYYY-MM-DD HH:MM:SS.ffffff', as SQLAlchemy stores them
+    """
+    columns = []
+    for _, values in dataframe.items():
+        missing = values.isna().values
+        if pd.api.types.is_datetime64_any_dtype(values):
+            # several times faster than Series.dt.strftime
+            values = np.char.replace(np.datetime_as_string(values.values, unit='us'),
+                                     'T', ' ')
+        values = np.array(values, dtype=object)
+        values[missing] = None
+        columns.append(values)
+    return list(zip(*columns))
+
+
+def insert_rows(dataframe, table_name, connection, chunksize=BULK_CHUNK_SIZE):
     """
-    Adds data from a pandas DataFrame to a local or RDS MySQL database
+    Inserts rows into an existing table with one executemany call per chunk; the
+        pymysql driver rewrites each call into multi-row INSERT statements
+    Args:
+        dataframe (pandas DataFrame): data to be inserted
+        table_name (str): name of the table
+        connection (sqlalchemy Connection): connection within a transaction
+        chunksize (int): rows per executemany call
+    Returns:
+        None -- inserts the rows
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    marker = '?' if connection.dialect.paramstyle == 'qmark' else '%s'
+    statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(table_name), ', '.join(quote(column) for column in dataframe.columns),
+        ', '.join([marker] * len(dataframe.columns)))
+    rows = table_rows(dataframe)
+    for start in range(0, len(rows), chunksize):
+        connection.exec_driver_sql(statement, rows[start:start + chunksize])
+
+
+def load_data_local_infile(dataframe, table_name, connection):
+    """
+    Loads rows into an existing MySQL table from a temporary CSV file with
+        LOAD DATA LOCAL INFILE
+    Args:
+        dataframe (pandas DataFrame): data to be loaded
+        table_name (str): name of the table
+        connection (sqlalchemy Connection): MySQL connection within a transaction
+    Returns:
+        None -- loads the rows
+    """
+    quote = connection.dialect.identifier_preparer.quote
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+        dataframe.to_csv(csv_file, header=False, index=False, na_rep='\\N',
+                         date_format='%Y-%m-%d %H:%M:%S')
+    try:
+        connection.exec_driver_sql(
+            "LOAD DATA LOCAL INFILE '{}' INTO TABLE {} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n' ({})".format(
+                csv_file.name.replace('\\', '/'), quote(table_name),
+                ', '.join(quote(column) for column in dataframe.columns)))
+    finally:
+        os.remove(csv_file.name)
+
+
+def create_key_table(keys, table_name, connection):
+    """
+    Creates a temporary table holding a DataFrame of keys, with a primary key on
+        all of its columns in order so that joins on the leading columns are index
+        lookups
+    Args:
+        keys (pandas DataFrame): keys to be loaded, with integer, float, datetime
+            or string columns
+        table_name (str): name of the temporary table
+        connection (sqlalchemy Connection): connection within a transaction
+    Returns:
+        None -- creates and fills the temporary table
+    """
+    columns = []
+    for name, values in keys.items():
+        if pd.api.types.is_integer_dtype(values):
+            column_type = sql.BigInteger()
+        elif pd.api.types.is_float_dtype(values):
+            column_type = sql.Float()
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            column_type = sql.DateTime()
+        else:
+            column_type = sql.String(max(1, int(values.astype(str).str.len().max())))
+        columns.append(sql.Column(name, column_type, primary_key=True))
+    drop_temporary_table(table_name, connection)
+    sql.Table(table_name, sql.MetaData(), *columns, prefixes=['TEMPORARY']).create(connection)
+    insert_rows(keys.drop_duplicates(), table_name, connection)
+
+
+def drop_temporary_table(table_name, connection):
+    """
+    Drops a temporary table if it exists, without the implicit commit MySQL
+        performs on a plain DROP TABLE
+    Args:
+        table_name (str): name of the temporary table
+        connection (sqlalchemy Connection): connection within a transaction
+    Returns:
+        None -- drops the table
+    """
+    drop = ('DROP TEMPORARY TABLE IF EXISTS ' if connection.dialect.name == 'mysql'
+            else 'DROP TABLE IF EXISTS ')
+    connection.exec_driver_sql(drop + connection.dialect.identifier_preparer.quote(table_name))
+
+
+def create_table(dataframe, table_name, if_exists_condition, engine):
+    """
+    Creates (or replaces) a table with the column types `pandas.DataFrame.to_sql`
+        gives the full DataFrame, without inserting any rows; an empty frame would
+        type all object columns (e.g. of dates) as TEXT, so their types are
+        inferred from their values and passed on explicitly
+    Args:
+        dataframe (pandas DataFrame): data the table is created for
+        table_name (str): name of the table
+        if_exists_condition (str): 'fail', 'replace' or 'append', as for
+            `pandas.DataFrame.to_sql`
+        engine (sqlalchemy.engine.base.Engine): engine of the database
+    Returns:
+        None -- creates the table
+    """
+    dtype = {}
+    for name, values in dataframe.items():
+        if pd.api.types.is_object_dtype(values):
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if kind in OBJECT_COLUMN_TYPES:
+                dtype[name] = OBJECT_COLUMN_TYPES[kind]
+    dataframe.head(0).to_sql(table_name, engine, if_exists=if_exists_condition, index=False,
+                             dtype=dtype)
+
+
+def bulk_load(dataframe, table_name, if_exists_condition, engine, chunksize=BULK_CHUNK_SIZE,
+              delete_where=None):
+    """
+    Writes a DataFrame to a table with the fastest path of the database: LOAD DATA
+        LOCAL INFILE on MySQL, falling back to batched multi-row inserts if the
+        server refuses it, and chunked executemany in one transaction on SQLite
+    Args:
+        dataframe (pandas DataFrame): data to be written
+        table_name (str): name of the table
+        if_exists_condition (str): 'fail', 'replace' or 'append', as for
+            `pandas.DataFrame.to_sql`
+        engine (sqlalchemy.engine.base.Engine): engine of the database
+        chunksize (int): rows per insert batch
+        delete_where (tuple): WHERE condition and a DataFrame of keys; the keys
+            are loaded into a temporary table, which the condition names `{keys}`
+            next to the loaded table's `{table}`, and the matching rows are deleted
+            in one statement in the same transaction as the load, e.g. to replace
+            rows (optional)
+    Returns:
+        (float): rows loaded per second
+    """
+    started = time.time()
+
+    # Create (or replace) the table with the column types pandas would use
+    create_table(dataframe, table_name, if_exists_condition, engine)
+
+    method = 'executemany'
+    with engine.begin() as connection:
+        if delete_where is not None and len(delete_where[1]):
+            quote = engine.dialect.identifier_preparer.quote
+            keys_table = table_name + '_delete_keys'
+            create_key_table(delete_where[1], keys_table, connection)
+            connection.exec_driver_sql('DELETE FROM {} WHERE {}'.format(
+                quote(table_name),
+                delete_where[0].format(table=quote(table_name), keys=quote(keys_table))))
+            drop_temporary_table(keys_table, connection)
+        if not len(dataframe):
+            method = 'nothing'
+        elif engine.dialect.name == 'mysql':
+            try:
+                load_data_local_infile(dataframe, table_name, connection)
+                method = 'LOAD DATA LOCAL INFILE'
+            except (exc.OperationalError, exc.InternalError) as error:
+                logger.warning('LOAD DATA LOCAL INFILE refused (%s); using batched inserts '
+                               'instead.', error)
+        elif engine.dialect.paramstyle not in ('qmark', 'format', 'pyformat'):
+            dataframe.to_sql(table_name, connection, if_exists='append', index=False,
+                             method='multi', chunksize=chunksize)
+            method = 'multi-row to_sql'
+
+        if method == 'executemany':
+            insert_rows(dataframe, table_name, connection, chunksize)
+
+    elapsed = time.time() - started
+    rows_per_second = len(dataframe) / elapsed if elapsed > 0 else float('inf')
+    logger.info('Loaded %s rows into "%s" with %s in %.2f s (%.0f rows/s).',
+                len(dataframe), table_name, method, elapsed, rows_per_second)
+    return rows_per_second
+
+
+def swap_in_table(dataframe, table_name, engine):
+    """
+    Replaces a table by bulk loading a staging table and then renaming it over the
+        live one, so readers never find the table missing or half loaded and a
+        failed load leaves the previous table in place; the swap is a single
+        RENAME TABLE on MySQL and a transaction of renames elsewhere
+    Args:
+        dataframe (pandas DataFrame): data replacing the table's contents
+        table_name (str): name of the live table
+        engine (sqlalchemy.engine.base.Engine): engine of the database
+    Returns:
+        None -- replaces the table
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    staging, retired = quote(table_name + '_staging'), quote(table_name + '_old')
+    live = quote(table_name)
+
+    # Load the new rows into a staging table, dropped again if the load fails
+    try:
+        bulk_load(dataframe, table_name + '_staging', 'replace', engine)
+    except Exception:
+        with engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE IF EXISTS ' + staging)
+        raise
+
+    # Swap the staging table in, keeping the live one aside until it is unused
+    renames = [(staging, live)]
+    if sql.inspect(engine).has_table(table_name):
+        renames.insert(0, (live, retired))
+    with engine.begin() as connection:
+        connection.exec_driver_sql('DROP TABLE IF EXISTS ' + retired)
+    with engine.begin() as connection:
+        if engine.dialect.name == 'mysql':
+            connection.exec_driver_sql('RENAME TABLE ' + ', '.join(
+                '{} TO {}'.format(old, new) for old, new in renames))
+        else:
+            if engine.dialect.name == 'sqlite':
+                # pysqlite only opens a transaction before DML statements
+                connection.exec_driver_sql('BEGIN')
+            for old, new in renames:
+                connection.exec_driver_sql('ALTER TABLE {} RENAME TO {}'.format(old, new))
+    with engine.begin() as connection:
+        connection.exec_driver_sql('DROP TABLE IF EXISTS ' + retired)
+    logger.debug("Swapped freshly loaded %s table in", table_name)
+
+
+def add_to_database(dataframe, table_name, if_exists_condition, engine_string=None,
+                    delete_where=None):
+    """
+    Adds data from a pandas DataFrame to a local or RDS MySQL database, through
+        `bulk_load`; tables are replaced with `swap_in_table`
     Args:
         dataframe (pandas DataFrame): DataFrame containing data to be added
             into the database of interest
@@ -60,13 +321,19 @@ def add_to_database(dataframe, table_name, if_exists_condition, engine_string=No
             done if data already exists in the table
         engine_string (str): sqlalchemy string for connection to desired
             database (optional input)
+        delete_where (tuple): WHERE condition and DataFrame of keys of rows deleted
+            in the transaction appending the data; see `bulk_load` (optional)
     Returns:
         None -- adds data to a MySQL database
     """
     engine = get_engine(engine_string)
 
     try:
-        dataframe.to_sql(table_name, engine, if_exists=if_exists_condition, index=False)
+        if if_exists_condition == 'replace':
+            swap_in_table(dataframe, table_name, engine)
+        else:
+            bulk_load(dataframe, table_name, if_exists_condition, engine,
+                      delete_where=delete_where)
         logger.debug("Data inserted into %s", table_name)
     except exc.IntegrityError:
         logger.error("There is an issue with duplication from your request. "
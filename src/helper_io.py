@@ -0,0 +1,132 @@
+"""Helper functions to read and write the pipeline's datasets as CSV or Parquet."""
+import os
+import csv
+import logging
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Logging
+logger = logging.getLogger(__name__)
+
+# File extension used for each supported storage format
+STORAGE_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet'}
+
+# Compression codec used for Parquet files
+PARQUET_COMPRESSION = 'snappy'
+
+
+def table_path(path, storage_format):
+    """
+    Swaps the extension of a configured file path for the one of the storage format
+    Args:
+        path (str): file path as configured (e.g. 'data/trips.csv')
+        storage_format (str): 'csv' or 'parquet'
+    Returns:
+        (str): file path with the extension of the storage format
+    """
+    if storage_format not in STORAGE_EXTENSIONS:
+        logger.error("Unknown storage format '%s'; choose one of %s.",
+                     storage_format, ', '.join(STORAGE_EXTENSIONS))
+        raise ValueError(f'unknown storage format: {storage_format}')
+    return os.path.splitext(path)[0] + STORAGE_EXTENSIONS[storage_format]
+
+
+def write_table(data, path, storage_format='csv'):
+    """
+    Writes a dataset to a local file in the requested storage format
+    Args:
+        data (pandas DataFrame or list): dataset to write; a list of DataFrames
+            sharing the same columns is written as one file, with each
+            DataFrame stored as its own Parquet row group (e.g. one per month)
+        path (str): file location to which the dataset is written
+        storage_format (str): 'csv' or 'parquet'
+    Returns:
+        None -- writes the dataset to path
+    """
+    frames = data if isinstance(data, list) else [data]
+
+    if storage_format == 'parquet':
+        writer = None
+        try:
+            for frame in frames:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema,
+                                              compression=PARQUET_COMPRESSION)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    elif storage_format == 'csv':
+        pd.concat(frames).to_csv(path, index=False)
+    else:
+        logger.error("Unknown storage format '%s'; choose one of %s.",
+                     storage_format, ', '.join(STORAGE_EXTENSIONS))
+        raise ValueError(f'unknown storage format: {storage_format}')
+
+
+def append_table(data, path, storage_format='csv', replaced=None):
+    """
+    Appends rows to a dataset previously written by `write_table`, creating it
+        if it does not exist yet, and optionally removes the existing rows they
+        replace
+    Args:
+        data (pandas DataFrame): rows to append, with the columns of the dataset
+        path (str): file location of the dataset
+        storage_format (str): 'csv' or 'parquet'
+        replaced (numpy array): boolean mask of the existing rows, in file order,
+            to remove (optional)
+    Returns:
+        None -- appends the rows to path
+    """
+    if not os.path.exists(path):
+        write_table(data, path, storage_format)
+    elif storage_format == 'csv':
+        columns = pd.read_csv(path, nrows=0).columns
+        if replaced is not None and replaced.any():
+            # Copy the rows that are kept as text, without parsing their values
+            temp_path = f'{path}.tmp'
+            with open(path, newline='') as source, open(temp_path, 'w', newline='') as target:
+                reader, writer = csv.reader(source), csv.writer(target)
+                writer.writerow(next(reader))
+                writer.writerows(row for row, drop in zip(reader, replaced) if not drop)
+            os.replace(temp_path, path)
+        # Appending to a CSV file only writes the new rows
+        data[columns].to_csv(path, mode='a', header=False, index=False)
+    elif storage_format == 'parquet':
+        # Parquet files cannot be extended in place: copy the existing row groups
+        # without decoding them to pandas, leaving out the replaced rows, and add
+        # the rows as a new row group
+        existing = pq.ParquetFile(path)
+        temp_path = f'{path}.tmp'
+        start = 0
+        with pq.ParquetWriter(temp_path, existing.schema_arrow,
+                              compression=PARQUET_COMPRESSION) as writer:
+            for group in range(existing.num_row_groups):
+                table = existing.read_row_group(group)
+                if replaced is not None and replaced[start:start + len(table)].any():
+                    table = table.filter(pa.array(~replaced[start:start + len(table)]))
+                start += existing.metadata.row_group(group).num_rows
+                writer.write_table(table)
+            writer.write_table(pa.Table.from_pandas(data, schema=existing.schema_arrow,
+                                                    preserve_index=False))
+        os.replace(temp_path, path)
+    else:
+        logger.error("Unknown storage format '%s'; choose one of %s.",
+                     storage_format, ', '.join(STORAGE_EXTENSIONS))
+        raise ValueError(f'unknown storage format: {storage_format}')
+
+
+def read_table(path, columns=None):
+    """
+    Reads a dataset from a local CSV or Parquet file, chosen by its extension
+    Args:
+        path (str): file location of the dataset
+        columns (list): columns to read (optional; reads all columns if not given)
+    Returns:
+        (pandas DataFrame): the dataset
+    """
+    if os.path.splitext(path)[1] == STORAGE_EXTENSIONS['parquet']:
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
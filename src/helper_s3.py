@@ -1,83 +1,291 @@
 """Helper function to deal with interfacing with S3 bucket on AWS."""
+import io
+import hashlib
 import sys
 import logging.config
 import logging
 import os
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import botocore.exceptions as botoexceptions
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import pandas as pd
+from src.helper_io import read_table, STORAGE_EXTENSIONS
 
 # Logging
 logger = logging.getLogger(__name__)
 
+# Multipart settings shared by all uploads and downloads: files above the
+# threshold are moved in parallel parts of `multipart_chunksize` bytes
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * 1024 ** 2,
+                                 multipart_chunksize=16 * 1024 ** 2,
+                                 max_concurrency=10,
+                                 use_threads=True)
 
-def upload_to_s3(file_local_path, s3_bucket, s3_directory):
-    """
-    Takes path of locally written df and writes it to S3 bucket.
+# Files uploaded at the same time by `upload_many_to_s3`
+UPLOAD_WORKERS = 4
 
-    Args:
-        file_local_path (str): Path of file that will be uploaded to S3
-        s3_bucket (str): S3 bucket name without the 's3://' prefix needed
-        s3_directory (str): Directory within S3 bucket within which to write the data.
+# Connections kept open by the shared client: one per part transferred at the same
+# time, so parallel multipart uploads do not discard and re-open connections
+MAX_POOL_CONNECTIONS = UPLOAD_WORKERS * TRANSFER_CONFIG.max_concurrency
 
-    Returns: none (writes files to S3)
 
+# Running total of bytes not transferred because the S3 object was unchanged
+SYNC_STATS = {'bytes_saved': 0, 'files_skipped': 0}
+SYNC_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """
+    Creates the S3 client once and reuses it for every transfer in the process,
+    with a connection pool sized for parallel multipart uploads.
+
+    Returns:
+        s3_client (botocore.client.S3): S3 client
     """
-    # Try checking for S3 client
     try:
-        s3 = boto3.resource("s3")
+        session = boto3.session.Session()
+        return session.client('s3', config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
     except botoexceptions.NoCredentialsError:
         logger.error("Your AWS credentials were not found. Verify that they have been "
                      "made available as detailed in readme instructions")
         sys.exit(1)
-    except FileNotFoundError:
-        logger.error('Please verify the path you inputted contains the correct data file.')
     except ConnectionError as con_e:
         logger.error(con_e)
         logger.error("Unable to connect to s3. Verify your AWS credentials "
                      "and connection and try again.")
         sys.exit(1)
 
+
+def local_etag(file_local_path, part_size=TRANSFER_CONFIG.multipart_chunksize,
+               threshold=TRANSFER_CONFIG.multipart_threshold):
+    """
+    Computes the ETag S3 assigns to a file uploaded with the given multipart settings.
+
+    Single-part uploads get the MD5 of the file; multipart uploads get the MD5
+    of the concatenated part MD5s followed by '-<number of parts>'.
+
+    Args:
+        file_local_path (str): Path of the local file
+        part_size (int): Size in bytes of each uploaded part
+        threshold (int): Size in bytes from which files are uploaded in parts
+
+    Returns:
+        (str): expected ETag, without surrounding quotes
+    """
+    whole_digest = hashlib.md5()
+    part_digests = []
+    with open(file_local_path, 'rb') as local_file:
+        for part in iter(lambda: local_file.read(part_size), b''):
+            whole_digest.update(part)
+            part_digests.append(hashlib.md5(part).digest())
+
+    if os.path.getsize(file_local_path) < threshold:
+        return whole_digest.hexdigest()
+    combined = hashlib.md5(b''.join(part_digests))
+    return f'{combined.hexdigest()}-{len(part_digests)}'
+
+
+def is_unchanged(file_local_path, s3_bucket, s3_file_path):
+    """
+    Checks whether a local file has the same size and content as an S3 object,
+        without transferring the object.
+
+    Args:
+        file_local_path (str): Path of the local file
+        s3_bucket (str): S3 bucket name without the 's3://' prefix needed
+        s3_file_path (str): Key of the S3 object
+
+    Returns:
+        (bool): True if the local file and the S3 object are identical
+    """
+    if not os.path.isfile(file_local_path):
+        return False
+    try:
+        head = get_s3_client().head_object(Bucket=s3_bucket, Key=s3_file_path)
+    except botoexceptions.ClientError:
+        return False
+
+    size = os.path.getsize(file_local_path)
+    if head['ContentLength'] != size:
+        return False
+
+    etag = head['ETag'].strip('"')
+    if '-' not in etag:
+        return etag == local_etag(file_local_path, threshold=size + 1)
+
+    # The part size of a multipart object is not stored, so try the
+    # configured part size and the smallest whole-MiB size giving that many parts
+    parts = int(etag.split('-')[1])
+    mib = 1024 ** 2
+    smallest_part = -(-size // parts)  # ceiling division
+    for part_size in {TRANSFER_CONFIG.multipart_chunksize,
+                      -(-smallest_part // mib) * mib}:
+        if -(-size // part_size) == parts and \
+                etag == local_etag(file_local_path, part_size=part_size, threshold=0):
+            return True
+    return False
+
+
+def record_skipped_transfer(file_local_path, s3_file_path):
+    """
+    Logs a transfer skipped because the file was unchanged, with the bytes saved.
+
+    Args:
+        file_local_path (str): Path of the local file
+        s3_file_path (str): Key of the S3 object
+
+    Returns: none (updates SYNC_STATS and writes to the log)
+
+    """
+    size = os.path.getsize(file_local_path)
+    with SYNC_LOCK:
+        SYNC_STATS['bytes_saved'] += size
+        SYNC_STATS['files_skipped'] += 1
+    logger.info("%s is unchanged on S3; skipped transferring %.1f MB "
+                "(%.1f MB saved over %s file(s) so far).", s3_file_path,
+                size / 1024 ** 2, SYNC_STATS['bytes_saved'] / 1024 ** 2,
+                SYNC_STATS['files_skipped'])
+
+
+def upload_to_s3(file_local_path, s3_bucket, s3_directory, skip_unchanged=False):
+    """
+    Takes path of locally written df and writes it to S3 bucket.
+
+    Args:
+        file_local_path (str): Path of file that will be uploaded to S3
+        s3_bucket (str): S3 bucket name without the 's3://' prefix needed
+        s3_directory (str): Directory within S3 bucket within which to write the data.
+        skip_unchanged (bool): Skip the upload if the S3 object already has
+            the same size and ETag as the local file
+
+    Returns: none (writes files to S3)
+
+    """
     logger.info("Writing files to S3.")
 
     s3_file_path = f'{s3_directory}{os.path.basename(os.path.normpath(file_local_path))}'
 
-    # Upload the file
-    s3_client = boto3.client('s3')
+    if skip_unchanged and is_unchanged(file_local_path, s3_bucket, s3_file_path):
+        record_skipped_transfer(file_local_path, s3_file_path)
+        return
+
+    # Upload the file, in parallel parts if it is large
     try:
-        s3_client.upload_file(file_local_path, s3_bucket, s3_file_path)
+        get_s3_client().upload_file(file_local_path, s3_bucket, s3_file_path,
+                                    Config=TRANSFER_CONFIG)
+    except botoexceptions.NoCredentialsError:
+        logger.error("Your AWS credentials were not found. Verify that they have been "
+                     "made available as detailed in readme instructions")
+        sys.exit(1)
+    except FileNotFoundError:
+        logger.error('Please verify the path you inputted contains the correct data file.')
     except botoexceptions.ClientError as err:
         logging.error(err)
 
 
-def download_csv_s3(s3_bucket_name, bucket_dir_path, input_filename, output_filename):
+def upload_many_to_s3(file_local_paths, s3_bucket, s3_directory, workers=UPLOAD_WORKERS,
+                      skip_unchanged=False):
     """
-    Obtains selected .csv file from s3 bucket, downloads it to output_filename,
-        and returns a dataframe
+    Uploads several local files to the same S3 directory in parallel.
+
+    Args:
+        file_local_paths (list): Paths of files that will be uploaded to S3
+        s3_bucket (str): S3 bucket name without the 's3://' prefix needed
+        s3_directory (str): Directory within S3 bucket within which to write the data.
+        workers (int): Number of files uploaded at the same time
+        skip_unchanged (bool): Skip files whose S3 object is already identical
+
+    Returns: none (writes files to S3)
+
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        uploads = [pool.submit(upload_to_s3, path, s3_bucket, s3_directory, skip_unchanged)
+                   for path in file_local_paths]
+        for upload in uploads:
+            upload.result()
+
+
+def read_csv_s3(s3_bucket_name, bucket_dir_path, input_filename):
+    """
+    Reads a .csv or .parquet file from S3 straight from the response body,
+        without writing it to local disk first
     Args:
         s3_bucket_name (str): the name of S3 bucket containing data of interest
         bucket_dir_path (str): s3 bucket file path where data is located
         input_filename (str): filename containing data of interest
-        output_filename (str): filename of where to download data from s3
     Returns:
         data_df (pandas DataFrame): DataFrame pulled from selected S3 bucket
     """
+    s3_file = os.path.join(bucket_dir_path, input_filename)
+    try:
+        body = get_s3_client().get_object(Bucket=s3_bucket_name, Key=s3_file)['Body']
+    except botoexceptions.ClientError as err:
+        if err.response['Error']['Code'] in ("404", "NoSuchKey"):
+            logger.error("The object does not exist. Verify path and filename.")
+        else:
+            logger.error("Unexpected error trying to retrieve s3 object. %s",
+                         err.response['Error'])
+        sys.exit(1)
 
-    # Connect to s3 prior to starting up any processing
+    # CSV is parsed while it streams in; Parquet needs a seekable buffer
     try:
-        s3 = boto3.client("s3")
-    except botoexceptions.NoCredentialsError:
-        logger.error("Your AWS credentials were not found. "
-                     "Verify that they have been passed to the environment "
-                     "as instructed in README.")
+        if os.path.splitext(input_filename)[1] == STORAGE_EXTENSIONS['parquet']:
+            data_df = pd.read_parquet(io.BytesIO(body.read()))
+        else:
+            data_df = pd.read_csv(body)
+        logger.info("Successfully streamed %s from s3", s3_file)
+    except ValueError:
+        logger.error("Selected file in s3 directory is not in CSV or Parquet form. "
+                     "Please respecify the file and try again")
         sys.exit(1)
+    finally:
+        body.close()
+
+    return data_df
+
+
+def download_csv_s3(s3_bucket_name, bucket_dir_path, input_filename, output_filename,
+                    skip_unchanged=False):
+    """
+    Obtains selected .csv or .parquet file from s3 bucket, downloads it to
+        output_filename, and returns a dataframe
+    Args:
+        s3_bucket_name (str): the name of S3 bucket containing data of interest
+        bucket_dir_path (str): s3 bucket file path where data is located
+        input_filename (str): filename containing data of interest
+        output_filename (str): filename of where to download data from s3;
+            if None, the file is streamed into memory without a local copy
+        skip_unchanged (bool): reuse an existing output_filename instead of
+            downloading if it has the same size and ETag as the S3 object
+    Returns:
+        data_df (pandas DataFrame): DataFrame pulled from selected S3 bucket
+    """
+    if input_filename is not None and output_filename is None:
+        return read_csv_s3(s3_bucket_name, bucket_dir_path, input_filename)
+
+    # Connect to s3 prior to starting up any processing
+    s3 = get_s3_client()
 
     # If filename specified, pull the requisite data
     if input_filename is not None:
         try:
             s3_file = os.path.join(bucket_dir_path, input_filename)
             logger.debug("user inputted file path:%s", s3_file)
-            s3.download_file(s3_bucket_name, s3_file, output_filename)
+            if skip_unchanged and is_unchanged(output_filename, s3_bucket_name, s3_file):
+                record_skipped_transfer(output_filename, s3_file)
+            else:
+                s3.download_file(s3_bucket_name, s3_file, output_filename,
+                                 Config=TRANSFER_CONFIG)
+        except botoexceptions.NoCredentialsError:
+            logger.error("Your AWS credentials were not found. "
+                         "Verify that they have been passed to the environment "
+                         "as instructed in README.")
+            sys.exit(1)
         except botoexceptions.ClientError as err:
             if err.response['Error']['Code'] == "404":
                 logger.error("The object does not exist. Verify path and filename.")
@@ -91,14 +299,15 @@ def download_csv_s3(s3_bucket_name, bucket_dir_path, input_filename, output_file
         logger.error("No specified filepath. Please re-enter filename and try again.")
         sys.exit(1)
 
-    # Raw data should be in CSV form, throw exception if not in CSV form
+    # Raw data should be in CSV or Parquet form (chosen by file extension),
+    # throw exception if not
     try:
-        data_df = pd.read_csv(output_filename)
+        data_df = read_table(output_filename)
         logger.info("Successfully retrieved data from s3")
     except TypeError:
         logger.error("")
     except ValueError:
-        logger.error("Selected file in s3 directory is not in CSV form. "
+        logger.error("Selected file in s3 directory is not in CSV or Parquet form. "
                      "Please respecify the file and try again")
         sys.exit(1)
     except AttributeError as error:
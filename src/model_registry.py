@@ -0,0 +1,99 @@
+"""Registry of fitted station model parameters, reused across training runs."""
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.helper_io import write_table
+
+# Logging
+logger = logging.getLogger(__name__)
+
+# Columns of the registry file, one row per station
+REGISTRY_COLUMNS = ['station_id', 'fingerprint', 'model_key', 'params_key', 'params',
+                    'mape', 'forecasts', 'converged', 'iterations', 'state', 'fitted_at']
+
+
+def digest(value):
+    """
+    Hashes a JSON-serializable value into a short hexadecimal key
+    Args:
+        value: value to hash, e.g. a dict of model settings
+    Returns:
+        (str): MD5 hex digest of the value's canonical JSON form
+    """
+    return hashlib.md5(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def series_fingerprint(y_var):
+    """
+    Fingerprints a station's stock series to detect whether it changed between runs
+    Args:
+        y_var (array-like): the station's hourly stock, in time order
+    Returns:
+        (str): MD5 hex digest of the series values
+    """
+    return hashlib.md5(np.ascontiguousarray(y_var, dtype=np.float64).tobytes()).hexdigest()
+
+
+def load_registry(registry_path):
+    """
+    Loads the model registry written by a previous training run
+    Args:
+        registry_path (str): path of the registry Parquet file
+    Returns:
+        (dict): registry entry (dict of the REGISTRY_COLUMNS) of each station id;
+            empty if no registry has been written yet
+    """
+    if not os.path.exists(registry_path):
+        logger.info('No model registry at "%s" yet; fitting all stations from scratch.',
+                    registry_path)
+        return {}
+    registry_df = pd.read_parquet(registry_path)
+    return {entry['station_id']: entry for entry in registry_df.to_dict('records')}
+
+
+def save_registry(registry, registry_path):
+    """
+    Writes the model registry for the next training run
+    Args:
+        registry (dict): registry entry of each station id
+        registry_path (str): path of the registry Parquet file
+    Returns:
+        None -- writes the registry to registry_path
+    """
+    registry_df = pd.DataFrame([registry[station] for station in sorted(registry)],
+                               columns=REGISTRY_COLUMNS)
+    write_table(registry_df, registry_path, 'parquet')
+    logger.debug('Model registry of %s stations written to %s', len(registry), registry_path)
+
+
+def registry_entry(station, fingerprint, model_key, params_key, mape_val, forecasts,
+                   fit_info):
+    """
+    Builds the registry entry of a freshly fitted station model
+    Args:
+        station (int): station id
+        fingerprint (str): fingerprint of the station's stock series
+        model_key (str): key of the settings that determine the model's outputs
+        params_key (str): key of the settings that determine the parameter layout
+        mape_val (float): holdout MAPE of the model
+        forecasts (numpy array): forecast stock of the model
+        fit_info (dict): fitted 'params', the optimizer's 'converged' flag and
+            number of 'iterations', and the forecast 'state'
+    Returns:
+        (dict): the station's registry entry
+    """
+    return {'station_id': station,
+            'fingerprint': fingerprint,
+            'model_key': model_key,
+            'params_key': params_key,
+            'params': np.asarray(fit_info['params'], dtype=np.float64),
+            'mape': float(mape_val),
+            'forecasts': np.asarray(forecasts, dtype=np.float64),
+            'converged': bool(fit_info['converged']),
+            'iterations': int(fit_info['iterations']),
+            'state': json.dumps(fit_info['state']),
+            'fitted_at': datetime.now().isoformat(timespec='seconds')}
@@ -1,118 +1,824 @@
 """Performs model training, generates predictions, and evaluates model."""
+import os
 import sys
+import time
 import logging
 import warnings
+import itertools
+import functools
+import json
+import pickle
+import shutil
+import tempfile
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import yaml
+import numpy as np
 import pandas as pd
+from numpy.linalg import LinAlgError
 from statsmodels.tsa.arima_model import ARIMA
 from statsmodels.tools.sm_exceptions import ConvergenceWarning
-from src.helper_months import date_range_hours
 from src.helper_db import add_to_database
-from src.helper_s3 import upload_to_s3, download_csv_s3
+from src.helper_s3 import upload_many_to_s3, download_csv_s3
+from src.helper_io import table_path, write_table
+from src.stock_store import StockStore
+from src.forecast_serving import arima_state, ar1_state, profile_state, \
+    save_forecast_states, load_forecast_states
+from src.evaluation import evaluate_forecasts, weekly_profile, METRICS_COLUMNS
+from src.stock_matrix import build_stock_matrix, load_stock_matrix
+from src.model_registry import digest, series_fingerprint, load_registry, \
+    save_registry, registry_entry
 
 # Logging
 logger = logging.getLogger(__name__)
 
 
-def model_fun(dataframe, start_date_args, end_date_args, model_params, optional_fit_args):
+def holdout_mape(y_var, model_params, optional_fit_args, full_fit=None,
+                 holdout_fit='refit', holdout_maxiter=10):
+    """
+    Evaluates a station's ARIMA model on a forecast of its last 12 hours made
+        from the hours before them
+    Args:
+        y_var (pandas Series): the station's hourly stock, in time order
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        full_fit (ARIMAResults): model fit on all of y_var; required unless
+            holdout_fit is 'refit'
+        holdout_fit (str): how the holdout forecast is made:
+            - 'refit': fit a second model on all but the last 12 hours
+            - 'warm_start': as 'refit', but the optimizer starts from the
+              parameters of full_fit and runs at most holdout_maxiter iterations
+            - 'filter': no second fit; run the full_fit parameters over the hours
+              before the holdout and forecast it dynamically
+        holdout_maxiter (int): optimizer iterations of 'warm_start' holdout fits
+    Returns:
+        mape_val (float): holdout MAPE, capped at 100
+    """
+    # for a rough evaluation of each model, forecast the last 12
+    # hours from the data before them and evaluate on those
+    y_train = y_var.iloc[0:len(y_var) - 12]
+    y_test = y_var.iloc[-12:]
+    if holdout_fit == 'filter':
+        predict_args = {'typ': 'levels'} if model_params['d'] else {}
+        y_pred = np.asarray(full_fit.predict(start=len(y_train), end=len(y_var) - 1,
+                                             dynamic=True, **predict_args))
+    else:
+        arima_model_eval = ARIMA(y_train, order=(model_params['p'],
+                                                 model_params['d'],
+                                                 model_params['q']))
+        if holdout_fit == 'warm_start':
+            model_eval_arima_fit = arima_model_eval.fit(
+                start_params=full_fit.params,
+                **dict(optional_fit_args, maxiter=holdout_maxiter))
+        else:
+            model_eval_arima_fit = arima_model_eval.fit(**optional_fit_args)
+        y_pred = model_eval_arima_fit.forecast(len(y_test))[0]
+    mape_result = (abs((y_pred - y_test) / y_test) * 100).mean()
+
+    # To deal with sparse data and to avoid inf results,
+    # cap MAPE upper bound at 100%
+    if mape_result > 100:
+        mape_val = 100
+    else:
+        mape_val = mape_result
+
+    return mape_val
+
+
+def fit_station(y_var, forecast_steps, model_params, optional_fit_args,
+                holdout_fit='refit', holdout_maxiter=10, start_params=None):
+    """
+    Trains the ARIMA model of one station, evaluates it on a 12-hour holdout and
+        forecasts its inventory
+    Args:
+        y_var (pandas Series): the station's hourly stock, in time order
+        forecast_steps (int): number of hours to forecast
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        holdout_fit (str): 'refit', 'warm_start' or 'filter'; see `holdout_mape`
+        holdout_maxiter (int): optimizer iterations of 'warm_start' holdout fits
+        start_params (numpy array): parameters of a previous fit of the station to
+            start the optimizer from (optional)
+    Returns:
+        mape_val (float): holdout MAPE, capped at 100
+        forecasts (numpy array): forecast stock for the next forecast_steps hours
+        fit_info (dict): fitted 'params', the optimizer's 'converged' flag and
+            number of 'iterations', and the forecast 'state' of the station
+    """
+    warnings.simplefilter('ignore', ConvergenceWarning)
+
+    # train on all the data, warm-started from a previous fit if there is one
+    arima_def = ARIMA(y_var, order=(model_params['p'],
+                                    model_params['d'],
+                                    model_params['q']))
+    try:
+        model_arima = arima_def.fit(start_params=start_params, **optional_fit_args)
+    except (ValueError, LinAlgError):
+        if start_params is None:
+            raise
+        model_arima = arima_def.fit(**optional_fit_args)
+
+    mape_val = holdout_mape(y_var, model_params, optional_fit_args, full_fit=model_arima,
+                            holdout_fit=holdout_fit, holdout_maxiter=holdout_maxiter)
+
+    forecasts = model_arima.forecast(steps=forecast_steps)[0]
+    retvals = getattr(model_arima, 'mle_retvals', None) or {}
+    fit_info = {'params': np.asarray(model_arima.params),
+                'converged': retvals.get('converged', True),
+                'iterations': retvals.get('iterations', 0),
+                'state': arima_state(model_arima, y_var, model_params)}
+
+    return mape_val, forecasts, fit_info
+
+
+def fit_station_chunk(station_series, forecast_steps, model_params, optional_fit_args,
+                      holdout_fit='refit', holdout_maxiter=10, start_params=None):
+    """
+    Trains the models of a group of stations, isolating failures so that one
+        station that cannot be fit does not stop the others
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        forecast_steps (int): number of hours to forecast
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        holdout_fit (str): 'refit', 'warm_start' or 'filter'; see `holdout_mape`
+        holdout_maxiter (int): optimizer iterations of 'warm_start' holdout fits
+        start_params (dict): parameters of previous fits to warm-start from, by
+            station id (optional)
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station; MAPE,
+            forecasts and fit info are None for stations whose fit failed
+    """
+    start_params = start_params or {}
+    results = []
+    for station, y_var in station_series:
+        try:
+            mape_val, forecasts, fit_info = fit_station(y_var, forecast_steps, model_params,
+                                                        optional_fit_args, holdout_fit,
+                                                        holdout_maxiter,
+                                                        start_params.get(station))
+        except Exception as err:
+            logger.warning('ARIMA model for station %s failed: %s:%s',
+                           station, type(err).__name__, err)
+            mape_val, forecasts, fit_info = None, None, None
+        results.append((station, mape_val, forecasts, fit_info))
+    return results
+
+
+def fit_store_chunk(store_path, stations, forecast_steps, model_params, optional_fit_args,
+                    holdout_fit='refit', holdout_maxiter=10, start_params=None):
+    """
+    Trains the models of a group of stations in a worker process, reading their
+        series from the memory-mapped stock store instead of receiving copies
+    Args:
+        store_path (str): path of the stock store's stock .npy file
+        stations (list): station ids
+        forecast_steps (int): number of hours to forecast
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        holdout_fit (str): 'refit', 'warm_start' or 'filter'; see `holdout_mape`
+        holdout_maxiter (int): optimizer iterations of 'warm_start' holdout fits
+        start_params (dict): parameters of previous fits to warm-start from, by
+            station id (optional)
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station, as
+            returned by `fit_station_chunk`
+    """
+    store = StockStore.open(store_path)
+    return fit_station_chunk([(station, pd.Series(store.series(station)))
+                              for station in stations], forecast_steps, model_params,
+                             optional_fit_args, holdout_fit, holdout_maxiter, start_params)
+
+
+def ar1_least_squares(stock, starts, ends):
+    """
+    Estimates an AR(1) model with intercept, y[t] = c + phi * y[t - 1], for many
+        series at once by conditional least squares
+    Args:
+        stock (numpy array): values of all series, held back to back
+        starts (numpy array): position of the first value of each series
+        ends (numpy array): position after the last value of each series used
+    Returns:
+        c (numpy array): intercept of each series, NaN where it cannot be estimated
+        phi (numpy array): autoregressive coefficient of each series, NaN where
+            it cannot be estimated
+    """
+    # pair each value with the next one of the same series
+    lengths = np.maximum(ends - starts, 0)
+    labels = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(lengths.sum()) + \
+        np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    has_next = positions < (ends - 1)[labels]
+    labels, lagged, current = labels[has_next], stock[positions[has_next]], \
+        stock[positions[has_next] + 1]
+
+    # per-series sums of the normal equations
+    def series_sum(weights):
+        return np.bincount(labels, weights=weights, minlength=len(starts))
+
+    count = series_sum(None)
+    sum_x, sum_y = series_sum(lagged), series_sum(current)
+    sum_xx, sum_xy = series_sum(lagged * lagged), series_sum(lagged * current)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        phi = (count * sum_xy - sum_x * sum_y) / (count * sum_xx - sum_x * sum_x)
+        c = (sum_y - phi * sum_x) / count
+    invalid = ~(np.isfinite(phi) & np.isfinite(c))
+    phi[invalid], c[invalid] = np.nan, np.nan
+    return c, phi
+
+
+def ar1_forecast(c, phi, last, steps):
+    """
+    Forecasts many AR(1) series at once by the recursion y[t] = c + phi * y[t - 1]
+    Args:
+        c (numpy array): intercept of each series
+        phi (numpy array): autoregressive coefficient of each series
+        last (numpy array): last observed value of each series
+        steps (int): number of steps to forecast
+    Returns:
+        (numpy array): forecasts of shape (series, steps)
+    """
+    forecasts = np.empty((len(c), steps))
+    level = last
+    for step in range(steps):
+        level = c + phi * level
+        forecasts[:, step] = level
+    return forecasts
+
+
+def batch_mape(y_pred, y_test):
+    """
+    Computes the holdout MAPE of many stations at once, capped at 100% as for
+        the ARIMA models
+    Args:
+        y_pred (numpy array): forecasts of shape (stations, holdout hours)
+        y_test (numpy array): observed stock of shape (stations, holdout hours)
+    Returns:
+        (numpy array): MAPE of each station
+    """
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mape_result = np.nanmean(np.abs((y_pred - y_test) / y_test) * 100, axis=1)
+    return np.where(mape_result > 100, 100, mape_result)
+
+
+def fit_ar1_batch(station_series, forecast_steps, holdout=12):
+    """
+    Trains an AR(1) model with intercept for every station at once, evaluates it
+        on a holdout of the last hours and forecasts inventory; a fast alternative
+        to fitting ARIMA(1, 0, 0) station by station
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        forecast_steps (int): number of hours to forecast
+        holdout (int): number of final hours held out to evaluate the model
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station; MAPE,
+            forecasts and fit info are None for stations whose model cannot be
+            estimated, and fit info only holds the forecast 'state'
+    """
+    if not station_series:
+        return []
+    lengths = np.array([len(y_var) for _, y_var in station_series], dtype=np.int64)
+    stock = np.concatenate([np.asarray(y_var, dtype=np.float64)
+                            for _, y_var in station_series])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+
+    # train on all the data, and on all but the holdout hours for evaluation
+    c_full, phi_full = ar1_least_squares(stock, starts, ends)
+    c_eval, phi_eval = ar1_least_squares(stock, starts, ends - holdout)
+    forecasts = ar1_forecast(c_full, phi_full, stock[ends - 1], forecast_steps)
+    y_pred = ar1_forecast(c_eval, phi_eval, stock[ends - holdout - 1], holdout)
+    y_test = stock[(ends - holdout)[:, None] + np.arange(holdout)]
+
+    mape_val = batch_mape(y_pred, y_test)
+
+    failed = np.isnan(phi_full) | np.isnan(phi_eval)
+    return [(station, None, None, None) if failed[row] else
+            (station, mape_val[row], forecasts[row],
+             {'state': ar1_state(c_full[row], phi_full[row], stock[ends[row] - 1])})
+            for row, (station, _) in enumerate(station_series)]
+
+
+def hour_of_week(hours):
+    """
+    Gives the hour of the week, from 0 (Monday 00:00) to 167, of hourly timestamps
+    Args:
+        hours (numpy array): datetime64 timestamps
+    Returns:
+        (numpy array): hour of the week of each timestamp
+    """
+    hours_since_epoch = hours.astype('M8[h]').astype(np.int64)
+    # 1970-01-01 was a Thursday, the fourth day of a Monday-based week
+    return (hours_since_epoch + 3 * 24) % (7 * 24)
+
+
+def fit_hour_of_week_batch(station_series, station_dates, forecast_hours, holdout=12):
+    """
+    Forecasts every station's inventory at once from its average stock at each
+        hour of the week, evaluated on a holdout of the last hours
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        station_dates (list): datetime64 timestamps of each station's stock values
+        forecast_hours (pandas DatetimeIndex): hours to forecast
+        holdout (int): number of final hours held out to evaluate the model
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station; fit info
+            only holds the forecast 'state'
+    """
+    if not station_series:
+        return []
+    lengths = np.array([len(y_var) for _, y_var in station_series], dtype=np.int64)
+    stock = np.concatenate([np.asarray(y_var, dtype=np.float64)
+                            for _, y_var in station_series])
+    weeks_hours = hour_of_week(np.concatenate(station_dates))
+    rows = np.repeat(np.arange(len(station_series)), lengths)
+    ends = np.cumsum(lengths)
+
+    def profile(used):
+        return weekly_profile(rows[used], weeks_hours[used], stock[used], len(lengths))
+
+    # profile of all the data for forecasting, and of all but the holdout hours
+    # for evaluation
+    full_profile = profile(np.ones(len(stock), dtype=bool))
+    eval_profile = profile(np.arange(len(stock)) < (ends - holdout)[rows])
+    forecasts = full_profile[:, hour_of_week(forecast_hours.values)]
+    test_positions = (ends - holdout)[:, None] + np.arange(holdout)
+    y_pred = eval_profile[np.arange(len(lengths))[:, None], weeks_hours[test_positions]]
+    mape_val = batch_mape(y_pred, stock[test_positions])
+
+    return [(station, mape_val[row], forecasts[row],
+             {'state': profile_state(full_profile[row])})
+            for row, (station, _) in enumerate(station_series)]
+
+
+def train_arima(station_series, forecast_hours, settings):
+    """
+    Model backend fitting statsmodels ARIMA models station by station, in chunks
+        dispatched to a process pool if more than one worker is configured
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        forecast_hours (pandas DatetimeIndex): hours to forecast
+        settings (dict): model_fun settings; uses model_params, optional_fit_args,
+            workers, chunk_size, holdout_fit, holdout_maxiter, start_params and
+            the stock store, which worker processes memory-map
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station
+    """
+    chunk_size = settings['chunk_size']
+    chunks = [station_series[i:i + chunk_size]
+              for i in range(0, len(station_series), chunk_size)]
+    chunk_results = [None] * len(chunks)
+    fit_args = (len(forecast_hours), settings['model_params'], settings['optional_fit_args'],
+                settings['holdout_fit'], settings['holdout_maxiter'])
+    start_params = settings['start_params']
+    started = time.time()
+    trained = 0
+
+    logger.warning('Running ARIMA model; many station-level outcomes may result in '
+                   '"The problem is unconstrained" output.')
+    if settings['workers'] > 1:
+        logger.info('Training %s station models using %s worker processes.',
+                    len(station_series), settings['workers'])
+
+        # workers read the series from the memory-mapped store; a store built
+        # in memory is written to a temporary directory for them first
+        store_path, temp_dir = settings['store'].path, None
+        if store_path is None:
+            temp_dir = tempfile.mkdtemp()
+            store_path = os.path.join(temp_dir, 'bike_stock_store.npy')
+            settings['store'].save(store_path)
+        try:
+            with ProcessPoolExecutor(max_workers=settings['workers']) as process_pool:
+                futures = {process_pool.submit(fit_store_chunk, store_path,
+                                               [station for station, _ in chunk], *fit_args,
+                                               {station: start_params[station]
+                                                for station, _ in chunk
+                                                if station in start_params}): index
+                           for index, chunk in enumerate(chunks)}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    # station failures are caught in the worker; a worker that
+                    # dies or whose chunk cannot be pickled leaves the chunk's
+                    # stations without a model rather than stopping the run
+                    try:
+                        chunk_results[index] = future.result()
+                    except (BrokenProcessPool, pickle.PicklingError) as err:
+                        logger.error('Worker training stations %s failed: %s:%s',
+                                     [station for station, _ in chunks[index]],
+                                     type(err).__name__, err)
+                        chunk_results[index] = [(station, None, None, None)
+                                                for station, _ in chunks[index]]
+                    trained += len(chunks[index])
+                    log_training_progress(trained, len(station_series), started)
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir)
+    else:
+        for index, chunk in enumerate(chunks):
+            chunk_results[index] = fit_station_chunk(chunk, *fit_args, start_params)
+            trained += len(chunk)
+            log_training_progress(trained, len(station_series), started)
+
+    return list(itertools.chain.from_iterable(chunk_results))
+
+
+def train_fast_ar1(station_series, forecast_hours, settings):
+    """
+    Model backend estimating AR(1) models with intercept for all stations at once
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        forecast_hours (pandas DatetimeIndex): hours to forecast
+        settings (dict): model_fun settings (unused)
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station
+    """
+    return fit_ar1_batch(station_series, len(forecast_hours))
+
+
+def train_hour_of_week(station_series, forecast_hours, settings):
+    """
+    Model backend forecasting all stations at once from their hour-of-week profiles
+    Args:
+        station_series (list): (station id, stock Series) pairs
+        forecast_hours (pandas DatetimeIndex): hours to forecast
+        settings (dict): model_fun settings; uses store for the timestamps
+    Returns:
+        (list): (station id, MAPE, forecasts, fit info) for each station
+    """
+    station_dates = [settings['store'].station_dates(station) for station, _ in station_series]
+    return fit_hour_of_week_batch(station_series, station_dates, forecast_hours)
+
+
+# Model backends selectable in model_fun; each trains the models of a list of
+# (station id, stock Series) pairs and returns (station id, MAPE, forecasts,
+# fit info) for each station
+MODEL_BACKENDS = {'arima': train_arima,
+                  'fast_ar1': train_fast_ar1,
+                  'hour_of_week': train_hour_of_week}
+
+
+def arma_backtest_forecasts(series, origin_counts, intercept, ar, ma, d, steps):
+    """
+    Forecasts from each origin by running ARMA parameters over the observations
+        before it, vectorized over stations of the same orders
+    Args:
+        series (numpy array): each station's stock values, left-aligned in rows
+            of shape (stations, values) and padded with NaN
+        origin_counts (numpy array): number of each station's values before each
+            origin, of shape (stations, folds)
+        intercept (numpy array): intercept c of each station
+        ar (numpy array): autoregressive coefficients of shape (stations, p)
+        ma (numpy array): moving average coefficients of shape (stations, q)
+        d (int): order of differencing
+        steps (int): number of steps forecast from each origin
+    Returns:
+        (numpy array): forecasts of shape (stations, folds, steps), NaN where a
+            station has too few values before an origin
+    """
+    p, q = ar.shape[1], ma.shape[1]
+    stations = np.arange(len(series))[:, None]
+
+    # the series and its successive differences; column t of diffs[k] is value t + k
+    diffs = [series]
+    for _ in range(d):
+        diffs.append(np.diff(diffs[-1], axis=1))
+    stationary = diffs[-1]
+
+    # residuals of the recursion, with the first ones taken as no shock; those
+    # before an origin only depend on the values before it
+    resid = np.zeros_like(stationary)
+    if q:
+        for t in range(stationary.shape[1]):
+            fitted = intercept.copy()
+            for i in range(min(p, t)):
+                fitted += ar[:, i] * stationary[:, t - 1 - i]
+            for j in range(min(q, t)):
+                fitted += ma[:, j] * resid[:, t - 1 - j]
+            resid[:, t] = np.nan_to_num(stationary[:, t] - fitted)
+
+    def before(values, last, count):
+        # values at positions last, last - 1, ..., last - count + 1, NaN before 0
+        positions = last[:, None] - np.arange(count)
+        taken = values[stations, np.maximum(positions, 0)]
+        return np.where(positions >= 0, taken, np.nan)
+
+    forecasts = np.empty(origin_counts.shape + (steps,))
+    for fold in range(origin_counts.shape[1]):
+        last = origin_counts[:, fold] - d - 1
+        lags, shocks = before(stationary, last, p), before(resid, last, q)
+        for step in range(steps):
+            value = intercept + (ar * lags).sum(axis=1) + (ma * shocks).sum(axis=1)
+            value[last < 0] = np.nan
+            forecasts[:, fold, step] = value
+            if p:
+                lags = np.column_stack([value, lags[:, :-1]])
+            if q:
+                shocks = np.column_stack([np.zeros(len(series)), shocks[:, :-1]])
+
+        # undo the differencing from the levels before the origin
+        for k in reversed(range(d)):
+            forecasts[:, fold] = before(diffs[k], origin_counts[:, fold] - 1 - k, 1) + \
+                np.cumsum(forecasts[:, fold], axis=1)
+    return forecasts
+
+
+def backtest_arima(store, states, stations, origin_hours, steps):
+    """
+    Backtest hook of the 'arima' backend: runs each station's fitted ARIMA
+        parameters over its series before each origin and forecasts from there;
+        the parameters are those fit on the whole series, so the scores are
+        in-sample with respect to them
+    Args:
+        store (StockStore): stock series the models were trained on
+        states (dict): forecast state of each station id
+        stations (list): ids of the stations backtested
+        origin_hours (numpy array): datetime64 timestamp of each origin
+        steps (int): number of hours forecast from each origin
+    Returns:
+        (numpy array): forecasts of shape (stations, folds, steps)
+    """
+    rows = store.rows(stations)
+    counts = np.column_stack([store.ends_before(origin)[rows] for origin in origin_hours]) \
+        - store.offsets[rows, None]
+    forecasts = np.empty((len(stations), len(origin_hours), steps))
+
+    # stations whose models have the same orders are filtered together
+    groups = {}
+    for index, station in enumerate(stations):
+        state = states[station]
+        key = (len(state['ar']), len(state['levels']), len(state['ma']))
+        groups.setdefault(key, []).append(index)
+    for (p, d, q), group in groups.items():
+        lengths = np.diff(store.offsets)[rows[group]]
+        series = np.full((len(group), lengths.max()), np.nan)
+        for position, index in enumerate(group):
+            series[position, :lengths[position]] = store.series(stations[index])
+        group_states = [states[stations[index]] for index in group]
+        forecasts[group] = arma_backtest_forecasts(
+            series, counts[group],
+            np.array([state['intercept'] for state in group_states]),
+            np.array([state['ar'] for state in group_states]).reshape(len(group), p),
+            np.array([state['ma'] for state in group_states]).reshape(len(group), q),
+            d, steps)
+    return forecasts
+
+
+def backtest_fast_ar1(store, states, stations, origin_hours, steps):
+    """
+    Backtest hook of the 'fast_ar1' backend: refits the AR(1) models on each
+        station's series before each origin, as in training
+    Args:
+        store (StockStore): stock series the models were trained on
+        states (dict): forecast state of each station id (unused)
+        stations (list): ids of the stations backtested
+        origin_hours (numpy array): datetime64 timestamp of each origin
+        steps (int): number of hours forecast from each origin
+    Returns:
+        (numpy array): forecasts of shape (stations, folds, steps)
+    """
+    rows = store.rows(stations)
+    stock = np.asarray(store.stock, dtype=np.float64)
+    starts = store.offsets[rows]
+    forecasts = np.empty((len(stations), len(origin_hours), steps))
+    for fold, origin in enumerate(origin_hours):
+        ends = store.ends_before(origin)[rows]
+        c_var, phi = ar1_least_squares(stock, starts, ends)
+        last = np.where(ends > starts, stock[np.maximum(ends - 1, 0)], np.nan)
+        forecasts[:, fold] = ar1_forecast(c_var, phi, last, steps)
+    return forecasts
+
+
+def backtest_hour_of_week(store, states, stations, origin_hours, steps):
+    """
+    Backtest hook of the 'hour_of_week' backend: averages each station's stock at
+        each hour of the week over its values before each origin, as in training
+    Args:
+        store (StockStore): stock series the models were trained on
+        states (dict): forecast state of each station id (unused)
+        stations (list): ids of the stations backtested
+        origin_hours (numpy array): datetime64 timestamp of each origin
+        steps (int): number of hours forecast from each origin
+    Returns:
+        (numpy array): forecasts of shape (stations, folds, steps)
+    """
+    rows = store.rows(stations)
+    stock = np.asarray(store.stock, dtype=np.float64)
+    store_rows = np.repeat(np.arange(len(store)), np.diff(store.offsets))
+    weeks_hours = hour_of_week(np.asarray(store.dates))
+    forecasts = np.empty((len(stations), len(origin_hours), steps))
+    for fold, origin in enumerate(origin_hours):
+        used = np.arange(len(stock)) < store.ends_before(origin)[store_rows]
+        profile = weekly_profile(store_rows[used], weeks_hours[used], stock[used], len(store))
+        forecast_hours = np.datetime64(origin, 'h') + np.arange(steps)
+        forecasts[:, fold] = profile[rows][:, hour_of_week(forecast_hours)]
+    return forecasts
+
+
+# Backtest hook of each model backend, forecasting the trained stations from
+# rolling origins the way the backend trains its models; the 'arima' backtest
+# reuses the fitted parameters, and is reported as in-sample
+MODEL_BACKTESTS = {'arima': backtest_arima,
+                   'fast_ar1': backtest_fast_ar1,
+                   'hour_of_week': backtest_hour_of_week}
+IN_SAMPLE_BACKTESTS = {'arima'}
+
+
+def model_fun(dataframe, start_date_args, end_date_args, model_params, optional_fit_args,
+              workers=1, chunk_size=20, backend='arima', holdout_fit='refit',
+              holdout_maxiter=10, holdout_tolerance=None, registry_path=None,
+              state_path=None):
     """
     Trains a ARIMA model for forecasting inventory for each Citi Bike station
         that has the necessary data
     Args:
-        dataframe (pandas DataFrame): input data consisting of bikes by station by day
+        dataframe (pandas DataFrame or StockStore): input data consisting of bikes
+            by station by day, either as a DataFrame or as a (memory-mapped)
+            StockStore from which each station's series is read as a slice
         start_date_args (dict): ARIMA model required fit parameters
         end_date_args (dict): ARIMA model required fit parameters
         model_params (dict): ARIMA model required fit parameters
         optional_fit_args (dict): ARIMA model additional hyperparameters
+        workers (int): number of processes training station models in parallel;
+            1 trains them in this process
+        chunk_size (int): number of stations dispatched to a process at a time
+        backend (str): key of MODEL_BACKENDS: 'arima' to fit statsmodels ARIMA
+            models station by station, 'fast_ar1' to estimate AR(1) models with
+            intercept for all stations at once by least squares (requires p=1,
+            d=0, q=0), or 'hour_of_week' to forecast each station's average stock
+            at each hour of the week
+        holdout_fit (str): how ARIMA holdout forecasts are made: 'refit' fits a
+            second model, 'warm_start' starts that fit from the full-data
+            parameters and 'filter' reuses the full-data parameters without a
+            second fit; see `holdout_mape`
+        holdout_maxiter (int): optimizer iterations of 'warm_start' holdout fits
+        holdout_tolerance (float): largest acceptable drift, in MAPE points, of
+            'warm_start' or 'filter' holdout MAPEs from full refits; checked on
+            the first few stations, with a warning if exceeded (optional)
+        registry_path (str): Parquet file of the fitted parameters, fingerprints
+            and outputs of each station's ARIMA model (optional); stations whose
+            data and settings are unchanged since the run that wrote it are not
+            refit, and the others are warm-started from their registered
+            parameters
+        state_path (str): JSON file to which the forecast state of each station
+            is written, so that forecasts can be computed on demand when
+            serving (optional)
     Returns:
         station_models_df (pandas: ARIMA trained model object
     """
 
-    df_loop = dataframe[['station_id', 'date', 'stock']]
+    if backend not in MODEL_BACKENDS:
+        logger.error("Unknown model backend '%s'; choose one of %s.",
+                     backend, ', '.join(MODEL_BACKENDS))
+        raise ValueError(f'unknown model backend: {backend}')
+    if backend == 'fast_ar1' and (model_params['p'], model_params['d'],
+                                  model_params['q']) != (1, 0, 0):
+        logger.error("The 'fast_ar1' backend only fits ARIMA(1, 0, 0) models; "
+                     "got p=%s, d=%s, q=%s.", model_params['p'], model_params['d'],
+                     model_params['q'])
+        raise ValueError('fast_ar1 requires p=1, d=0, q=0')
+    if holdout_fit not in ('refit', 'warm_start', 'filter'):
+        logger.error("Unknown holdout fit '%s'; choose 'refit', 'warm_start' or 'filter'.",
+                     holdout_fit)
+        raise ValueError(f'unknown holdout fit: {holdout_fit}')
 
-    # get list of each station in the dataset
-    station_list = dataframe.station_id.unique()
+    # partition the input by station once; each station's series is then a
+    # slice of one contiguous stock array rather than a filtered copy
+    if isinstance(dataframe, StockStore):
+        store = dataframe
+    else:
+        store = StockStore.from_frame(dataframe[['station_id', 'date', 'stock']])
+    station_list = store.station_ids
 
     # initial lists to be appended to through training loop
     mapes_station_arima = []
     stations_w_models = []
-    date_time_list = []
-    dict_list = []
+    station_forecasts = []
 
     # Generate forecast time range (default is until August 4 at midnight)
     start_date = datetime(**start_date_args)
     end_date = datetime(**end_date_args)
-    for single_date in date_range_hours(start_date, end_date):
-        date_time_list.append(single_date.strftime("%Y-%m-%d %H:%M"))
+    forecast_hours = pd.date_range(start_date, end_date, freq='H')
+    forecast_hours = forecast_hours[forecast_hours < end_date]
 
-    # for each station in the list, attempt to build an ARIMA model for forecasting
-    warnings.simplefilter('ignore', ConvergenceWarning)
-    logger.warning('Running ARIMA model; many station-level outcomes may result in '
-                   '"The problem is unconstrained" output.')
-    for station in station_list:
-
-        # subset dataframe to station of interest
-        df_train = df_loop.loc[dataframe['station_id'] == station]
-        df_train.reset_index(inplace=True, drop=True)
-        y_var = df_train['stock']
-
-        # only perform training if there are at least 336 hours (2 weeks) of data
-        # with at least 1 bike in that station
-        enough_data_flag = len(df_train.loc[df_train['stock'] > 0])
-        if enough_data_flag > 336:
-
-            # train on all the data
-            arima_def = ARIMA(y_var, order=(model_params['p'],
-                                            model_params['d'],
-                                            model_params['q']))
-            model_arima = arima_def.fit(**optional_fit_args)
-
-            # append model object reference to a list
-            stations_w_models.append(station)
-
-            # for a rough evaluation of each model, train on all but last 12
-            # hours and evaluate on those
-            y_train = y_var.iloc[0:len(y_var) - 12]
-            y_test = y_var.iloc[-12:]
-            arima_model_eval = ARIMA(y_train, order=(model_params['p'],
-                                                     model_params['d'],
-                                                     model_params['q']))
-            model_eval_arima_fit = arima_model_eval.fit(**optional_fit_args)
+    # only perform training if there are at least 336 hours (2 weeks) of data
+    # with at least 1 bike in that station, counted for all stations at once
+    if len(store):
+        enough_data_flag = np.add.reduceat((store.stock > 0).astype(np.int64),
+                                           store.offsets[:-1])
+    else:
+        enough_data_flag = np.zeros(0, dtype=np.int64)
+    station_series = [(station, pd.Series(store.series(station)))
+                      for station in station_list[enough_data_flag > 336]]
 
-            y_pred = model_eval_arima_fit.forecast(len(y_test))[0]
-            mape_result = (abs((y_pred - y_test) / y_test) * 100).mean()
+    # reuse registered models of stations whose data and settings are unchanged
+    # and warm-start the others from their registered parameters
+    registry = load_registry(registry_path) if registry_path and backend == 'arima' else {}
+    model_key = digest([model_params, optional_fit_args, holdout_fit, holdout_maxiter,
+                        forecast_hours[0] if len(forecast_hours) else None,
+                        len(forecast_hours)])
+    params_key = digest([model_params, optional_fit_args.get('trend')])
+    fingerprints = {}
+    station_results = {}
+    start_params = {}
+    if registry_path and backend == 'arima':
+        for station, y_var in station_series:
+            fingerprints[station] = series_fingerprint(y_var)
+            entry = registry.get(station)
+            if entry is None:
+                continue
+            if entry['fingerprint'] == fingerprints[station] and \
+                    entry['model_key'] == model_key and entry.get('state'):
+                station_results[station] = (station, entry['mape'],
+                                            np.asarray(entry['forecasts']),
+                                            {'state': json.loads(entry['state'])})
+            elif entry['params_key'] == params_key:
+                start_params[station] = np.asarray(entry['params'])
+        logger.info('Model registry: reusing %s unchanged station models, warm-starting '
+                    '%s and fitting %s from scratch.', len(station_results),
+                    len(start_params),
+                    len(station_series) - len(station_results) - len(start_params))
+    series_to_fit = [(station, y_var) for station, y_var in station_series
+                     if station not in station_results]
 
-            # To deal with sparse data and to avoid inf results,
-            # cap MAPE upper bound at 100%
-            if mape_result > 100:
-                mape_val = 100
-            else:
-                mape_val = mape_result
+    # build a model for forecasting each station with enough data, using the
+    # selected backend
+    started = time.time()
+    settings = {'model_params': model_params, 'optional_fit_args': optional_fit_args,
+                'workers': workers, 'chunk_size': chunk_size, 'holdout_fit': holdout_fit,
+                'holdout_maxiter': holdout_maxiter, 'start_params': start_params,
+                'store': store}
+    backend_results = MODEL_BACKENDS[backend](series_to_fit, forecast_hours, settings)
+    logger.info("Trained %s station models with the '%s' backend in %.1f s.",
+                len(series_to_fit), backend, time.time() - started)
 
-            mapes_station_arima.append(mape_val)
+    # gather results in station order, so the output does not depend on the
+    # order in which the chunks finished or on which models were reused
+    for result in backend_results:
+        station_results[result[0]] = result
+    failed_stations = 0
+    nonfinite_stations = []
+    states = {}
+    for station, _ in station_series:
+        _, mape_val, forecasts, fit_info = station_results[station]
+        if forecasts is None:
+            failed_stations += 1
+            registry.pop(station, None)
+            continue
+        # NaN or infinite forecasts cannot be rounded to a number of bikes
+        if not np.isfinite(forecasts).all():
+            nonfinite_stations.append(station)
+            registry.pop(station, None)
+            continue
+        states[station] = fit_info['state']
+        if 'params' in fit_info and registry_path and backend == 'arima':
+            registry[station] = registry_entry(station, fingerprints[station], model_key,
+                                               params_key, mape_val, forecasts, fit_info)
 
-            # Build forecast table
-            forecasts = pd.DataFrame(model_arima.forecast(
-                steps=len(date_time_list))).transpose()[0]
+        # append model object reference to a list
+        stations_w_models.append(station)
+        mapes_station_arima.append(mape_val)
 
-            for i in range(0, len(date_time_list)):
-                forecast_d = {'station_id': station,
-                              'date_time': date_time_list[i],
-                              'pred_num_bikes': round(forecasts[i])}
-                dict_list.append(forecast_d)
+        station_forecasts.append(forecasts)
 
-        else:
-            pass
+    if failed_stations:
+        logger.warning('Models failed for %s stations; they are left out '
+                       'of the predictions.', failed_stations)
+    if nonfinite_stations:
+        logger.warning('Models of %s stations forecast NaN or infinite values; they are '
+                       'left out of the predictions: %s', len(nonfinite_stations),
+                       ', '.join(str(station) for station in nonfinite_stations))
 
-    # Create a dataframe of predictions by station, date, and hour
+    if registry_path and backend == 'arima':
+        save_registry(registry, registry_path)
+        logger.info('Success! Saved model registry of %s stations to "%s".',
+                    len(registry), registry_path)
+
+    if state_path:
+        save_forecast_states(states, forecast_hours, state_path)
+        logger.info('Success! Saved forecast states of %s stations to "%s".',
+                    len(states), state_path)
+
+    # compare a few holdout evaluations made without a full refit with refits
+    if backend == 'arima' and holdout_fit != 'refit' and holdout_tolerance is not None:
+        check_holdout_drift(station_series, dict(zip(stations_w_models, mapes_station_arima)),
+                            model_params, optional_fit_args, holdout_tolerance)
+
+    # Create a dataframe of predictions by station, date, and hour, column by
+    # column: each station's id repeated over the forecast hours, which are tiled
+    # once per station, next to the concatenated forecasts
     try:
-        predictions = pd.DataFrame(dict_list)
-        predictions['date_time'] = pd.to_datetime(predictions['date_time'])
-        predictions['date'] = predictions['date_time'].dt.date
-        predictions['hour'] = predictions['date_time'].dt.hour
-        predictions_output = predictions[['station_id', 'date', 'hour',
-                                          'pred_num_bikes']]
+        forecasts_all = np.concatenate(station_forecasts) if station_forecasts \
+            else np.zeros(0)
+        predictions_output = pd.DataFrame({
+            'station_id': np.repeat(np.asarray(stations_w_models, dtype=np.int64),
+                                    len(forecast_hours)),
+            'date': np.tile(forecast_hours.date, len(stations_w_models)),
+            'hour': np.tile(forecast_hours.hour.values.astype(np.int64),
+                            len(stations_w_models)),
+            'pred_num_bikes': np.round(forecasts_all).astype(np.int64)})
     except ValueError as val_e:
         logging.error('ARIMA model structure formatted incorrectly. '
                       'Check values of stations included.')
@@ -136,6 +842,59 @@ def model_fun(dataframe, start_date_args, end_date_args, model_params, optional_
     return predictions_output, station_mapes_df
 
 
+def check_holdout_drift(station_series, station_mapes, model_params, optional_fit_args,
+                        holdout_tolerance, sample_size=3):
+    """
+    Refits the holdout models of the first few stations from scratch and warns if
+        the MAPE of their cheaper holdout evaluations drifted beyond the tolerance
+    Args:
+        station_series (list): (station id, stock Series) pairs that were trained
+        station_mapes (dict): holdout MAPE of each trained station
+        model_params (dict): ARIMA model required fit parameters
+        optional_fit_args (dict): ARIMA model additional hyperparameters
+        holdout_tolerance (float): largest acceptable MAPE drift, in MAPE points
+        sample_size (int): number of stations refit
+    Returns:
+        (float): largest MAPE drift among the sampled stations
+    """
+    drifts = []
+    for station, y_var in station_series:
+        if len(drifts) == sample_size:
+            break
+        if station not in station_mapes:
+            continue
+        try:
+            refit_mape = holdout_mape(y_var, model_params, optional_fit_args)
+        except (ValueError, LinAlgError):
+            continue
+        drifts.append(abs(refit_mape - station_mapes[station]))
+
+    max_drift = max(drifts) if drifts else 0
+    if max_drift > holdout_tolerance:
+        logger.warning('Holdout MAPE drifted by up to %.3f points from full refits '
+                       '(tolerance %s); consider holdout_fit: refit.',
+                       max_drift, holdout_tolerance)
+    else:
+        logger.info('Holdout MAPE within %.3f points of full refits.', max_drift)
+    return max_drift
+
+
+def log_training_progress(trained, total, started):
+    """
+    Logs the number of stations trained so far and the estimated time remaining
+    Args:
+        trained (int): number of stations trained so far
+        total (int): number of stations to train
+        started (float): time.time() at which training started
+    Returns:
+        None -- logs the progress
+    """
+    elapsed = time.time() - started
+    remaining = elapsed / trained * (total - trained) if trained else 0
+    logger.info('Trained %s/%s station models (%.0f%%) in %.0f s; about %.0f s remaining.',
+                trained, total, 100 * trained / total, elapsed, remaining)
+
+
 def run_train_models(args):
     """
     Wrapper function to run model traning and evaluation steps
@@ -156,91 +915,181 @@ def run_train_models(args):
                      "correct filename/path.")
         sys.exit(1)
 
-    # get station level data, train station forecasting models
-    logger.info('Reading in time series "bike_stock" data from S3 '
-                'at %s...', args.s3_bucket)
-    bike_stock_data = download_csv_s3(s3_bucket_name=args.s3_bucket,
-                                      bucket_dir_path=config['download_csv_s3']
-                                      ['bike_stock_data']['bucket_dir_path'],
-                                      input_filename=config['download_csv_s3']
-                                      ['bike_stock_data']['input_filename'],
-                                      output_filename=config['download_csv_s3']
-                                      ['bike_stock_data']['output_filename'])
+    # Bike stock and predictions data are stored in the configured storage format
+    storage_format = config['storage_format']
+    prediction_path = table_path(config['model_run']['prediction_path'], storage_format)
+
+    # get station level data, train station forecasting models; a local stock
+    # store written by data processing is memory-mapped instead of downloaded
+    store_path = config['model_run'].get('stock_store_path')
+    if store_path and os.path.exists(store_path):
+        logger.info('Memory-mapping time series "bike_stock" data from the '
+                    'stock store at %s...', store_path)
+        bike_stock_data = StockStore.open(store_path)
+    else:
+        logger.info('Reading in time series "bike_stock" data from S3 '
+                    'at %s...', args.s3_bucket)
+        bike_stock_data = download_csv_s3(s3_bucket_name=args.s3_bucket,
+                                          bucket_dir_path=config['download_csv_s3']
+                                          ['bike_stock_data']['bucket_dir_path'],
+                                          input_filename=table_path(
+                                              config['download_csv_s3']['bike_stock_data']
+                                              ['input_filename'], storage_format),
+                                          output_filename=table_path(
+                                              config['download_csv_s3']['bike_stock_data']
+                                              ['output_filename'], storage_format),
+                                          skip_unchanged=config['s3_skip_unchanged'])
 
+    # Partition the bike stock data by station once for all backends, and lay it
+    # out as a dense station x hour matrix for the backtest; the matrix written
+    # by data processing along with the local store is memory-mapped instead
+    matrix_path = config['model_run'].get('stock_matrix_path')
+    if isinstance(bike_stock_data, StockStore) and matrix_path \
+            and os.path.exists(matrix_path):
+        logger.info('Memory-mapping the bike stock matrix at %s...', matrix_path)
+        matrix, matrix_stations, matrix_hours = load_stock_matrix(matrix_path)
+    else:
+        if not isinstance(bike_stock_data, StockStore):
+            bike_stock_data = StockStore.from_frame(bike_stock_data[['station_id', 'date',
+                                                                     'stock']])
+        matrix, matrix_stations, matrix_hours = \
+            build_stock_matrix(bike_stock_data.to_frame())
+
+    # Train the configured backend for the predictions, and any other backends
+    # listed for comparison, reporting the accuracy and wall-clock of each; each
+    # backend's forecasts are backtested in a background thread while the next
+    # backend trains
+    backend = config['model_run']['backend']
+    backends = [backend]
+    order = (config['arima_params']['p'], config['arima_params']['d'],
+             config['arima_params']['q'])
+    for name in config['model_run']['compare_backends'] or []:
+        if name == backend:
+            continue
+        if name == 'fast_ar1' and order != (1, 0, 0):
+            logger.warning("Skipping the 'fast_ar1' comparison: it only fits ARIMA(1, 0, 0) "
+                           "models, and arima_params is %s.", order)
+            continue
+        backends.append(name)
     logger.info("Training models for each station, this will take"
                 " a few moments.")
     logger.warning("You may see some warnings issued from the ARIMA"
                    " fit. Due to the nature of the data for some "
                    "stations, the fit/optimization algorithm encounters"
                    " issues.")
-    predictions, station_mapes = model_fun(dataframe=bike_stock_data,
-                                           start_date_args=config['forecast_date_range']
-                                           ['start_date'],
-                                           end_date_args=config['forecast_date_range']
-                                           ['end_date'],
-                                           model_params=config['arima_params'],
-                                           optional_fit_args=config['arima_fit_params'])
-
-    # Append station-level characteristics to predictions table
-    logger.info('Reading in stations data from S3 at %s...', args.s3_bucket)
-    stations_data = download_csv_s3(s3_bucket_name=args.s3_bucket,
-                                    bucket_dir_path=config['download_csv_s3']
-                                    ['stations_data']['bucket_dir_path'],
-                                    input_filename=config['download_csv_s3']
-                                    ['stations_data']['input_filename'],
-                                    output_filename=config['download_csv_s3']
-                                    ['stations_data']['output_filename'])
-
-    # Merge predictions and stations data
-    prediction_df = pd.merge(predictions, stations_data, how='left')
-    prediction_df = prediction_df[['station_id', 'name',
-                                   'latitude', 'longitude',
-                                   'date', 'hour', 'pred_num_bikes']]. \
-        sort_values(['longitude', 'latitude'], ascending=(True, False))
-
-    # Save predictions to local file
-    prediction_df.to_csv(config['model_run']['prediction_path'], index=False)
-    logger.info('Success! Added predictions data locally to: '
-                '"%s"', config['model_run']['prediction_path'])
-
-    # Save station-level MAPE to local file
-    station_mapes.to_csv(config['model_run']['mape_path'], index=False)
-    logger.info('Success! Added predictions evaluation data '
-                'locally to: "%s"', config['model_run']['mape_path'])
-
-    # Save average MAPE to local file
-    avg_mape = open(config['avg_mape_filepath'], "w")
-    avg_mape.write('Average MAPE across all stations: ' +
-                   str(station_mapes.MAPE.mean()))
-    avg_mape.close()
-    logger.info('Success! Added avg. MAPE data '
-                'locally to: "%s"', config['avg_mape_filepath'])
-
-    # Save predictions and performance metrics to S3
-    # Predictions
-    upload_to_s3(file_local_path=config['model_run']['prediction_path'],
-                 s3_bucket=args.s3_bucket,
-                 s3_directory=config['model_run']['bucket_dir_path'])
-    # Performance metrics
-    upload_to_s3(file_local_path=config['model_run']['mape_path'],
-                 s3_bucket=args.s3_bucket,
-                 s3_directory=config['model_run']['bucket_dir_path'])
-    # Average MAPE
-    upload_to_s3(file_local_path=config['avg_mape_filepath'],
-                 s3_bucket=args.s3_bucket,
-                 s3_directory=config['model_run']['bucket_dir_path'])
+    backend_report = []
+    evaluations = []
+    evaluator = ThreadPoolExecutor(max_workers=1)
+    state_stem = os.path.splitext(config['model_run']['state_path'])[0]
+    for name in backends:
+        state_path = config['model_run']['state_path'] if name == backend \
+            else f'{state_stem}_{name}.json'
+        started = time.time()
+        backend_predictions, backend_mapes = model_fun(
+            dataframe=bike_stock_data,
+            start_date_args=config['forecast_date_range']['start_date'],
+            end_date_args=config['forecast_date_range']['end_date'],
+            model_params=config['arima_params'],
+            optional_fit_args=config['arima_fit_params'],
+            workers=config['model_run']['workers'],
+            chunk_size=config['model_run']['chunk_size'],
+            backend=name,
+            holdout_fit=config['model_run']['holdout_fit'],
+            holdout_maxiter=config['model_run']['holdout_maxiter'],
+            holdout_tolerance=config['model_run']['holdout_tolerance'],
+            registry_path=config['model_run']['registry_path'],
+            state_path=state_path)
+        backend_report.append({'backend': name,
+                               'stations': len(backend_mapes),
+                               'avg_mape': backend_mapes.MAPE.mean(),
+                               'seconds': round(time.time() - started, 3)})
+        logger.info("Backend '%s': average MAPE %.3f across %s stations in %.1f s.",
+                    name, backend_report[-1]['avg_mape'], backend_report[-1]['stations'],
+                    backend_report[-1]['seconds'])
+        if name == backend:
+            predictions = backend_predictions
+        states = load_forecast_states(state_path)[2]
+        evaluations.append((name, evaluator.submit(
+            evaluate_forecasts, matrix, matrix_stations['station_id'].values, matrix_hours,
+            [station for station in states if station in bike_stock_data],
+            functools.partial(MODEL_BACKTESTS[name], bike_stock_data, states),
+            config['model_run']['eval_horizons'], config['model_run']['eval_folds'],
+            config['model_run']['eval_fold_step'])))
+
+    # Save accuracy and wall-clock of each backend to local file
+    pd.DataFrame(backend_report).to_csv(config['model_run']['backend_report_path'],
+                                        index=False)
+    logger.info('Success! Added model backend report locally to: "%s"',
+                config['model_run']['backend_report_path'])
+
+    # In the 'table' serving mode, the web app reads every hourly prediction from
+    # the predictions table; in the 'lazy' mode it computes forecasts on demand
+    # from the forecast states, and the predictions table is not written
+    write_predictions = config['model_run']['serving_mode'] == 'table'
+    if write_predictions:
+        # Append station-level characteristics to predictions table
+        logger.info('Reading in stations data from S3 at %s...', args.s3_bucket)
+        stations_data = download_csv_s3(s3_bucket_name=args.s3_bucket,
+                                        bucket_dir_path=config['download_csv_s3']
+                                        ['stations_data']['bucket_dir_path'],
+                                        input_filename=config['download_csv_s3']
+                                        ['stations_data']['input_filename'],
+                                        output_filename=config['download_csv_s3']
+                                        ['stations_data']['output_filename'],
+                                        skip_unchanged=config['s3_skip_unchanged'])
+
+        # Merge predictions and stations data
+        prediction_df = pd.merge(predictions, stations_data, how='left')
+        prediction_df = prediction_df[['station_id', 'name',
+                                       'latitude', 'longitude',
+                                       'date', 'hour', 'pred_num_bikes']]. \
+            sort_values(['longitude', 'latitude'], ascending=(True, False))
+
+        # Save predictions to local file
+        write_table(prediction_df, prediction_path, storage_format)
+        logger.info('Success! Added predictions data locally to: '
+                    '"%s"', prediction_path)
+
+    # Save the backtest metrics of each backend, station and horizon to local file
+    metrics = pd.concat([evaluation.result().assign(backend=name,
+                                                    in_sample=name in IN_SAMPLE_BACKTESTS)
+                         for name, evaluation in evaluations])
+    evaluator.shutdown()
+    metrics = metrics[['backend', 'in_sample'] + METRICS_COLUMNS]
+    metrics.to_csv(config['model_run']['metrics_path'], index=False)
+    logger.info('Success! Added backtest metrics locally to: "%s"',
+                config['model_run']['metrics_path'])
+
+    # Save predictions, backtest metrics, forecast states and the model registry
+    # to S3 in parallel
+    output_paths = [config['model_run']['metrics_path'],
+                    config['model_run']['backend_report_path'],
+                    config['model_run']['state_path']]
+    if write_predictions:
+        output_paths.insert(0, prediction_path)
+    registry_path = config['model_run']['registry_path']
+    if registry_path and os.path.exists(registry_path):
+        output_paths.append(registry_path)
+    upload_many_to_s3(file_local_paths=output_paths,
+                      s3_bucket=args.s3_bucket,
+                      s3_directory=config['model_run']['bucket_dir_path'],
+                      skip_unchanged=config['s3_skip_unchanged'])
     logger.info('Success! Added predictions and performance '
                 'metrics data to the "%s" S3 bucket in the "%s" folder.',
                 args.s3_bucket, config['model_run']['bucket_dir_path'])
 
     # Save predictions to Database
-    logger.info('Writing predictions data to database at %s.',
-                args.engine_string)
-    add_to_database(prediction_df, "predictions", 'replace',
+    if write_predictions:
+        logger.info('Writing predictions data to database at %s.',
                     args.engine_string)
-    logger.info('Success! Added predictions data to the database'
-                ' at "%s"', args.engine_string)
+        add_to_database(prediction_df, "predictions", 'replace',
+                        args.engine_string)
+        logger.info('Success! Added predictions data to the database'
+                    ' at "%s"', args.engine_string)
 
-    # Report average MAPE, write to a csv file
-    logger.info('Average MAPE across all stations: %s',
-                str(station_mapes.MAPE.mean()))
+    # Report the average backtest errors of the configured backend
+    summary = metrics[metrics.backend == backend].groupby('horizon')[
+        ['MAPE', 'sMAPE', 'MAE']].mean()
+    for horizon, row in summary.iterrows():
+        logger.info('Backtest at %sh across all stations: MAPE %.3f, sMAPE %.3f, '
+                    'MAE %.3f', horizon, row.MAPE, row.sMAPE, row.MAE)
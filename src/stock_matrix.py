@@ -0,0 +1,133 @@
+"""Compact dense station x hour representation of the processed bike stock data."""
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+def build_stock_matrix(bike_df):
+    """
+    Pivots the long-format bike stock data into a dense station x hour matrix
+    Args:
+        bike_df (pandas DataFrame): output of `process_bike_data`, with the columns
+            station_id, date (hourly timestamp) and stock, and optionally name,
+            latitude and longitude
+    Returns:
+        matrix (numpy array): float32 array of shape (stations, hours) holding the
+            stock of each station at each hour, NaN where the hour has no data
+        stations (pandas DataFrame): station dimension table (station_id and any
+            of name, latitude, longitude) whose row order matches the matrix rows
+        hours (pandas DatetimeIndex): hourly timestamps matching the matrix columns
+    """
+    station_columns = [column for column in ['station_id', 'name', 'latitude', 'longitude']
+                       if column in bike_df.columns]
+    stations = bike_df[station_columns]. \
+        drop_duplicates('station_id').sort_values('station_id').reset_index(drop=True)
+    dates = pd.to_datetime(bike_df['date']).values.astype('M8[h]')
+    hours = pd.date_range(dates.min(), dates.max(), freq='H')
+
+    rows = np.searchsorted(stations['station_id'].values, bike_df['station_id'].values)
+    cols = (dates - dates.min()).astype(np.int64)
+    matrix = np.full((len(stations), len(hours)), np.nan, dtype=np.float32)
+    matrix[rows, cols] = bike_df['stock'].values
+
+    return matrix, stations, hours
+
+
+def extend_stock_matrix(matrix, stations, hours, bike_df, replaced_stations, replaced_days):
+    """
+    Adds long-format bike stock data of some (station, day) partitions to a stock
+        matrix, in place of the partitions' previous stock
+    Args:
+        matrix (numpy array): stock matrix as returned by `build_stock_matrix`
+        stations (pandas DataFrame): station dimension table of the matrix rows
+        hours (pandas DatetimeIndex): hourly timestamps of the matrix columns
+        bike_df (pandas DataFrame): bike stock of the partitions, with the columns
+            of `build_stock_matrix`
+        replaced_stations (numpy array): station id of each replaced partition
+        replaced_days (numpy array): datetime64[D] day of each replaced partition
+    Returns:
+        matrix (numpy array): float32 array covering the stations and hours of
+            both the matrix and bike_df
+        stations (pandas DataFrame): station dimension table of the matrix rows
+        hours (pandas DatetimeIndex): hourly timestamps of the matrix columns
+    """
+    blocks = [(matrix, stations, hours)]
+    if len(bike_df):
+        blocks.append(build_stock_matrix(bike_df))
+    all_stations = pd.concat([block_stations for _, block_stations, _ in blocks]). \
+        drop_duplicates('station_id', keep='last').sort_values('station_id'). \
+        reset_index(drop=True)
+    all_hours = pd.date_range(min(block_hours[0] for _, _, block_hours in blocks),
+                              max(block_hours[-1] for _, _, block_hours in blocks), freq='H')
+    station_index = all_stations['station_id'].values
+
+    def cells(block_stations, block_hours):
+        rows = np.searchsorted(station_index, block_stations['station_id'].values)
+        start = (block_hours[0] - all_hours[0]) // pd.Timedelta(hours=1)
+        return rows[:, None], start + np.arange(len(block_hours))
+
+    extended = np.full((len(all_stations), len(all_hours)), np.nan, dtype=np.float32)
+    extended[cells(stations, hours)] = matrix
+
+    # clear the replaced partitions, then fill in their new stock
+    rows = np.searchsorted(station_index, replaced_stations)
+    first_hour = all_hours[0].to_datetime64().astype('M8[h]')
+    cols = (replaced_days.astype('M8[h]') - first_hour).astype(np.int64)[:, None] + \
+        np.arange(24)
+    inside = (cols >= 0) & (cols < len(all_hours)) & \
+        np.isin(replaced_stations, station_index)[:, None]
+    extended[np.broadcast_to(rows[:, None], cols.shape)[inside], cols[inside]] = np.nan
+    for block_matrix, block_stations, block_hours in blocks[1:]:
+        block_cells = cells(block_stations, block_hours)
+        extended[block_cells] = np.where(np.isnan(block_matrix), extended[block_cells],
+                                         block_matrix)
+
+    return extended, all_stations, all_hours
+
+
+def save_stock_matrix(matrix, stations, hours, matrix_path):
+    """
+    Saves the dense stock matrix as a .npy file that can be memory-mapped,
+        alongside its station dimension table and hour axis
+    Args:
+        matrix (numpy array): stock matrix as returned by `build_stock_matrix`
+        stations (pandas DataFrame): station dimension table
+        hours (pandas DatetimeIndex): hourly timestamps of the matrix columns
+        matrix_path (str): path of the .npy file; the station table is written
+            next to it as <name>_stations.csv and the hour axis as <name>.json
+    Returns:
+        None -- writes the three files
+    """
+    stem = os.path.splitext(matrix_path)[0]
+    np.save(matrix_path, matrix)
+    stations.to_csv(f'{stem}_stations.csv', index=False)
+    with open(f'{stem}.json', 'w') as meta_file:
+        json.dump({'start': str(hours[0]), 'hours': len(hours)}, meta_file)
+    logger.debug("Stock matrix of shape %s written to %s", matrix.shape, matrix_path)
+
+
+def load_stock_matrix(matrix_path, mmap_mode='r'):
+    """
+    Loads a stock matrix saved by `save_stock_matrix`
+    Args:
+        matrix_path (str): path of the .npy file
+        mmap_mode (str): memory-map mode passed to `numpy.load`; None reads
+            the whole matrix into memory
+    Returns:
+        matrix (numpy array): float32 array of shape (stations, hours)
+        stations (pandas DataFrame): station dimension table whose row order
+            matches the matrix rows, as returned by `build_stock_matrix`
+        hours (pandas DatetimeIndex): hourly timestamps matching the matrix columns
+    """
+    stem = os.path.splitext(matrix_path)[0]
+    matrix = np.load(matrix_path, mmap_mode=mmap_mode)
+    stations = pd.read_csv(f'{stem}_stations.csv')
+    with open(f'{stem}.json', 'r') as meta_file:
+        meta = json.load(meta_file)
+    hours = pd.date_range(meta['start'], periods=meta['hours'], freq='H')
+    return matrix, stations, hours
@@ -0,0 +1,155 @@
+"""Memory-mapped on-disk store of the bike stock time series, indexed by station."""
+import os
+import logging
+import numpy as np
+import pandas as pd
+
+# Logging
+logger = logging.getLogger(__name__)
+
+
+class StockStore:
+    """Bike stock series of all stations held back to back in one array.
+
+    Each station's hourly `stock` values are contiguous and located through a
+    per-station offset index, so reading one station's series is a slice of
+    the array. When opened from disk the arrays are memory-mapped: only the
+    pages of the stations that are read get loaded, and several processes
+    reading the same store share them through the OS page cache.
+    """
+
+    def __init__(self, stock, dates, station_ids, offsets):
+        """
+        Args:
+            stock (numpy array): stock values of all stations, grouped by station
+                and ordered by time within each station
+            dates (numpy array): datetime64[h] timestamp of each stock value
+            station_ids (numpy array): station ids, in the order they appear in `stock`
+            offsets (numpy array): start position of each station's values in
+                `stock`, followed by the total length
+        """
+        self.stock = stock
+        self.dates = dates
+        self.station_ids = station_ids
+        self.offsets = offsets
+        self.path = None
+        self._rows = {station: row for row, station in enumerate(station_ids.tolist())}
+
+    @classmethod
+    def from_frame(cls, dataframe):
+        """
+        Builds an in-memory store from long-format bike stock data
+        Args:
+            dataframe (pandas DataFrame): bike stock data with the columns
+                station_id, date and stock
+        Returns:
+            (StockStore): store holding each station's stock series
+        """
+        ordered = dataframe.sort_values(['station_id', 'date'], kind='mergesort')
+        station_col = ordered['station_id'].values
+        starts = np.flatnonzero(np.r_[True, station_col[1:] != station_col[:-1]][:len(ordered)])
+        return cls(stock=ordered['stock'].values.astype(np.float64, copy=False),
+                   dates=pd.to_datetime(ordered['date']).values.astype('M8[h]'),
+                   station_ids=station_col[starts],
+                   offsets=np.r_[starts, len(ordered)].astype(np.int64))
+
+    @classmethod
+    def open(cls, store_path, mmap_mode='r'):
+        """
+        Opens a store written by `save`
+        Args:
+            store_path (str): path of the store's stock .npy file
+            mmap_mode (str): memory-map mode passed to `numpy.load`; None reads
+                the arrays into memory
+        Returns:
+            (StockStore): store backed by the files at store_path, which it keeps
+                as its `path`
+        """
+        stem = os.path.splitext(store_path)[0]
+        index = np.load(f'{stem}_index.npy')
+        store = cls(stock=np.load(store_path, mmap_mode=mmap_mode),
+                    dates=np.load(f'{stem}_dates.npy', mmap_mode=mmap_mode),
+                    station_ids=index[:-1, 0],
+                    offsets=index[:, 1])
+        store.path = store_path
+        return store
+
+    def save(self, store_path):
+        """
+        Writes the store as memory-mappable .npy files
+        Args:
+            store_path (str): path of the stock .npy file; the timestamps and the
+                per-station offset index are written next to it as
+                <name>_dates.npy and <name>_index.npy
+        Returns:
+            None -- writes the three files
+        """
+        stem = os.path.splitext(store_path)[0]
+        np.save(store_path, self.stock)
+        np.save(f'{stem}_dates.npy', self.dates)
+        index = np.column_stack([np.r_[self.station_ids, -1], self.offsets]).astype(np.int64)
+        np.save(f'{stem}_index.npy', index)
+        logger.debug("Stock store of %s stations written to %s", len(self), store_path)
+
+    def to_frame(self):
+        """
+        Returns:
+            (pandas DataFrame): long-format station_id, date and stock columns
+        """
+        return pd.DataFrame({'station_id': np.repeat(self.station_ids, np.diff(self.offsets)),
+                             'date': self.dates,
+                             'stock': self.stock})
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def __contains__(self, station):
+        return station in self._rows
+
+    def series(self, station):
+        """
+        Returns one station's stock series without copying it
+        Args:
+            station (int): station id
+        Returns:
+            (numpy array): the station's stock values in time order
+        """
+        row = self._rows[station]
+        return self.stock[self.offsets[row]:self.offsets[row + 1]]
+
+    def station_dates(self, station):
+        """
+        Returns the timestamps of one station's stock series without copying them
+        Args:
+            station (int): station id
+        Returns:
+            (numpy array): datetime64[h] timestamps of the station's stock values
+        """
+        row = self._rows[station]
+        return self.dates[self.offsets[row]:self.offsets[row + 1]]
+
+    def rows(self, stations):
+        """
+        Locates stations in the offset index
+        Args:
+            stations (list): station ids
+        Returns:
+            (numpy array): row of each station, whose values are
+                stock[offsets[row]:offsets[row + 1]]
+        """
+        return np.array([self._rows[station] for station in stations], dtype=np.int64)
+
+    def ends_before(self, date):
+        """
+        Locates the end of each station's values before a timestamp, counted for
+            all stations at once
+        Args:
+            date (numpy datetime64): timestamp
+        Returns:
+            (numpy array): position in `stock` after each station's last value
+                dated before `date`, by row
+        """
+        before = (self.dates < np.datetime64(date, 'h')).astype(np.int64)
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        return self.offsets[:-1] + np.add.reduceat(before, self.offsets[:-1])
@@ -0,0 +1,304 @@
+"""Tests for data_download_trips.py module."""
+import io
+import os
+import json
+import threading
+import zipfile
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import pytest
+import requests
+import pandas as pd
+from src import data_download_trips
+from src.data_download_trips import fetch_trips_zip, aggregate_trips_zip, parse_trip_hours, \
+    download_trips_data
+
+raw_trips = ('tripduration,starttime,stoptime,start station id,start station name,'
+             'start station latitude,start station longitude,end station id\n'
+             '300,2020-03-01 06:10:01.1230,2020-03-01 06:15:01.1230,72,a,0,0,79\n'
+             '300,2020-03-01 06:20:01.1230,2020-03-01 06:25:01.1230,79,b,0,0,72\n'
+             '300,2020-03-01 06:40:01.1230,2020-03-01 07:05:01.1230,72,a,0,0,79\n'
+             '300,2020-03-01 07:10:01.1230,2020-03-01 07:15:01.1230,79,b,0,0,72\n'
+             '300,2020-03-01 07:20:01.1230,2020-03-01 07:25:01.1230,72,a,0,0,72\n')
+
+
+@pytest.fixture
+def trips_zip(tmp_path):
+    """Writes a small monthly trips .zip file."""
+    zip_path = str(tmp_path / '202003-citibike-tripdata.csv.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zip_f:
+        zip_f.writestr('202003-citibike-tripdata.csv', raw_trips)
+    return zip_path
+
+
+class ServedDirectoryHandler(SimpleHTTPRequestHandler):
+    """Serves the server's `served_directory`; `directory=` needs Python 3.7."""
+
+    def translate_path(self, path):
+        relative = os.path.relpath(super().translate_path(path), os.getcwd())
+        return os.path.join(self.server.served_directory, relative)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """Serves the files in a temporary directory over HTTP."""
+    served = tmp_path / 'served'
+    served.mkdir()
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zip_f:
+        zip_f.writestr('202003-citibike-tripdata.csv', 'a,b,c\n1,2,3\n')
+    (served / '202003-citibike-tripdata.csv.zip').write_bytes(buffer.getvalue())
+    (served / 'not_a_zip.csv.zip').write_bytes(b'<html>Access Denied</html>')
+
+    server = HTTPServer(('127.0.0.1', 0), ServedDirectoryHandler)
+    server.served_directory = str(served)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/', len(buffer.getvalue())
+    server.shutdown()
+
+
+def test_fetch_trips_zip(file_server, tmp_path):
+    """Test for fetch_trips_zip happy path."""
+    url_stem, size = file_server
+    f_path = str(tmp_path / '202003.zip')
+
+    output = fetch_trips_zip(f_path, f'{url_stem}202003-citibike-tripdata.csv.zip',
+                             retries=2, backoff=0, timeout=5)
+
+    assert output['status'] == 'ok'
+    assert output['bytes'] == size
+    assert output['attempts'] == 1
+    assert zipfile.is_zipfile(f_path)
+
+
+def test_fetch_trips_zip_unhappy(file_server, tmp_path):
+    """Test for fetch_trips_zip unhappy path."""
+    url_stem, _ = file_server
+    f_path = str(tmp_path / 'not_a_zip.zip')
+
+    output = fetch_trips_zip(f_path, f'{url_stem}not_a_zip.csv.zip',
+                             retries=2, backoff=0, timeout=5)
+
+    assert output['status'] == 'failed'
+    assert output['attempts'] == 2
+
+
+def test_fetch_trips_zip_cached(file_server, tmp_path):
+    """Test for fetch_trips_zip skipping an unchanged cached file."""
+    url_stem, size = file_server
+    f_path = str(tmp_path / '202003.zip')
+    url = f'{url_stem}202003-citibike-tripdata.csv.zip'
+
+    first = fetch_trips_zip(f_path, url, retries=2, backoff=0, timeout=5)
+    output = fetch_trips_zip(f_path, url, retries=2, backoff=0, timeout=5, cached=first)
+
+    assert output['status'] == 'cached'
+    assert output['bytes'] == 0
+    assert output['size'] == size
+    assert output['md5'] == first['md5']
+
+
+def test_fetch_trips_zip_cached_unhappy(file_server, tmp_path):
+    """Test for fetch_trips_zip re-downloading a corrupted cached file."""
+    url_stem, size = file_server
+    f_path = str(tmp_path / '202003.zip')
+    url = f'{url_stem}202003-citibike-tripdata.csv.zip'
+
+    first = fetch_trips_zip(f_path, url, retries=2, backoff=0, timeout=5)
+    with open(f_path, 'r+b') as zip_file:
+        zip_file.write(b'corrupt')
+    output = fetch_trips_zip(f_path, url, retries=2, backoff=0, timeout=5, cached=first)
+
+    assert output['status'] == 'ok'
+    assert output['bytes'] == size
+    assert output['md5'] == first['md5']
+
+
+class RangeResponse:
+    """Stands in for the responses of a server that only serves Range requests
+    starting within the file."""
+
+    def __init__(self, content, headers=None):
+        self.content = content
+        self.headers = {'ETag': '"v1"', 'Content-Length': str(len(content))}
+        self.status_code = 200
+        if headers and 'Range' in headers:
+            offset = int(headers['Range'][len('bytes='):-1])
+            if offset >= len(content):
+                self.status_code = 416
+                self.headers = {'Content-Range': f'bytes */{len(content)}'}
+            else:
+                self.status_code = 206
+                self.content = content[offset:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size):
+        return [self.content]
+
+
+@pytest.mark.parametrize('part_bytes', [0, 1])
+def test_fetch_trips_zip_resume_complete(trips_zip, tmp_path, monkeypatch, part_bytes):
+    """Test for fetch_trips_zip finalizing a complete or overlong .part file."""
+    with open(trips_zip, 'rb') as zip_file:
+        content = zip_file.read()
+    f_path = str(tmp_path / '202003.zip')
+    with open(f'{f_path}.part', 'wb') as part_file:
+        part_file.write(content + b'x' * part_bytes)
+    monkeypatch.setattr(requests, 'head', lambda *args, **kwargs: RangeResponse(content))
+    monkeypatch.setattr(requests, 'get',
+                        lambda *args, **kwargs: RangeResponse(content, kwargs['headers']))
+
+    output = fetch_trips_zip(f_path, 'http://example.com/202003.zip', retries=2, backoff=0,
+                             timeout=5, cached={'etag': '"v1"', 'complete': False})
+
+    assert output['status'] == 'ok'
+    assert output['attempts'] == 1 + part_bytes
+    assert output['bytes'] == len(content) * part_bytes
+    assert zipfile.is_zipfile(f_path)
+
+
+def test_download_trips_data_failed_cached(file_server, tmp_path):
+    """Test for download_trips_data keeping a complete cache entry when a download fails."""
+    url_stem, _ = file_server
+    zip_data_path = f'{tmp_path}/zips/'
+    (tmp_path / 'zips').mkdir()
+    url = f'{url_stem}202003-citibike-tripdata.csv.zip'
+    first = fetch_trips_zip(f'{zip_data_path}202003-citibike-tripdata.csv.zip', url,
+                            retries=1, backoff=0, timeout=5)
+    entry = {key: first[key] for key in ('url', 'size', 'md5', 'complete')}
+    expected_output = {'202003': dict(entry, etag='"s3-etag"')}
+    with open(f'{zip_data_path}manifest.json', 'w') as manifest_file:
+        json.dump(expected_output, manifest_file)
+
+    # nothing listens on the discard port, so every attempt fails
+    with pytest.raises(SystemExit):
+        download_trips_data('202003', '202003', zip_data_path, 'http://127.0.0.1:9/',
+                            '-citibike-tripdata.csv.zip', '-citibike-tripdata.csv.zip',
+                            threads=1, workers=1, chunksize=None, retries=1, backoff=0,
+                            timeout=5, output_path=str(tmp_path / 'trips.csv'),
+                            storage_format='csv', s3_bucket='bucket', s3_directory='data/')
+    with open(f'{zip_data_path}manifest.json') as manifest_file:
+        output = json.load(manifest_file)
+
+    assert output == expected_output
+
+
+def test_download_trips_data(file_server, tmp_path, monkeypatch):
+    """Test for download_trips_data happy path."""
+    url_stem, _ = file_server
+    zip_data_path = f'{tmp_path}/zips/'
+    output_path = str(tmp_path / 'trips.csv')
+    served_paths = []
+    for month in ['202003', '202004']:
+        served_paths.append(tmp_path / 'served' / f'{month}-citibike-tripdata.csv.zip')
+        with zipfile.ZipFile(served_paths[-1], 'w') as zip_f:
+            zip_f.writestr(f'{month}-citibike-tripdata.csv',
+                           raw_trips.replace('2020-03-', f'{month[:4]}-{month[4:]}-'))
+    uploads = []
+    monkeypatch.setattr(data_download_trips, 'upload_to_s3',
+                        lambda *args: uploads.append(args))
+
+    expected_output = pd.concat([aggregate_trips_zip(str(path)) for path in served_paths],
+                                ignore_index=True)
+    expected_output.date = expected_output.date.astype(str)
+
+    download_trips_data('202003', '202004', zip_data_path, url_stem,
+                        '-citibike-tripdata.csv.zip', '-citibike-tripdata.csv.zip',
+                        threads=2, workers=2, chunksize=None, retries=1, backoff=0,
+                        timeout=5, output_path=output_path, storage_format='csv',
+                        s3_bucket='bucket', s3_directory='data/')
+    output = pd.read_csv(output_path)
+    with open(f'{zip_data_path}manifest.json') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    assert expected_output.equals(output)
+    assert uploads == [(output_path, 'bucket', 'data/')]
+    assert sorted(manifest) == ['202003', '202004']
+    assert all(manifest[month]['complete'] for month in manifest)
+    assert [manifest[month]['size'] for month in sorted(manifest)] == \
+        [len(path.read_bytes()) for path in served_paths]
+
+
+def test_aggregate_trips_zip(trips_zip):
+    """Test for aggregate_trips_zip happy path."""
+    expected_output = pd.DataFrame({
+        'station_id': [72, 72, 79, 79],
+        'date': [pd.Timestamp('2020-03-01').date()] * 4,
+        'hour': [6, 7, 6, 7],
+        'inflows': [1, 2, 1, 1],
+        'outflows': [2, 1, 1, 1]})
+
+    output = aggregate_trips_zip(trips_zip)
+
+    assert expected_output.equals(output)
+
+
+def test_aggregate_trips_zip_one_sided(tmp_path):
+    """Test for aggregate_trips_zip keeping hours with flows in one direction only."""
+    zip_path = str(tmp_path / '202003-citibike-tripdata.csv.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zip_f:
+        zip_f.writestr('202003-citibike-tripdata.csv', raw_trips.splitlines()[0] + '\n'
+                       '300,2020-03-01 08:50:01.1230,2020-03-01 09:05:01.1230,72,a,0,0,83\n')
+
+    expected_output = pd.DataFrame({
+        'station_id': [72, 83],
+        'date': [pd.Timestamp('2020-03-01').date()] * 2,
+        'hour': [8, 9],
+        'inflows': [0, 1],
+        'outflows': [1, 0]})
+
+    output = aggregate_trips_zip(zip_path)
+
+    assert expected_output.equals(output)
+
+
+def test_aggregate_trips_zip_chunked(trips_zip):
+    """Test for aggregate_trips_zip streaming the month in chunks."""
+    expected_output = aggregate_trips_zip(trips_zip)
+
+    output = aggregate_trips_zip(trips_zip, chunksize=2)
+
+    assert expected_output.equals(output)
+
+
+def test_parse_trip_hours():
+    """Test for parse_trip_hours happy path."""
+    times = pd.Series(['2020-03-01 06:10:01.1230', '2016-10-01 23:59:59',
+                       '3/1/2016 06:10:01', '3/1/2016 17:10', '2016-03-01T08:00:00'])
+
+    expected_output = pd.Series(pd.to_datetime(['2020-03-01 06:00', '2016-10-01 23:00',
+                                                '2016-03-01 06:00', '2016-03-01 17:00',
+                                                '2016-03-01 08:00']))
+
+    output = parse_trip_hours(times, legacy=True)
+
+    assert expected_output.equals(output)
+
+
+def test_parse_trip_hours_invalid_day():
+    """Test for parse_trip_hours rejecting a day past the end of its month."""
+    times = pd.Series(['2019-02-28 06:10:01', '2019-02-29 06:10:01'])
+
+    with pytest.raises(ValueError):
+        parse_trip_hours(times)
+
+
+def test_parse_trip_hours_unhappy():
+    """Test for parse_trip_hours unhappy path."""
+    times = pd.Series(['2020-13-01 06:10:01', 'not a time'])
+
+    with pytest.raises(ValueError):
+        parse_trip_hours(times)
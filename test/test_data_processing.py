@@ -1,7 +1,10 @@
 """Tests for data_processing.py module."""
 import pytest
+import numpy as np
 import pandas as pd
-from src.data_processing import process_bike_data
+from src.data_processing import process_bike_data, fill_within_groups, select_new_days, \
+    replace_store_days, partition_delete_where, day_keys
+from src.stock_store import StockStore
 
 raw_trips_columns = ['station_id', 'date', 'hour', 'inflows', 'outflows']
 
@@ -76,3 +79,98 @@ def test_process_bike_data_unhappy():
     output = process_bike_data(trips, stations, 0.65)
 
     assert not output.equals(expected_output)
+
+
+def test_fill_within_groups():
+    """Test for fill_within_groups happy path."""
+    values = np.array([np.nan, 1.0, np.nan, np.nan, 5.0, np.nan])
+    group_starts = np.array([0, 0, 0, 3, 3, 5])
+    group_ends = np.array([2, 2, 2, 4, 4, 5])
+
+    expected_output = np.array([1.0, 1.0, 1.0, 5.0, 5.0, np.nan])
+
+    output = fill_within_groups(values, group_starts, group_ends)
+
+    assert np.array_equal(expected_output, output, equal_nan=True)
+
+
+def test_fill_within_groups_unhappy():
+    """Test for fill_within_groups not filling across groups."""
+    values = np.array(['W 52 St & 11 Ave', np.nan, np.nan], dtype=object)
+    group_starts = np.array([0, 1, 1])
+    group_ends = np.array([0, 2, 2])
+
+    output = fill_within_groups(values, group_starts, group_ends)
+
+    assert pd.isna(output[1:]).all()
+
+
+def test_select_new_days():
+    """Test for select_new_days happy path: the last processed day is processed again."""
+    trips = pd.DataFrame(raw_trips + [[72, '2020-03-02', 6, 1, 1], [79, '2020-03-01', 6, 1, 1]],
+                         columns=raw_trips_columns)
+    stations = pd.DataFrame(raw_stations, columns=raw_stations_columns)
+    processed = process_bike_data(trips.iloc[:len(raw_trips)], stations, 0.65)
+
+    output = select_new_days(trips, processed)
+
+    assert output.equals(trips)
+
+
+def test_select_new_days_unhappy():
+    """Test for select_new_days when only days before the last processed day remain."""
+    trips = pd.DataFrame(raw_trips + [[72, '2020-03-02', 6, 1, 1]], columns=raw_trips_columns)
+    stations = pd.DataFrame(raw_stations, columns=raw_stations_columns)
+    processed = process_bike_data(trips, stations, 0.65)
+
+    output = select_new_days(trips.iloc[:len(raw_trips)], processed)
+
+    assert output.empty
+
+
+def test_replace_store_days():
+    """Test for replace_store_days happy path: trips arriving late in a processed day."""
+    trips = pd.DataFrame(raw_trips + [[72, '2020-03-02', 6, 1, 1]], columns=raw_trips_columns)
+    stations = pd.DataFrame(raw_stations, columns=raw_stations_columns)
+    store = StockStore.from_frame(process_bike_data(trips.iloc[:4], stations, 0.65))
+    new_trips = select_new_days(trips, store.to_frame())
+
+    output = replace_store_days(store, process_bike_data(new_trips, stations, 0.65),
+                                day_keys(new_trips.station_id, new_trips.date))
+
+    expected_output = process_bike_data(trips, stations, 0.65)
+    assert output.stock.tolist() == expected_output.stock.tolist()
+    assert output.dates.tolist() == expected_output.date.values.astype('M8[h]').tolist()
+
+
+def test_replace_store_days_unhappy():
+    """Test for replace_store_days when a reprocessed day no longer yields any stock."""
+    trips = pd.DataFrame(raw_trips, columns=raw_trips_columns)
+    stations = pd.DataFrame(raw_stations, columns=raw_stations_columns)
+    processed = process_bike_data(trips, stations, 0.65)
+
+    output = replace_store_days(StockStore.from_frame(processed), processed.iloc[:0],
+                                day_keys(trips.station_id, trips.date))
+
+    assert len(output) == 0
+
+
+def test_partition_delete_where():
+    """Test for partition_delete_where happy path."""
+    partitions = pd.DataFrame({'station_id': [72, 79],
+                               'day': pd.to_datetime(['2020-02-29', '2020-03-01'])})
+
+    clause, keys = partition_delete_where(partitions)
+
+    assert '{keys}.station_id = {table}.station_id' in clause
+    expected_keys = pd.DataFrame({'station_id': np.array([72, 79], dtype=np.int64),
+                                  'day_start': pd.to_datetime(['2020-02-29', '2020-03-01']),
+                                  'day_end': pd.to_datetime(['2020-03-01', '2020-03-02'])})
+    pd.testing.assert_frame_equal(keys, expected_keys)
+
+
+def test_partition_delete_where_unhappy():
+    """Test for partition_delete_where without partitions."""
+    partitions = pd.DataFrame({'station_id': [], 'day': pd.to_datetime([])})
+
+    assert len(partition_delete_where(partitions)[1]) == 0
@@ -0,0 +1,53 @@
+"""Tests for evaluation.py module."""
+import numpy as np
+import pandas as pd
+from src.evaluation import forecast_metrics, evaluate_forecasts
+from src.stock_matrix import build_stock_matrix
+
+
+def test_forecast_metrics():
+    """Test for forecast_metrics happy path, with zero and missing observations."""
+    y_pred = np.array([[2.0, 1.0, 0.0, 5.0]])
+    y_true = np.array([[4.0, 0.0, 0.0, np.nan]])
+
+    mape, smape, mae = forecast_metrics(y_pred, y_true)
+
+    assert np.allclose(mape, [50.0])
+    assert np.allclose(smape, [(200 * 2 / 6 + 200 + 0) / 3])
+    assert np.allclose(mae, [1.0])
+
+
+def constant_forecaster(stations, origin_hours, steps):
+    """Forecasts a stock of 10 for every station, origin and step."""
+    return np.full((len(stations), len(origin_hours), steps), 10.0)
+
+
+def test_evaluate_forecasts():
+    """Test for evaluate_forecasts happy path."""
+    bike_df = pd.DataFrame({'station_id': np.repeat([72, 79], 400),
+                            'date': np.tile(pd.date_range('2021-03-01', periods=400,
+                                                          freq='H'), 2),
+                            'stock': np.r_[np.full(400, 10.0), np.full(400, 20.0)]})
+    matrix, stations, hours = build_stock_matrix(bike_df)
+
+    output = evaluate_forecasts(matrix, stations.station_id.values, hours, [79, 72, 83],
+                                constant_forecaster, [1, 12], folds=3, fold_step=24)
+
+    assert output.station_id.tolist() == [72, 72, 79, 79]
+    assert output.horizon.tolist() == [1, 12, 1, 12]
+    assert output.folds.tolist() == [3, 3, 3, 3]
+    assert np.allclose(output.MAE, [0, 0, 10, 10])
+    assert np.allclose(output.MAPE, [0, 0, 50, 50])
+
+
+def test_evaluate_forecasts_unhappy():
+    """Test for evaluate_forecasts unhappy path: too little data for any fold."""
+    bike_df = pd.DataFrame({'station_id': 72,
+                            'date': pd.date_range('2021-03-01', periods=48, freq='H'),
+                            'stock': 10.0})
+    matrix, stations, hours = build_stock_matrix(bike_df)
+
+    output = evaluate_forecasts(matrix, stations.station_id.values, hours, [72],
+                                constant_forecaster, [1, 12], folds=3, fold_step=24)
+
+    assert output.empty
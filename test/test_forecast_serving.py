@@ -0,0 +1,66 @@
+"""Tests for forecast_serving.py module."""
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import pandas as pd
+from src.forecast_serving import ForecastCache, ar1_state, forecast_from_state, \
+    save_forecast_states
+from src.model_run import model_fun
+
+
+@pytest.mark.parametrize('backend', ['arima', 'fast_ar1', 'hour_of_week'])
+def test_forecast_cache(tmp_path, backend):
+    """Test for ForecastCache reproducing the predictions of each backend."""
+    bike_df = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+    state_path = str(tmp_path / 'forecast_states.json')
+
+    predictions, _ = model_fun(bike_df, start_date_args, end_date_args, model_params,
+                               optional_fit_args, backend=backend, state_path=state_path)
+    cache = ForecastCache(state_path, maxsize=1)
+    output = [cache.predict(row.station_id, row.date, row.hour)
+              for row in predictions.itertuples()]
+
+    assert output == predictions.pred_num_bikes.tolist()
+    assert len(cache._cache) == 1
+
+
+def test_forecast_cache_unhappy(tmp_path):
+    """Test for ForecastCache unhappy path: unknown station and hour out of range."""
+    state_path = str(tmp_path / 'forecast_states.json')
+    hours = pd.date_range('2021-04-01', periods=8, freq='H')
+    save_forecast_states({72: ar1_state(1.0, 0.5, 4.0)}, hours, state_path)
+    cache = ForecastCache(state_path)
+
+    assert cache.predict(79, '2021-04-01', 0) is None
+    assert cache.predict(72, '2021-04-01', 8) is None
+    assert cache.predict(72, '2021-04-01', 0) == 3
+
+
+def test_forecast_from_state_differenced():
+    """Test for forecast_from_state undoing the differencing of the series."""
+    state = dict(ar1_state(1.0, 0.0, 0.0), levels=[10.0])
+
+    output = forecast_from_state(state, 3, pd.Timestamp('2021-04-01'))
+
+    assert output.tolist() == [11.0, 12.0, 13.0]
+
+
+def test_forecast_cache_threads(tmp_path):
+    """Test for ForecastCache shared by concurrent requests."""
+    state_path = str(tmp_path / 'forecast_states.json')
+    hours = pd.date_range('2021-04-01', periods=48, freq='H')
+    save_forecast_states({station: ar1_state(station, 0.0, 0.0) for station in range(50)},
+                         hours, state_path)
+    cache = ForecastCache(state_path, maxsize=5)
+
+    def request(station):
+        return [cache.predict(station, '2021-04-02', hour) for hour in range(24)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        output = list(pool.map(request, list(range(50)) * 4))
+
+    assert output == [[station] * 24 for station in range(50)] * 4
+    assert len(cache._cache) == 5
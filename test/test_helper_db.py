@@ -0,0 +1,123 @@
+"""Tests for helper_db.py module."""
+import pytest
+import numpy as np
+import pandas as pd
+import sqlalchemy as sql
+from src.helper_db import add_to_database
+
+
+def test_add_to_database(tmp_path):
+    """Test for add_to_database happy path, bulk loading into SQLite."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    bike_df = pd.DataFrame({'station_id': [72, 72, 79],
+                            'name': ['W 52 St & 11 Ave', 'W 52 St & 11 Ave', None],
+                            'date': pd.to_datetime(['2021-03-01 00:00', '2021-03-01 01:00',
+                                                    '2021-03-01 00:00']),
+                            'stock': [10.0, np.nan, 4.0]})
+
+    add_to_database(bike_df, 'bike_stock', 'replace', engine_string)
+    add_to_database(bike_df, 'bike_stock', 'append', engine_string)
+    output = pd.read_sql('SELECT * FROM bike_stock', engine_string, parse_dates=['date'])
+
+    expected_output = pd.concat([bike_df, bike_df], ignore_index=True)
+    pd.testing.assert_frame_equal(output, expected_output)
+
+
+def test_add_to_database_column_types(tmp_path):
+    """Test for add_to_database creating the column types of the full DataFrame."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    predictions_df = pd.DataFrame({'station_id': [72, 79],
+                                   'name': [None, 'W 52 St & 11 Ave'],
+                                   'date': pd.to_datetime(['2021-03-01', '2021-03-02']).date,
+                                   'pred_num_bikes': [3.0, 5.0]})
+
+    add_to_database(predictions_df, 'predictions', 'replace', engine_string)
+    columns = sql.inspect(sql.create_engine(engine_string)).get_columns('predictions')
+
+    assert {column['name']: type(column['type']).__name__ for column in columns} == \
+        {'station_id': 'BIGINT', 'name': 'TEXT', 'date': 'DATE', 'pred_num_bikes': 'FLOAT'}
+
+
+def test_add_to_database_unhappy(tmp_path):
+    """Test for add_to_database unhappy path: a failed load inserts no rows."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    engine = sql.create_engine(engine_string)
+    engine.execute('CREATE TABLE stations (station_id INTEGER PRIMARY KEY, name TEXT)')
+    stations_df = pd.DataFrame({'station_id': [72, 79, 72], 'name': ['a', 'b', 'c']})
+
+    with pytest.raises(SystemExit):
+        add_to_database(stations_df, 'stations', 'append', engine_string)
+
+    assert engine.execute('SELECT COUNT(*) FROM stations').scalar() == 0
+
+
+def test_add_to_database_delete(tmp_path):
+    """Test for add_to_database replacing the rows of a station's day on append."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    old_df = pd.DataFrame({'station_id': [72, 72, 79],
+                           'date': pd.to_datetime(['2021-03-01 00:00', '2021-03-02 00:00',
+                                                   '2021-03-02 00:00']),
+                           'stock': [1.0, 2.0, 3.0]})
+    new_df = pd.DataFrame({'station_id': [72, 72],
+                           'date': pd.to_datetime(['2021-03-02 00:00', '2021-03-02 01:00']),
+                           'stock': [5.0, 6.0]})
+    delete_where = ('EXISTS (SELECT 1 FROM {keys} WHERE {keys}.station_id = '
+                    '{table}.station_id AND {table}.date >= {keys}.day_start '
+                    'AND {table}.date < {keys}.day_end)',
+                    pd.DataFrame({'station_id': [72],
+                                  'day_start': pd.to_datetime(['2021-03-02']),
+                                  'day_end': pd.to_datetime(['2021-03-03'])}))
+
+    add_to_database(old_df, 'bike_stock', 'replace', engine_string)
+    add_to_database(new_df, 'bike_stock', 'append', engine_string, delete_where=delete_where)
+    output = pd.read_sql('SELECT * FROM bike_stock ORDER BY station_id, date', engine_string,
+                         parse_dates=['date'])
+
+    expected_output = pd.concat([old_df.iloc[[0]], new_df, old_df.iloc[[2]]],
+                                ignore_index=True)
+    pd.testing.assert_frame_equal(output, expected_output)
+
+
+def test_add_to_database_delete_unhappy(tmp_path):
+    """Test for add_to_database unhappy path: a failed load keeps the deleted rows."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    engine = sql.create_engine(engine_string)
+    engine.execute('CREATE TABLE stations (station_id INTEGER PRIMARY KEY, name TEXT)')
+    engine.execute("INSERT INTO stations VALUES (72, 'a')")
+    stations_df = pd.DataFrame({'station_id': [72, 72], 'name': ['b', 'c']})
+
+    with pytest.raises(SystemExit):
+        add_to_database(stations_df, 'stations', 'append', engine_string,
+                        delete_where=('station_id IN (SELECT station_id FROM {keys})',
+                                      pd.DataFrame({'station_id': [72]})))
+
+    assert engine.execute('SELECT name FROM stations').fetchall() == [('a',)]
+
+
+def test_add_to_database_replace(tmp_path):
+    """Test for add_to_database replacing a table through a staging table."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    old_df = pd.DataFrame({'station_id': [72], 'pred_num_bikes': [3]})
+    new_df = pd.DataFrame({'station_id': [72, 79], 'pred_num_bikes': [5, 8]})
+
+    add_to_database(old_df, 'predictions', 'replace', engine_string)
+    add_to_database(new_df, 'predictions', 'replace', engine_string)
+
+    pd.testing.assert_frame_equal(pd.read_sql('SELECT * FROM predictions', engine_string),
+                                  new_df)
+    assert sql.inspect(sql.create_engine(engine_string)).get_table_names() == ['predictions']
+
+
+def test_add_to_database_replace_unhappy(tmp_path):
+    """Test for add_to_database unhappy path: a failed replace keeps the old table."""
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'msia423_db.db')
+    old_df = pd.DataFrame({'station_id': [72], 'pred_num_bikes': [3]})
+    bad_df = pd.DataFrame({'station_id': [72], 'pred_num_bikes': [{'bikes': 5}]})
+
+    add_to_database(old_df, 'predictions', 'replace', engine_string)
+    with pytest.raises(SystemExit):
+        add_to_database(bad_df, 'predictions', 'replace', engine_string)
+
+    pd.testing.assert_frame_equal(pd.read_sql('SELECT * FROM predictions', engine_string),
+                                  old_df)
+    assert sql.inspect(sql.create_engine(engine_string)).get_table_names() == ['predictions']
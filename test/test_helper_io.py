@@ -0,0 +1,95 @@
+"""Tests for helper_io.py module."""
+import pytest
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from src.helper_io import table_path, write_table, append_table, read_table
+
+trips_columns = ['station_id', 'date', 'hour', 'inflows', 'outflows']
+
+trips_march = [[72, '2020-03-01', 6, 1, 3],
+               [72, '2020-03-01', 9, 6, 3]]
+
+trips_april = [[72, '2020-04-01', 10, 2, 4],
+               [79, '2020-04-01', 11, 2, 2]]
+
+
+def test_table_path():
+    """Test for table_path happy path."""
+    expected_output = 'data/trips.parquet'
+
+    output = table_path('data/trips.csv', 'parquet')
+
+    assert expected_output == output
+
+
+def test_table_path_unhappy():
+    """Test for table_path unhappy path."""
+    with pytest.raises(ValueError):
+        table_path('data/trips.csv', 'xlsx')
+
+
+def test_write_table(tmp_path):
+    """Test for write_table round trip through Parquet with one row group per frame."""
+    frames = [pd.DataFrame(trips_march, columns=trips_columns),
+              pd.DataFrame(trips_april, columns=trips_columns)]
+    path = str(tmp_path / 'trips.parquet')
+
+    expected_output = pd.concat(frames, ignore_index=True)
+
+    write_table(frames, path, 'parquet')
+    output = read_table(path)
+
+    assert expected_output.equals(output)
+    assert pq.ParquetFile(path).num_row_groups == 2
+
+
+def test_write_table_unhappy(tmp_path):
+    """Test for write_table unhappy path."""
+    frame = pd.DataFrame(trips_march, columns=trips_columns)
+
+    with pytest.raises(ValueError):
+        write_table(frame, str(tmp_path / 'trips.xlsx'), 'xlsx')
+
+
+@pytest.mark.parametrize('storage_format', ['csv', 'parquet'])
+def test_append_table(tmp_path, storage_format):
+    """Test for append_table adding rows to an existing dataset."""
+    march = pd.DataFrame(trips_march, columns=trips_columns)
+    april = pd.DataFrame(trips_april, columns=trips_columns)
+    path = table_path(str(tmp_path / 'trips.csv'), storage_format)
+
+    expected_output = pd.concat([march, april], ignore_index=True)
+
+    write_table(march, path, storage_format)
+    append_table(april[trips_columns[::-1]], path, storage_format)
+    output = read_table(path)
+
+    assert expected_output.equals(output)
+
+
+@pytest.mark.parametrize('storage_format', ['csv', 'parquet'])
+def test_append_table_replaced(tmp_path, storage_format):
+    """Test for append_table replacing existing rows across row groups."""
+    march = pd.DataFrame(trips_march, columns=trips_columns)
+    april = pd.DataFrame(trips_april, columns=trips_columns)
+    update = pd.DataFrame([[72, '2020-04-01', 10, 5, 5]], columns=trips_columns)
+    path = table_path(str(tmp_path / 'trips.csv'), storage_format)
+
+    expected_output = pd.concat([march.iloc[:1], april.iloc[1:], update], ignore_index=True)
+
+    write_table([march, april], path, storage_format)
+    append_table(update, path, storage_format, replaced=np.array([False, True, True, False]))
+    output = read_table(path)
+
+    assert expected_output.equals(output)
+
+
+def test_append_table_unhappy(tmp_path):
+    """Test for append_table unhappy path."""
+    frame = pd.DataFrame(trips_march, columns=trips_columns)
+    path = str(tmp_path / 'trips.xlsx')
+    open(path, 'w').close()
+
+    with pytest.raises(ValueError):
+        append_table(frame, path, 'xlsx')
@@ -0,0 +1,109 @@
+"""Tests for helper_s3.py module."""
+import pytest
+import boto3
+import pandas as pd
+from moto import mock_s3
+import src.helper_s3 as hs
+
+bucket = 'test-citibikes-bucket'
+
+stations = pd.DataFrame({'station_id': [72, 79],
+                         'name': ['W 52 St & 11 Ave', 'Franklin St & W Broadway']})
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    """Creates an empty bucket in a local S3 stand-in."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_s3():
+        hs.get_s3_client.cache_clear()
+        boto3.client('s3').create_bucket(Bucket=bucket)
+        yield boto3.client('s3')
+    hs.get_s3_client.cache_clear()
+
+
+def test_get_s3_client(s3_bucket):
+    """Test for get_s3_client keeping a connection per concurrently uploaded part."""
+    assert hs.get_s3_client().meta.config.max_pool_connections == \
+        hs.UPLOAD_WORKERS * hs.TRANSFER_CONFIG.max_concurrency
+
+
+def test_upload_many_to_s3(s3_bucket, tmp_path):
+    """Test for upload_many_to_s3 happy path."""
+    paths = []
+    for name in ['predictions.csv', 'predictions_mape.csv', 'avg_mape.csv']:
+        paths.append(str(tmp_path / name))
+        stations.to_csv(paths[-1], index=False)
+
+    expected_output = ['data/avg_mape.csv', 'data/predictions.csv', 'data/predictions_mape.csv']
+
+    hs.upload_many_to_s3(paths, bucket, 'data/')
+    output = sorted(obj['Key'] for obj in s3_bucket.list_objects_v2(Bucket=bucket)['Contents'])
+
+    assert expected_output == output
+
+
+def test_read_csv_s3(s3_bucket):
+    """Test for read_csv_s3 streaming a .csv file."""
+    s3_bucket.put_object(Bucket=bucket, Key='data/stations.csv',
+                         Body=stations.to_csv(index=False).encode())
+
+    output = hs.read_csv_s3(bucket, 'data/', 'stations.csv')
+
+    assert stations.equals(output)
+
+
+def test_read_csv_s3_unhappy(s3_bucket):
+    """Test for read_csv_s3 unhappy path."""
+    with pytest.raises(SystemExit):
+        hs.read_csv_s3(bucket, 'data/', 'missing.csv')
+
+
+def test_download_csv_s3(s3_bucket, tmp_path):
+    """Test for download_csv_s3 happy path."""
+    s3_bucket.put_object(Bucket=bucket, Key='data/stations.csv',
+                         Body=stations.to_csv(index=False).encode())
+    output_filename = str(tmp_path / 'stations.csv')
+
+    output = hs.download_csv_s3(bucket, 'data/', 'stations.csv', output_filename)
+
+    assert stations.equals(output)
+    assert stations.equals(pd.read_csv(output_filename))
+
+
+def test_download_csv_s3_skip_unchanged(s3_bucket, tmp_path):
+    """Test for download_csv_s3 reusing an unchanged local copy."""
+    output_filename = str(tmp_path / 'stations.csv')
+    stations.to_csv(output_filename, index=False)
+    hs.upload_to_s3(output_filename, bucket, 'data/')
+    saved_before = hs.SYNC_STATS['bytes_saved']
+
+    output = hs.download_csv_s3(bucket, 'data/', 'stations.csv', output_filename,
+                                skip_unchanged=True)
+
+    assert stations.equals(output)
+    assert hs.SYNC_STATS['bytes_saved'] - saved_before == (tmp_path / 'stations.csv').stat().st_size
+
+
+def test_is_unchanged_multipart(s3_bucket, tmp_path, monkeypatch):
+    """Test for is_unchanged against an object uploaded in several parts."""
+    monkeypatch.setattr(hs.TRANSFER_CONFIG, 'multipart_threshold', 5 * 1024 ** 2)
+    monkeypatch.setattr(hs.TRANSFER_CONFIG, 'multipart_chunksize', 5 * 1024 ** 2)
+    path = tmp_path / 'bike_stock.csv'
+    path.write_bytes(b'0123456789' * 1024 ** 2)
+    hs.upload_to_s3(str(path), bucket, 'data/')
+
+    assert '-' in s3_bucket.head_object(Bucket=bucket, Key='data/bike_stock.csv')['ETag']
+    assert hs.is_unchanged(str(path), bucket, 'data/bike_stock.csv')
+
+
+def test_is_unchanged_unhappy(s3_bucket, tmp_path):
+    """Test for is_unchanged detecting a modified local file."""
+    path = tmp_path / 'stations.csv'
+    stations.to_csv(path, index=False)
+    hs.upload_to_s3(str(path), bucket, 'data/')
+    stations.iloc[::-1].to_csv(path, index=False)
+
+    assert not hs.is_unchanged(str(path), bucket, 'data/stations.csv')
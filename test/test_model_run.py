@@ -1,7 +1,15 @@
 """Tests for model_run.py module."""
+import os
+import functools
 import pytest
+import numpy as np
 import pandas as pd
+from src import model_run
 from src.model_run import model_fun
+from src.stock_store import StockStore
+from src.stock_matrix import build_stock_matrix
+from src.evaluation import evaluate_forecasts
+from src.forecast_serving import ar1_state, load_forecast_states
 
 
 def test_model_fun():
@@ -68,3 +76,343 @@ def test_model_fun_unhappy():
                              model_params, optional_fit_args)
 
     assert not expected_output.equals(output), expected_mape.equals(mape)
+
+
+def exit_worker(*args):
+    """Ends the worker process running it, breaking its process pool."""
+    os._exit(1)
+
+
+def test_model_fun_workers():
+    """Test for model_fun training station models in a process pool."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe, dataframe.assign(station_id=79)])
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    expected_output, expected_mape = model_fun(dataframe, start_date_args, end_date_args,
+                                               model_params, optional_fit_args)
+
+    output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                             model_params, optional_fit_args, workers=2, chunk_size=1)
+
+    assert expected_output.equals(output)
+    assert expected_mape.equals(mape)
+
+
+@pytest.mark.parametrize('workers,chunk_size', [(2, 1), (2, 2), (1, 2)])
+def test_model_fun_workers_unhappy(tmp_path, monkeypatch, workers, chunk_size):
+    """Test for model_fun isolating a station that raises an unexpected error."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe,
+                           dataframe.assign(station_id=79, stock=dataframe.stock + 1000)])
+    store_path = str(tmp_path / 'bike_stock_store.npy')
+    StockStore.from_frame(dataframe).save(store_path)
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+    fit_station = model_run.fit_station
+
+    def fit_or_fail(y_var, *args):
+        if y_var.iloc[0] >= 1000:
+            raise IndexError('index out of bounds')
+        return fit_station(y_var, *args)
+
+    # the worker processes are forked after the patch, so they see it
+    monkeypatch.setattr(model_run, 'fit_station', fit_or_fail)
+
+    output, mape = model_fun(StockStore.open(store_path), start_date_args, end_date_args,
+                             model_params, optional_fit_args, workers=workers,
+                             chunk_size=chunk_size)
+
+    assert list(mape.Station) == [72]
+    assert output.station_id.unique().tolist() == [72]
+
+
+def test_model_fun_workers_broken(tmp_path, monkeypatch):
+    """Test for model_fun isolating a worker process that dies."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe, dataframe.assign(station_id=79)])
+    store_path = str(tmp_path / 'bike_stock_store.npy')
+    StockStore.from_frame(dataframe).save(store_path)
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+    monkeypatch.setattr(model_run, 'fit_store_chunk', exit_worker)
+
+    output, mape = model_fun(StockStore.open(store_path), start_date_args, end_date_args,
+                             model_params, optional_fit_args, workers=2, chunk_size=1)
+
+    assert mape.empty
+    assert output.empty
+
+
+def test_model_fun_failed_station():
+    """Test for model_fun leaving out a station whose model cannot be fit."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe.assign(station_id=71, stock=1.0), dataframe])
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                             model_params, optional_fit_args)
+
+    assert list(mape.Station) == [72]
+    assert output.station_id.unique().tolist() == [72]
+
+
+def test_model_fun_nonfinite_station(monkeypatch):
+    """Test for model_fun leaving out a station whose forecasts are not finite."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe.assign(station_id=71), dataframe])
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    def train_nan_71(station_series, forecast_hours, settings):
+        return [(station, mape_val, forecasts * np.nan if station == 71 else forecasts,
+                 fit_info)
+                for station, mape_val, forecasts, fit_info
+                in model_run.train_fast_ar1(station_series, forecast_hours, settings)]
+    monkeypatch.setitem(model_run.MODEL_BACKENDS, 'fast_ar1', train_nan_71)
+
+    output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                             model_params, optional_fit_args, backend='fast_ar1')
+
+    assert list(mape.Station) == [72]
+    assert output.station_id.unique().tolist() == [72]
+
+
+def test_model_fun_fast_ar1():
+    """Test for model_fun fast_ar1 backend against the statsmodels css-mle fit."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe.assign(station_id=71, stock=1.0), dataframe])
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 3, 'hour': 0, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    expected_output, expected_mape = model_fun(dataframe, start_date_args, end_date_args,
+                                               model_params, optional_fit_args)
+
+    output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                             model_params, optional_fit_args, backend='fast_ar1')
+
+    assert expected_output[['station_id', 'date', 'hour']].equals(
+        output[['station_id', 'date', 'hour']])
+    assert (expected_output.pred_num_bikes - output.pred_num_bikes).abs().max() <= 1
+    assert list(mape.Station) == [72]
+    assert abs(expected_mape.MAPE[0] - mape.MAPE[0]) < 1
+
+
+def test_model_fun_fast_ar1_unhappy():
+    """Test for model_fun fast_ar1 backend unhappy path."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 2, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    with pytest.raises(ValueError):
+        model_fun(dataframe, start_date_args, end_date_args,
+                  model_params, optional_fit_args, backend='fast_ar1')
+
+
+def test_model_fun_holdout_filter():
+    """Test for model_fun evaluating the holdout with the full-fit parameters."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    expected_output, expected_mape = model_fun(dataframe, start_date_args, end_date_args,
+                                               model_params, optional_fit_args)
+
+    for holdout_fit in ['warm_start', 'filter']:
+        output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                                 model_params, optional_fit_args, holdout_fit=holdout_fit,
+                                 holdout_tolerance=0.5)
+
+        assert expected_output.equals(output)
+        assert abs(expected_mape.MAPE[0] - mape.MAPE[0]) < 0.5
+
+
+def test_model_fun_holdout_filter_unhappy():
+    """Test for model_fun holdout evaluation unhappy path."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    with pytest.raises(ValueError):
+        model_fun(dataframe, start_date_args, end_date_args,
+                  model_params, optional_fit_args, holdout_fit='skip')
+
+
+def test_model_fun_registry(tmp_path):
+    """Test for model_fun reusing and warm-starting models from the registry."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    dataframe = pd.concat([dataframe, dataframe.assign(station_id=79)])
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+    registry_path = str(tmp_path / 'model_registry.parquet')
+
+    expected_output, expected_mape = model_fun(dataframe, start_date_args, end_date_args,
+                                               model_params, optional_fit_args,
+                                               registry_path=registry_path)
+    fitted = pd.read_parquet(registry_path)
+
+    # station 79 gets a new hour of data, station 72 is unchanged
+    new_hour = dataframe.iloc[[-1]].assign(date='2021-03-31 23:00:00')
+    output, mape = model_fun(pd.concat([dataframe, new_hour]), start_date_args,
+                             end_date_args, model_params, optional_fit_args,
+                             registry_path=registry_path)
+    refitted = pd.read_parquet(registry_path)
+
+    assert expected_output[expected_output.station_id == 72].equals(
+        output[output.station_id == 72])
+    assert expected_mape.MAPE[0] == mape.MAPE[0]
+    assert refitted.fitted_at[0] == fitted.fitted_at[0]
+    assert refitted.fingerprint[1] != fitted.fingerprint[1]
+    assert refitted.converged.all()
+
+
+def test_model_fun_registry_unhappy(tmp_path):
+    """Test for model_fun refitting all stations when the model settings change."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+    registry_path = str(tmp_path / 'model_registry.parquet')
+
+    model_fun(dataframe, start_date_args, end_date_args, model_params,
+              optional_fit_args, registry_path=registry_path)
+    fitted = pd.read_parquet(registry_path)
+    model_fun(dataframe, start_date_args, end_date_args, {'p': 2, 'd': 0, 'q': 0},
+              optional_fit_args, registry_path=registry_path)
+    refitted = pd.read_parquet(registry_path)
+
+    assert len(refitted.params[0]) == len(fitted.params[0]) + 1
+    assert refitted.model_key[0] != fitted.model_key[0]
+
+
+def test_model_fun_hour_of_week():
+    """Test for model_fun hour_of_week backend on a weekly periodic stock."""
+
+    dates = pd.date_range('2021-03-01', '2021-03-29', freq='H', closed='left')
+    dataframe = pd.DataFrame({'station_id': 72, 'date': dates,
+                              'stock': 10.0 + dates.dayofweek * 24 + dates.hour})
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    # April 1, 2021 was a Thursday
+    expected_output = list(10 + 3 * 24 + np.arange(8))
+
+    output, mape = model_fun(dataframe, start_date_args, end_date_args,
+                             model_params, optional_fit_args, backend='hour_of_week')
+
+    assert output.pred_num_bikes.tolist() == expected_output
+    assert mape.MAPE[0] == 0
+
+
+def test_model_fun_hour_of_week_unhappy():
+    """Test for model_fun with an unknown backend."""
+
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    with pytest.raises(ValueError):
+        model_fun(dataframe, start_date_args, end_date_args,
+                  model_params, optional_fit_args, backend='holt_winters')
+
+
+@pytest.mark.parametrize('backend, state', [
+    ('arima', ar1_state(20.0, -1.0, 0.0)),
+    ('arima', {'kind': 'arma', 'intercept': 0.0, 'ar': [-1.0], 'ma': [0.0],
+               'history': [], 'resid': [], 'levels': [0.0]}),
+    ('fast_ar1', None),
+    ('hour_of_week', None)])
+def test_model_backtests(backend, state):
+    """Test for the backtest hooks forecasting from the values before each origin."""
+    dates = pd.date_range('2021-03-01', periods=400, freq='H')
+    bike_df = pd.DataFrame({'station_id': 72, 'date': dates,
+                            'stock': 10.0 + (-1.0) ** np.arange(400) + 10 * (dates >= dates[376])})
+    bike_df = bike_df.drop([100, 101])
+    matrix, stations, hours = build_stock_matrix(bike_df)
+    store = StockStore.from_frame(bike_df)
+
+    output = evaluate_forecasts(matrix, stations.station_id.values, hours, [72],
+                                functools.partial(model_run.MODEL_BACKTESTS[backend], store,
+                                                  {72: state}),
+                                [24], folds=2, fold_step=24)
+
+    assert output.folds.tolist() == [2]
+    assert np.allclose(output.MAE, 5.0)
+
+
+def test_model_backtests_unhappy():
+    """Test for the backtest hooks on a station without data before the origins."""
+    dates = pd.date_range('2021-03-01', periods=400, freq='H')
+    bike_df = pd.DataFrame({'station_id': np.repeat([72, 79], [400, 20]),
+                            'date': np.r_[dates, dates[-20:]], 'stock': 10.0})
+    store = StockStore.from_frame(bike_df)
+
+    output = model_run.backtest_arima(store, {72: ar1_state(5.0, 0.5, 10.0),
+                                              79: ar1_state(5.0, 0.5, 10.0)},
+                                      [72, 79], dates.values[[-48, -24]], 24)
+
+    assert np.allclose(output[0], 10.0)
+    assert np.isnan(output[1]).all()
+
+
+def test_model_backtests_backends(tmp_path):
+    """Test for the backtest of different backends giving different metrics."""
+    dataframe = pd.read_csv('data/sample/sample_bike_stock.csv')
+    store = StockStore.from_frame(dataframe)
+    matrix, stations, hours = build_stock_matrix(dataframe)
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    metrics = {}
+    for backend in ['arima', 'fast_ar1']:
+        state_path = str(tmp_path / f'{backend}.json')
+        model_fun(store, start_date_args, end_date_args, model_params, optional_fit_args,
+                  backend=backend, state_path=state_path)
+        metrics[backend] = evaluate_forecasts(
+            matrix, stations.station_id.values, hours, [72],
+            functools.partial(model_run.MODEL_BACKTESTS[backend], store,
+                              load_forecast_states(state_path)[2]),
+            [1, 12], folds=7, fold_step=24)
+
+    assert metrics['arima'].station_id.tolist() == metrics['fast_ar1'].station_id.tolist()
+    assert not np.allclose(metrics['arima'].MAE, metrics['fast_ar1'].MAE)
@@ -0,0 +1,76 @@
+"""Tests for stock_matrix.py module."""
+import pytest
+import numpy as np
+import pandas as pd
+from src.stock_matrix import build_stock_matrix, save_stock_matrix, load_stock_matrix, \
+    extend_stock_matrix
+
+
+def test_build_stock_matrix():
+    """Test for build_stock_matrix happy path."""
+    bike_df = pd.read_csv('data/sample/sample_bike_stock.csv', parse_dates=['date'])
+
+    matrix, stations, hours = build_stock_matrix(bike_df)
+    rows = np.searchsorted(stations.station_id.values, bike_df.station_id.values)
+    cols = hours.get_indexer(bike_df.date)
+
+    assert matrix.dtype == np.float32
+    assert matrix.shape == (len(stations), len(hours))
+    assert np.array_equal(matrix[rows, cols], bike_df.stock.values.astype(np.float32))
+    assert np.isnan(matrix).sum() == matrix.size - len(bike_df)
+
+
+def test_load_stock_matrix(tmp_path):
+    """Test for load_stock_matrix round trip through a memory-mapped .npy file."""
+    bike_df = pd.read_csv('data/sample/sample_bike_stock.csv', parse_dates=['date'])
+    matrix, stations, hours = build_stock_matrix(bike_df)
+    matrix_path = str(tmp_path / 'bike_stock_matrix.npy')
+
+    save_stock_matrix(matrix, stations, hours, matrix_path)
+    output, output_stations, output_hours = load_stock_matrix(matrix_path)
+
+    assert isinstance(output, np.memmap)
+    assert np.array_equal(matrix, output, equal_nan=True)
+    assert hours.equals(output_hours)
+    pd.testing.assert_frame_equal(output_stations, stations)
+
+
+def test_load_stock_matrix_unhappy(tmp_path):
+    """Test for load_stock_matrix unhappy path."""
+    with pytest.raises(FileNotFoundError):
+        load_stock_matrix(str(tmp_path / 'missing.npy'))
+
+
+def test_extend_stock_matrix():
+    """Test for extend_stock_matrix replacing a day and adding a station."""
+    dates = pd.date_range('2021-03-01 06:00', periods=48, freq='H')
+    old_df = pd.DataFrame({'station_id': 72, 'date': dates, 'stock': 1.0})
+    new_df = pd.DataFrame({'station_id': np.repeat([72, 79], [20, 5]),
+                           'date': np.r_[dates[18:38], dates[18:23]], 'stock': 2.0})
+    matrix, stations, hours = build_stock_matrix(old_df)
+
+    output, output_stations, output_hours = extend_stock_matrix(
+        matrix, stations, hours, new_df, np.array([72, 79]),
+        np.array(['2021-03-02', '2021-03-02'], dtype='M8[D]'))
+
+    # station 72's hours of March 2 after 13:00 are gone with the replaced day
+    kept = old_df.date.dt.normalize() != '2021-03-02'
+    expected_df = pd.concat([old_df[kept], new_df]).sort_values(['station_id', 'date'])
+    expected, expected_stations, expected_hours = build_stock_matrix(expected_df)
+    assert np.array_equal(output, expected, equal_nan=True)
+    assert output_stations.equals(expected_stations)
+    assert output_hours.equals(expected_hours)
+
+
+def test_extend_stock_matrix_unhappy():
+    """Test for extend_stock_matrix without new stock: the replaced days are cleared."""
+    dates = pd.date_range('2021-03-01', periods=48, freq='H')
+    matrix, stations, hours = build_stock_matrix(pd.DataFrame({'station_id': 72,
+                                                               'date': dates, 'stock': 1.0}))
+
+    output, _, output_hours = extend_stock_matrix(
+        matrix, stations, hours, pd.DataFrame(columns=['station_id', 'date', 'stock']),
+        np.array([72, 83]), np.array(['2021-03-02', '2021-03-02'], dtype='M8[D]'))
+
+    assert output_hours.equals(hours)
+    assert np.isnan(output[0, 24:]).all() and (output[0, :24] == 1).all()
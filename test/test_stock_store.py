@@ -0,0 +1,86 @@
+"""Tests for stock_store.py module."""
+import pytest
+import numpy as np
+import pandas as pd
+from src.stock_store import StockStore
+from src.model_run import model_fun
+
+
+def test_stock_store_from_frame():
+    """Test for StockStore.from_frame happy path."""
+    bike_df = pd.DataFrame({'station_id': [79, 72, 79, 72],
+                            'date': pd.to_datetime(['2021-03-01 01:00', '2021-03-01 00:00',
+                                                    '2021-03-01 00:00', '2021-03-01 01:00']),
+                            'stock': [4.0, 10.0, 5.0, 11.0]})
+
+    store = StockStore.from_frame(bike_df)
+
+    assert len(store) == 2
+    assert np.array_equal(store.series(72), [10.0, 11.0])
+    assert np.array_equal(store.series(79), [5.0, 4.0])
+    assert store.station_dates(79)[0] == np.datetime64('2021-03-01T00', 'h')
+
+
+def test_stock_store_open(tmp_path):
+    """Test for StockStore.open round trip through memory-mapped .npy files."""
+    bike_df = pd.read_csv('data/sample/sample_bike_stock.csv', parse_dates=['date'])
+    store_path = str(tmp_path / 'bike_stock_store.npy')
+
+    StockStore.from_frame(bike_df).save(store_path)
+    output = StockStore.open(store_path)
+
+    assert isinstance(output.stock, np.memmap)
+    assert 72 in output
+    assert np.array_equal(output.series(72),
+                          bike_df.loc[bike_df.station_id == 72, 'stock'].values)
+
+
+def test_stock_store_open_unhappy(tmp_path):
+    """Test for StockStore.open unhappy path."""
+    with pytest.raises(FileNotFoundError):
+        StockStore.open(str(tmp_path / 'missing.npy'))
+
+
+def test_model_fun_stock_store(tmp_path):
+    """Test for model_fun reading station series from a memory-mapped store."""
+    bike_df = pd.read_csv('data/sample/sample_bike_stock.csv')
+    store_path = str(tmp_path / 'bike_stock_store.npy')
+    StockStore.from_frame(bike_df).save(store_path)
+    start_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 0, 'minute': 00}
+    end_date_args = {'year': 2021, 'month': 4, 'day': 1, 'hour': 8, 'minute': 00}
+    model_params = {'p': 1, 'd': 0, 'q': 0}
+    optional_fit_args = {'trend': 'c', 'method': 'css-mle', 'solver': 'lbfgs'}
+
+    expected_output, expected_mape = model_fun(bike_df, start_date_args, end_date_args,
+                                               model_params, optional_fit_args)
+    output, mape = model_fun(StockStore.open(store_path), start_date_args, end_date_args,
+                             model_params, optional_fit_args)
+
+    assert expected_output.equals(output)
+    assert np.allclose(expected_mape.MAPE, mape.MAPE)
+
+
+def test_stock_store_to_frame():
+    """Test for StockStore.to_frame round trip."""
+    bike_df = pd.DataFrame({'station_id': [72, 72, 79],
+                            'date': pd.to_datetime(['2021-03-01 00:00', '2021-03-01 02:00',
+                                                    '2021-03-01 01:00']),
+                            'stock': [10.0, 12.0, 4.0]})
+
+    output = StockStore.from_frame(bike_df).to_frame()
+
+    pd.testing.assert_frame_equal(output, bike_df)
+
+
+def test_stock_store_ends_before():
+    """Test for StockStore.rows and ends_before happy path."""
+    bike_df = pd.DataFrame({'station_id': [79, 72, 72, 79],
+                            'date': pd.to_datetime(['2021-03-01 02:00', '2021-03-01 00:00',
+                                                    '2021-03-01 03:00', '2021-03-01 00:00']),
+                            'stock': [1.0, 2.0, 3.0, 4.0]})
+    store = StockStore.from_frame(bike_df)
+
+    ends = store.ends_before(np.datetime64('2021-03-01T02'))
+
+    assert store.rows([79, 72]).tolist() == [1, 0]
+    assert ends.tolist() == [1, 3]